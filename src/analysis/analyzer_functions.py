@@ -1,35 +1,51 @@
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
 from tqdm import tqdm
 import emoji
+import functools
+import numpy as np
 import pandas as pd
-import spacy
 import requests
+import scipy.sparse
 import json
+import re
+import time
+from urllib.parse import urlsplit
 
+from helpers.instrumentation import METRICS
+from nlp_resources import (
+    get_language_profiles,
+    get_nlp,
+    get_stop_words,
+    get_word_tokenizer,
+)
 
-nlp = spacy.load("en_core_web_sm")
-stop_words = set(stopwords.words("english"))
+LIBRE_TRANSLATE_URL = "http://127.0.0.1:5000/translate"
 
-nltk.download("vader_lexicon")
-nltk.download("punkt")
-nltk.download("wordnet")
-nltk.download("stopwords")
-nltk.download("averaged_perceptron_tagger")
+# probability of a trigram missing from a language profile
+TRIGRAM_SMOOTHING = 1e-5
+# key of a free slot of the trigram hash table, packed trigrams use 63 bits
+EMPTY_KEY = np.uint64(2**64 - 1)
+# mean log-likelihood per trigram of English over the most likely other language
+# above which a text counts as English; above zero English is the most likely
+# language, the rest keeps short headlines in languages with little training
+# text, e.g. Norwegian or Romanian, out
+ENGLISH_MARGIN = 0.4
+# shorter texts, about two words, are left to LibreTranslate
+MIN_TRIGRAMS = 8
 
 
-def libre_translate(text):
+def libre_translate(text, url=LIBRE_TRANSLATE_URL):
     """
     Detect language of a title using LibreTranslate API
     """
+    start = time.perf_counter()
     try:
         # Send a POST request to the LibreTranslate API
         response = requests.post(
-            "http://127.0.0.1:5000/translate",
+            url,
             headers={"Content-Type": "application/json"},
             data=json.dumps({"q": text, "source": "auto", "target": "en"}),
         )
+        METRICS.record_response(response, time.perf_counter() - start)
 
         # If the request was successful, get the detected language
         if response.status_code == 200:
@@ -37,15 +53,69 @@ def libre_translate(text):
         else:
             return "error"
     except Exception as e:
+        elapsed = time.perf_counter() - start
+        METRICS.record_request(urlsplit(url).netloc, elapsed, type(e).__name__)
         print(f"Error detecting language for text: '{text}': {e}")
         return "error"
 
 
+def build_emoji_pattern():
+    """
+    Compile one regex matching what emoji.replace_emoji removes, with the code
+    points of single character emojis collapsed into ranges
+    """
+    code_points = sorted(ord(e) for e in emoji.EMOJI_DATA if len(e) == 1)
+    ranges = []
+    for code_point in code_points:
+        if ranges and code_point == ranges[-1][1] + 1:
+            ranges[-1][1] = code_point
+        else:
+            ranges.append([code_point, code_point])
+    char_class = "".join(
+        re.escape(chr(first)) + ("-" + re.escape(chr(last)) if last > first else "")
+        for first, last in ranges
+    )
+
+    # flags are pairs of regional indicators, grouped by the first, and tag
+    # sequences after a black flag; neither part is an emoji on its own
+    flag_pairs = {}
+    for e in emoji.EMOJI_DATA:
+        if len(e) == 2 and all("\U0001f1e6" <= c <= "\U0001f1ff" for c in e):
+            flag_pairs.setdefault(e[0], []).append(e[1])
+    tag_flags = [e for e in emoji.EMOJI_DATA if "\U000e0020" <= e[-1] <= "\U000e007f"]
+    emoji_unit = "|".join(
+        [
+            *map(re.escape, sorted(tag_flags, key=len, reverse=True)),
+            "[" + char_class + "]",
+            *(
+                re.escape(first) + "[" + "".join(sorted(seconds)) + "]"
+                for first, seconds in sorted(flag_pairs.items())
+            ),
+        ]
+    )
+
+    # a zero width joiner only goes with the emoji right before it, or after its
+    # variation selector if another emoji follows; elsewhere, e.g. in Indic
+    # scripts, it is kept. Variation selectors are removed everywhere.
+    # Checking the first character up front keeps the alternatives off text.
+    unit = "(?:" + emoji_unit + ")"
+    return re.compile(
+        r"(?=[#*0-9\ufe0e\ufe0f\U0001f1e6-\U0001f1ff" + char_class + "])"
+        r"(?:[#*0-9]\ufe0f?\u20e3"
+        rf"|(?:{unit}(?:\ufe0f\u200d(?={unit})|\u200d)?)+"
+        r"|[\ufe0e\ufe0f]+)"
+    )
+
+
+emoji_pattern = build_emoji_pattern()
+
+
 def remove_stopwords(text):
     """
-    Remove stopwords from the text
+    Remove stopwords from the text, tokenized exactly like word_tokenize
     """
-    word_tokens = word_tokenize(text)
+    stop_words = get_stop_words()
+    word_tokens = get_word_tokenizer()(text)
     removed_text = [word for word in word_tokens if word not in stop_words]
     return " ".join(removed_text)
 
@@ -57,14 +127,218 @@ def get_lemma(text):
     if type(text) is list:
         text = " ".join(text)
 
-    text = nlp(text)
-    lemmatized = [token.lemma_ for token in nlp(text)]
+    lemmatized = [token.lemma_ for token in get_nlp()(text)]
 
     return " ".join(lemmatized)
 
 
+def get_lemma_batch(texts, batch_size=1000, n_process=1):
+    """
+    Lemmatize a Series or iterable of texts with nlp.pipe, aligned to the input index
+    """
+    if not isinstance(texts, pd.Series):
+        texts = pd.Series(list(texts), dtype=object)
+
+    mask = texts.notnull()
+    docs = (" ".join(text) if type(text) is list else str(text) for text in texts[mask])
+
+    nlp = get_nlp()
+    with METRICS.stage("get_lemma_batch", int(mask.sum())):
+        lemmatized = [
+            " ".join(token.lemma_ for token in doc)
+            for doc in nlp.pipe(docs, batch_size=batch_size, n_process=n_process)
+        ]
+
+    result = pd.Series(pd.NA, index=texts.index, dtype=object)
+    result[mask] = lemmatized
+
+    return result
+
+
 def remove_emojis(text):
     """
     Remove emojis from the text
     """
-    return emoji.replace_emoji(text, replace="")
+    # only keycaps contain ASCII, and those need the non-ASCII U+20E3
+    if text.isascii():
+        return text
+    return emoji_pattern.sub("", text)
+
+
+non_letter_pattern = re.compile(r"[\W\d_]+")
+
+
+def pack_trigrams(codes):
+    """
+    Pack each character trigram of an array of code points into one integer,
+    21 bits per code point, so equal keys mean equal trigrams
+    """
+    codes = codes.astype(np.uint64)
+    return codes[:-2] << np.uint64(42) | codes[1:-1] << np.uint64(21) | codes[2:]
+
+
+def to_code_points(text):
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+
+def hash_trigrams(keys, bits):
+    """
+    Slot of each trigram key in a hash table of 2**bits slots
+    """
+    hashes = keys * np.uint64(0x9E3779B97F4A7C15)
+    return (hashes >> np.uint64(64 - bits)).astype(np.intp)
+
+
+def build_trigram_model(profiles):
+    """
+    The languages of the profiles, a hash table from trigram key to row and the
+    log probabilities of each row's trigram in the languages; row 0 stands for
+    all trigrams missing from the profiles.
+
+    The table is open addressing with linear probing: slot_keys holds the key
+    stored in each slot, EMPTY_KEY for a free slot, so colliding trigrams get
+    slots of their own and unknown trigrams never borrow a known one's row.
+    """
+    languages = list(profiles)
+    trigrams = sorted(set().union(*profiles.values()))
+
+    probabilities = np.zeros((len(trigrams) + 1, len(languages)))
+    for i, counts in enumerate(profiles.values()):
+        total = sum(counts.values())
+        probabilities[1:, i] = [counts.get(trigram, 0) / total for trigram in trigrams]
+    log_probabilities = np.log(probabilities + TRIGRAM_SMOOTHING).astype(np.float32)
+
+    keys = pack_trigrams(to_code_points("".join(trigrams)))[::3]
+    # at most a quarter of the slots in use keeps the probe sequences short
+    bits = max(int(len(keys) * 4 - 1).bit_length(), 1)
+    slot_keys = np.full(2**bits, EMPTY_KEY, dtype=np.uint64)
+    slot_rows = np.zeros(2**bits, dtype=np.int32)
+    for row, (key, slot) in enumerate(zip(keys, hash_trigrams(keys, bits)), 1):
+        while slot_keys[slot] != EMPTY_KEY:
+            slot = (slot + 1) % len(slot_keys)
+        slot_keys[slot] = key
+        slot_rows[slot] = row
+
+    return languages, (slot_keys, slot_rows), log_probabilities
+
+
+@functools.cache
+def get_trigram_model():
+    """
+    Get the trigram model of the language profiles that ship with the package
+    """
+    return build_trigram_model(get_language_profiles())
+
+
+def lookup_trigrams(keys, table):
+    """
+    Row of the model of each trigram key, 0 for trigrams the model does not know
+    """
+    slot_keys, slot_rows = table
+    bits = len(slot_keys).bit_length() - 1
+    rows = np.zeros(len(keys), dtype=np.int32)
+    pending = np.arange(len(keys))
+    slots = hash_trigrams(keys, bits)
+    # probe the next slot for the keys that met another trigram, until each
+    # key is found or reaches a free slot
+    while len(pending):
+        found_keys = slot_keys[slots]
+        found = found_keys == keys[pending]
+        rows[pending[found]] = slot_rows[slots[found]]
+        probing = ~found & (found_keys != EMPTY_KEY)
+        pending = pending[probing]
+        slots = (slots[probing] + 1) & (len(slot_keys) - 1)
+    return rows
+
+
+def score_languages(texts, model=None):
+    """
+    Log-likelihood of each text of a Series in each language of the model, its
+    trigram count and whether all its letters are Latin, computed over the
+    concatenated code points of all texts. model defaults to the trigram model
+    of the shipped language profiles.
+    """
+    normalized = (
+        " "
+        + texts.fillna("")
+        .astype(str)
+        .str.lower()
+        .str.replace(non_letter_pattern, " ", regex=True)
+        .str.strip()
+        + " "
+    )
+    lengths = normalized.str.len().to_numpy(dtype=np.int64)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    codes = to_code_points("".join(normalized.tolist()))
+
+    # the trigrams of a text start at its first up to its third last character,
+    # one sparse row of trigram counts per text times the model gives the
+    # log-likelihoods of all texts and languages at once
+    n_trigrams = lengths - 2
+    is_trigram = np.repeat(
+        np.tile([True, False], len(texts)),
+        np.column_stack([n_trigrams, np.full(len(texts), 2)]).ravel(),
+    )[: max(len(codes) - 2, 0)]
+    _, table, log_probabilities = model or get_trigram_model()
+    trigram_rows = lookup_trigrams(pack_trigrams(codes)[is_trigram], table)
+    counts = scipy.sparse.csr_matrix(
+        (
+            np.ones(len(trigram_rows), dtype=np.float32),
+            trigram_rows,
+            np.concatenate([[0], np.cumsum(n_trigrams)]),
+        ),
+        shape=(len(texts), len(log_probabilities)),
+    )
+    log_likelihoods = counts @ log_probabilities
+
+    # letters of other scripts than Latin, from Greek on except Latin Extended Additional
+    non_latin = (codes >= 0x370) & ((codes < 0x1E00) | (codes >= 0x1F00))
+    non_latin_sums = np.concatenate([[0], np.cumsum(non_latin)])
+    latin = non_latin_sums[ends] == non_latin_sums[starts]
+
+    return log_likelihoods, n_trigrams, latin
+
+
+def score_english(texts, model=None):
+    """
+    English margin, trigram count and whether all letters are Latin for each text
+    of a Series
+    """
+    model = model or get_trigram_model()
+    log_likelihoods, n_trigrams, latin = score_languages(texts, model)
+
+    english = model[0].index("en")
+    others = np.delete(log_likelihoods, english, axis=1).max(axis=1)
+    margins = (log_likelihoods[:, english] - others) / np.maximum(n_trigrams, 1)
+
+    return margins, n_trigrams, latin
+
+
+def detect_english_series(
+    texts,
+    margin=ENGLISH_MARGIN,
+    min_trigrams=MIN_TRIGRAMS,
+    chunk_size=50000,
+    model=None,
+):
+    """
+    Mask of the texts that are English with certainty, aligned to the input index.
+    Texts in another script, too short or not clearly English are False and
+    should go to LibreTranslate. model defaults to the trigram model of the
+    shipped language profiles.
+    """
+    if not isinstance(texts, pd.Series):
+        texts = pd.Series(list(texts), dtype=object)
+
+    english = np.zeros(len(texts), dtype=bool)
+    with METRICS.stage("detect_english", len(texts)):
+        for start in range(0, len(texts), chunk_size):
+            margins, n_trigrams, latin = score_english(
+                texts.iloc[start : start + chunk_size], model
+            )
+            english[start : start + chunk_size] = (
+                latin & (n_trigrams >= min_trigrams) & (margins > margin)
+            )
+
+    return pd.Series(english, index=texts.index)
@@ -0,0 +1,294 @@
+"""
+In-memory index over the Billboard Hot 100 dataset. Chart dates are parsed once
+into day numbers and every artist credit is split into per-artist posting lists,
+so per-artist queries only touch that artist's chart entries.
+"""
+
+import os
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+
+from config import CACHE_DATA_PATH, RAW_DATA_PATH, get_celebrities
+
+BILLBOARD_CSV_PATH = os.path.join(RAW_DATA_PATH, "billboard_charts_2015_to_today.csv")
+BILLBOARD_INDEX_PATH = os.path.join(CACHE_DATA_PATH, "billboard_index.npz")
+CHART_SIZE = 100
+
+# separators between the artists of a credit, e.g. "A Featuring B & C", "A x B"
+CREDIT_SEPARATOR = re.compile(
+    r"\s+(?:Featuring|Feat\.?|Duet With|With|Presents|And|Vs\.?|x|X|&|\+)\s+"
+    r"|\s*,\s*|\s*[()]\s*"
+)
+NON_ALPHANUMERIC = re.compile(r"[\W_]+")
+
+TRAJECTORY_DTYPE = np.dtype(
+    [("date", "datetime64[D]"), ("entries", np.int16), ("best_rank", np.int16)]
+)
+
+
+def normalize_artist(name: str) -> str:
+    """
+    Normalize an artist name for matching, e.g. "R. Kelly" -> "r kelly"
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return NON_ALPHANUMERIC.sub(" ", name.casefold()).strip()
+
+
+def get_artist_keys(credit: str) -> set:
+    """
+    Get the normalized artists of a credit.
+
+    Every run of consecutive parts is a key as well, so names containing a
+    separator ("Tyler, The Creator", "Mumford & Sons") still match.
+    """
+    spans = []
+    start = 0
+    for match in CREDIT_SEPARATOR.finditer(credit):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(credit)))
+    spans = [(start, end) for start, end in spans if end > start]
+
+    keys = set()
+    for i in range(len(spans)):
+        for j in range(i, len(spans)):
+            key = normalize_artist(credit[spans[i][0] : spans[j][1]])
+            if key:
+                keys.add(key)
+    return keys
+
+
+def to_day(value) -> int:
+    """
+    Convert a date-like value into days since 1970-01-01
+    """
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert(None)
+    return int(np.datetime64(timestamp.date(), "D").astype(np.int64))
+
+
+def encode_strings(values) -> np.ndarray:
+    """
+    Store strings as UTF-8 bytes, a quarter of the size of a unicode array
+    """
+    return np.array([value.encode("utf-8") for value in values], dtype=bytes)
+
+
+def decode_strings(values: np.ndarray) -> list:
+    """
+    Decode strings stored by encode_strings
+    """
+    return [value.decode("utf-8") for value in values]
+
+
+class BillboardIndex:
+    """
+    Array-backed index of the weekly chart entries.
+
+    The entries are sorted by date and rank, and the posting list of an artist
+    holds the positions of its entries in that order, so a date range is a
+    binary search within the posting list.
+    """
+
+    def __init__(self, arrays: dict):
+        self.arrays = arrays
+        self.day = arrays["day"]
+        self.week = arrays["week"]
+        self.this_week = arrays["this_week"]
+        self.last_week = arrays["last_week"]
+        self.peak_position = arrays["peak_position"]
+        self.weeks_on_chart = arrays["weeks_on_chart"]
+        self.song = arrays["song"]
+        self.credit = arrays["credit"]
+        self.songs = arrays["songs"]
+        self.credits = arrays["credits"]
+        self.weeks = arrays["weeks"]
+        self.artists = arrays["artists"]
+        self.offsets = arrays["offsets"]
+        self.postings = arrays["postings"]
+        # celebrities from config.json are looked up by their search term
+        celebrities = get_celebrities()
+        self.aliases = dict(zip(celebrities["name"], celebrities["search_term"]))
+
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> "BillboardIndex":
+        """
+        Build the index from the rows of the Billboard CSV file
+        """
+        df = df.sort_values(["date", "this_week"], ignore_index=True)
+
+        day = (
+            pd.to_datetime(df["date"], format="%Y-%m-%d")
+            .to_numpy()
+            .astype("datetime64[D]")
+            .astype(np.int32)
+        )
+        weeks, week = np.unique(day, return_inverse=True)
+        song_codes, songs = pd.factorize(df["song"])
+        credit_codes, credits = pd.factorize(df["artist"])
+
+        # group the entries by credit, then merge the groups of every artist
+        order = np.argsort(credit_codes, kind="stable").astype(np.int32)
+        bounds = np.searchsorted(credit_codes[order], np.arange(len(credits) + 1))
+        credit_entries = [order[bounds[i] : bounds[i + 1]] for i in range(len(credits))]
+
+        artist_credits = {}
+        for credit_id, credit in enumerate(credits):
+            for key in get_artist_keys(credit):
+                artist_credits.setdefault(key, []).append(credit_id)
+
+        artists = sorted(artist_credits)
+        offsets = np.zeros(len(artists) + 1, dtype=np.int64)
+        postings = []
+        for i, artist in enumerate(artists):
+            entries = np.sort(
+                np.concatenate([credit_entries[c] for c in artist_credits[artist]])
+            )
+            postings.append(entries)
+            offsets[i + 1] = offsets[i] + len(entries)
+
+        return cls(
+            {
+                "day": day,
+                "week": week.astype(np.int16),
+                "this_week": df["this_week"].to_numpy(np.int16),
+                "last_week": df["last_week"].fillna(0).to_numpy(np.int16),
+                "peak_position": df["peak_position"].to_numpy(np.int16),
+                "weeks_on_chart": df["weeks_on_chart"].to_numpy(np.int16),
+                "song": song_codes.astype(np.int32),
+                "credit": credit_codes.astype(np.int32),
+                "songs": encode_strings(songs),
+                "credits": encode_strings(credits),
+                "weeks": weeks.astype(np.int32),
+                "artists": encode_strings(artists),
+                "offsets": offsets,
+                "postings": np.concatenate(postings).astype(np.int32),
+            }
+        )
+
+    @classmethod
+    def from_csv(cls, file_path: str = BILLBOARD_CSV_PATH) -> "BillboardIndex":
+        """
+        Build the index from a Billboard CSV file
+        """
+        return cls.build(pd.read_csv(file_path))
+
+    def save(self, file_path: str = BILLBOARD_INDEX_PATH) -> None:
+        """
+        Persist the arrays uncompressed, so loading is a plain read
+        """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **self.arrays)
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str = BILLBOARD_INDEX_PATH) -> "BillboardIndex":
+        """
+        Load a persisted index
+        """
+        with np.load(file_path, allow_pickle=False) as data:
+            return cls({key: data[key] for key in data.files})
+
+    def lookup(self, artist: str) -> np.ndarray:
+        """
+        Positions of all chart entries credited to an artist or celebrity
+        """
+        key = normalize_artist(self.aliases.get(artist, artist)).encode("utf-8")
+        i = np.searchsorted(self.artists, key)
+        if i == len(self.artists) or self.artists[i] != key:
+            return self.postings[:0]
+        return self.postings[self.offsets[i] : self.offsets[i + 1]]
+
+    def select(self, artist: str, start=None, end=None) -> np.ndarray:
+        """
+        Positions of an artist's chart entries from start (inclusive) to end (exclusive)
+        """
+        entries = self.lookup(artist)
+        days = self.day[entries]
+        first = 0 if start is None else np.searchsorted(days, to_day(start))
+        last = len(entries) if end is None else np.searchsorted(days, to_day(end))
+        return entries[first:last]
+
+    def trajectory(self, artist: str, start=None, end=None) -> np.ndarray:
+        """
+        Number of entries and best rank of an artist for every chart week in the
+        range, the best rank is 0 in weeks without an entry
+        """
+        entries = self.select(artist, start, end)
+        first = 0 if start is None else np.searchsorted(self.weeks, to_day(start))
+        last = (
+            len(self.weeks) if end is None else np.searchsorted(self.weeks, to_day(end))
+        )
+
+        week = self.week[entries].astype(np.intp) - first
+        best_rank = np.full(last - first, CHART_SIZE + 1, dtype=np.int16)
+        np.minimum.at(best_rank, week, self.this_week[entries])
+        best_rank[best_rank > CHART_SIZE] = 0
+
+        result = np.empty(last - first, dtype=TRAJECTORY_DTYPE)
+        result["date"] = self.weeks[first:last].astype("datetime64[D]")
+        result["entries"] = np.bincount(week, minlength=last - first)
+        result["best_rank"] = best_rank
+        return result
+
+    def weeks_charted(self, artist: str, start=None, end=None) -> int:
+        """
+        Number of chart weeks with at least one entry of an artist
+        """
+        return len(np.unique(self.week[self.select(artist, start, end)]))
+
+    def song_weeks_on_chart(self, artist: str, start=None, end=None) -> dict:
+        """
+        Weeks on chart of each of an artist's songs at its last entry in the range
+        """
+        entries = self.select(artist, start, end)
+        # entries are in date order, so the last write per song wins
+        songs = decode_strings(self.songs[self.song[entries]])
+        return dict(zip(songs, self.weeks_on_chart[entries].tolist()))
+
+    def rank_distribution(self, artist: str, start=None, end=None) -> np.ndarray:
+        """
+        Number of an artist's entries at each rank, index 0 is rank 1
+        """
+        entries = self.select(artist, start, end)
+        return np.bincount(self.this_week[entries], minlength=CHART_SIZE + 1)[1:]
+
+    def to_frame(self, entries: np.ndarray) -> pd.DataFrame:
+        """
+        Turn entry positions back into rows of the Billboard dataset
+        """
+        last_week = self.last_week[entries].astype("float64")
+        last_week[last_week == 0] = np.nan
+        return pd.DataFrame(
+            {
+                "date": self.day[entries].astype("datetime64[D]"),
+                "song": decode_strings(self.songs[self.song[entries]]),
+                "artist": decode_strings(self.credits[self.credit[entries]]),
+                "this_week": self.this_week[entries],
+                "last_week": last_week,
+                "peak_position": self.peak_position[entries],
+                "weeks_on_chart": self.weeks_on_chart[entries],
+            }
+        )
+
+
+def get_billboard_index(
+    csv_path: str = BILLBOARD_CSV_PATH, index_path: str = BILLBOARD_INDEX_PATH
+) -> BillboardIndex:
+    """
+    Load the persisted index, rebuilding it when the CSV file is newer
+    """
+    stale = not os.path.exists(index_path) or (
+        os.path.getmtime(index_path) < os.path.getmtime(csv_path)
+    )
+    if stale:
+        index = BillboardIndex.from_csv(csv_path)
+        index.save(index_path)
+        return index
+    return BillboardIndex.load(index_path)
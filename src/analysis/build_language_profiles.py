@@ -0,0 +1,184 @@
+"""
+Build language_profiles.json, the character trigram counts of English and the
+common Latin-script languages that detect_english_series scores texts with.
+
+The counts come from running text: the headlines and comments of the processed
+files with the language LibreTranslate detected, the English translations it
+returned, and the example and test sentences that ship with spaCy for the
+languages the crawled data has little of. spaCy's stop word lists add the most
+frequent words of each language.
+
+The languages of the processed files are not reliable everywhere, some article
+files have them shifted against the titles, so a labelled text only counts if
+the profiles of the spaCy texts alone agree on its language. With --evaluate
+the profiles are built from every other processed row and tested on the rest.
+"""
+
+from collections import Counter
+import argparse
+import ast
+import glob
+import importlib
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from config import PROCESSED_DATA_PATH
+from analyzer_functions import build_trigram_model, detect_english_series
+from analyzer_functions import score_languages
+from preprocessing_pipeline import SOURCES
+
+PROFILES_FILE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "language_profiles.json"
+)
+# languages in Latin script, the others are recognized by their script alone
+LANGUAGES = [
+    "en", "es", "pt", "fr", "de", "it", "nl", "tr", "id", "ms", "tl", "vi", "pl",
+    "ro", "sv", "da", "nb", "fi", "hu", "cs", "sk", "sl", "hr", "lt", "sq", "ca",
+]  # fmt: skip
+TRIGRAMS_PER_LANGUAGE = 1000
+# shorter strings of spaCy's tests are mostly tokenizer cases, not sentences
+MIN_TEST_WORDS = 5
+
+non_letter_pattern = re.compile(r"[\W\d_]+")
+
+
+def get_trigrams(text: str) -> list:
+    """
+    Character trigrams of a text as detect_english_series sees it: lowercase,
+    letters only, words separated and framed by single spaces
+    """
+    text = f" {non_letter_pattern.sub(' ', text.lower()).strip()} "
+    return [text[i : i + 3] for i in range(len(text) - 2)]
+
+
+def get_spacy_texts(language: str) -> list:
+    """
+    Stop words, example sentences and test sentences of a language as they ship
+    with spaCy
+    """
+    import spacy
+
+    stop_words = importlib.import_module(f"spacy.lang.{language}.stop_words")
+    # sorted, so that ties in the counts are cut the same way on every build
+    texts = sorted(stop_words.STOP_WORDS)
+    try:
+        texts += importlib.import_module(f"spacy.lang.{language}.examples").sentences
+    except ImportError:
+        pass
+
+    tests_path = os.path.join(os.path.dirname(spacy.__file__), "tests", "lang")
+    for path in sorted(glob.glob(os.path.join(tests_path, language, "*.py"))):
+        with open(path, "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+        texts += [
+            node.value
+            for node in ast.walk(tree)
+            if isinstance(node, ast.Constant)
+            and isinstance(node.value, str)
+            and len(node.value.split()) >= MIN_TEST_WORDS
+        ]
+    return texts
+
+
+def load_processed_texts() -> pd.DataFrame:
+    """
+    Texts of the processed files with the language LibreTranslate detected and
+    their translation
+    """
+    frames = []
+    for settings in SOURCES.values():
+        column = "remove_emoji" if settings["remove_emoji"] else settings["text_column"]
+        pattern = settings["output"].format(name="*")
+        for path in sorted(glob.glob(os.path.join(PROCESSED_DATA_PATH, pattern))):
+            df = pd.read_csv(path, usecols=[column, "source", "translated"])
+            frames.append(df.rename(columns={column: "text"}))
+    if not frames:
+        return pd.DataFrame(columns=["text", "source", "translated"])
+    return pd.concat(frames, ignore_index=True).dropna().astype(str)
+
+
+def count_profiles(texts: dict) -> dict:
+    """
+    The most common trigrams of each language's texts with their counts
+    """
+    profiles = {}
+    for language, language_texts in texts.items():
+        counts = Counter()
+        for text in language_texts:
+            counts.update(get_trigrams(text))
+        profiles[language] = dict(counts.most_common(TRIGRAMS_PER_LANGUAGE))
+    return profiles
+
+
+def build_profiles(processed: pd.DataFrame = None) -> dict:
+    """
+    Build the profiles from the spaCy texts and the processed texts, by default
+    those of all processed files
+    """
+    if processed is None:
+        processed = load_processed_texts()
+
+    texts = {language: get_spacy_texts(language) for language in LANGUAGES}
+    log_likelihoods, _, _ = score_languages(
+        processed["text"], build_trigram_model(count_profiles(texts))
+    )
+    agreed = processed[
+        np.array(LANGUAGES)[log_likelihoods.argmax(axis=1)] == processed["source"]
+    ]
+    for language, group in agreed.groupby("source"):
+        texts[language] += group["text"].tolist()
+
+    # the translations are English, except for texts LibreTranslate was not
+    # asked about or returned as they were
+    translated = processed["translated"] != processed["text"]
+    texts["en"] += processed.loc[translated, "translated"].tolist()
+
+    return count_profiles(texts)
+
+
+def evaluate_profiles() -> pd.DataFrame:
+    """
+    Build the profiles from every other processed row and count, per detected
+    language of the other rows, how many detect_english_series takes for English.
+    Texts LibreTranslate did not take for English are worth reading, as its
+    labels are not always right.
+    """
+    processed = load_processed_texts()
+    results = []
+    for fold in range(2):
+        model = build_trigram_model(build_profiles(processed.iloc[1 - fold :: 2]))
+        test = processed.iloc[fold::2]
+        english = detect_english_series(test["text"], model=model)
+        results.append(
+            pd.DataFrame({"source": test["source"], "english": english.to_numpy()})
+        )
+    return (
+        pd.concat(results)
+        .groupby("source")["english"]
+        .agg(texts="size", english="sum")
+        .sort_values("texts", ascending=False)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--evaluate",
+        action="store_true",
+        help="Test profiles built from half of the processed rows on the other half",
+    )
+    args = parser.parse_args()
+
+    if args.evaluate:
+        print(evaluate_profiles().to_string())
+    else:
+        profiles = build_profiles()
+        with open(PROFILES_FILE, "w", encoding="utf-8") as f:
+            json.dump(profiles, f, ensure_ascii=False, separators=(",", ":"))
+        print(f"Saved {len(profiles)} language profiles to {PROFILES_FILE}")
@@ -0,0 +1,315 @@
+"""
+Typed loader for the raw datasets of a celebrity, restricted to a window around
+the cancellation date. CSV files are converted once into a cached Parquet copy
+sorted by date, so the window filter prunes row groups instead of parsing text.
+"""
+
+import os
+import pandas as pd
+
+from config import CACHE_DATA_PATH, RAW_DATA_PATH, get_celebrities
+from helpers.file_functions import open_sink
+
+DATASET_CACHE_PATH = os.path.join(CACHE_DATA_PATH, "datasets")
+ROW_GROUP_SIZE = 50000
+CHUNK_SIZE = 100000
+# strings of chunked reads are kept in Arrow buffers instead of Python objects
+ARROW_STRING = "string[pyarrow]"
+
+# "csv_columns" renames the columns of hand-downloaded files by position, as
+# their headers differ per celebrity, e.g. "Kanye West: (Worldwide)"
+SOURCES = {
+    "spotify_listeners": {
+        "dataset": "spotify_daily_listeners",
+        "csv_columns": ["date", "listeners", "change"],
+        "date_column": "date",
+        "date_format": "%b %d, %Y",
+        "dtypes": {"listeners": "int64", "change": "int64"},
+    },
+    "spotify_followers": {
+        "dataset": "spotify_daily_followers",
+        "csv_columns": ["date", "followers", "change"],
+        "date_column": "date",
+        "date_format": "%b %d, %Y",
+        "dtypes": {"followers": "int64", "change": "int64"},
+    },
+    "spotify_charts": {
+        "dataset": "spotify_artist_charts_daily_top50",
+        "csv_columns": [
+            "track",
+            "platform",
+            "country",
+            "genre",
+            "peak_position",
+            "peak_date",
+        ],
+        "date_column": "peak_date",
+        "date_format": "%b %d, %Y",
+        "dtypes": {
+            "track": "string",
+            "platform": "category",
+            "country": "category",
+            "genre": "string",
+            "peak_position": "int16",
+        },
+    },
+    "google_trends": {
+        "dataset": "google_trends",
+        "csv_columns": ["date", "trend"],
+        "date_column": "date",
+        "date_format": "ISO8601",
+        "dtypes": {"trend": "int16"},
+    },
+    "youtube_stats": {
+        "dataset": "youtube_stats",
+        "csv_columns": None,
+        "date_column": None,
+        "dtypes": {"video_id": "string", "view_count": "Int64", "like_count": "Int64"},
+    },
+    "youtube_stats_snapshots": {
+        "dataset": "youtube_stats_snapshots",
+        "csv_columns": None,
+        "date_column": "crawled_at",
+        "date_format": "ISO8601",
+        "dtypes": {"video_id": "string", "view_count": "int64", "like_count": "int64"},
+    },
+    "youtube_comments": {
+        "dataset": "youtube_comments",
+        "csv_columns": None,
+        "date_column": "updateDt",
+        "date_format": "ISO8601",
+        "dtypes": {"text": "string", "video_id": "category"},
+    },
+    "articles": {
+        "dataset": "articles_gnews",
+        "csv_columns": None,
+        "date_column": "published_on",
+        "date_format": "ISO8601",
+        "dtypes": {
+            "title": "string",
+            "content": "string",
+            "link": "string",
+            "source": "category",
+            "source_url": "category",
+        },
+    },
+}
+
+
+def get_celebrity(name: str) -> pd.Series:
+    """
+    Get the prepared config.json row of a celebrity
+    """
+    celebrities = get_celebrities()
+    matches = celebrities[celebrities["name"] == name]
+    if matches.empty:
+        raise ValueError(f"Unknown celebrity: {name}")
+    return matches.iloc[0]
+
+
+def find_raw_file(name: str, dataset: str):
+    """
+    Find a raw CSV file ignoring case, e.g. marilyn_Manson_youtube_stats.csv
+    """
+    file_name = f"{name}_{dataset}.csv".lower()
+    for entry in os.listdir(RAW_DATA_PATH):
+        if entry.lower() == file_name:
+            return os.path.join(RAW_DATA_PATH, entry)
+    return None
+
+
+def parse_csv(file_path: str, settings: dict) -> pd.DataFrame:
+    """
+    Read a raw CSV file with the column names and dtypes of its source
+    """
+    if settings["csv_columns"] is not None:
+        df = pd.read_csv(file_path, header=0, names=settings["csv_columns"])
+    else:
+        df = pd.read_csv(file_path)
+
+    for column, dtype in settings["dtypes"].items():
+        if column not in df.columns:
+            continue
+        if dtype.lower().startswith("int"):
+            # Google Trends reports values below one as "<1"
+            values = df[column].replace("<1", 0)
+            df[column] = pd.to_numeric(values, errors="coerce").astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+
+    date_column = settings["date_column"]
+    if date_column is not None:
+        df[date_column] = pd.to_datetime(
+            df[date_column], format=settings["date_format"], utc=True
+        )
+        df = df.sort_values(date_column, ignore_index=True)
+
+    return df
+
+
+def get_cached_copy(name: str, settings: dict):
+    """
+    Path of the cached Parquet copy of a raw CSV file, rebuilt when the CSV is newer
+    """
+    file_path = find_raw_file(name, settings["dataset"])
+    if file_path is None:
+        return None
+
+    cache_path = os.path.join(
+        DATASET_CACHE_PATH, settings["dataset"], f"{name}.parquet"
+    )
+    stale = not os.path.exists(cache_path) or (
+        os.path.getmtime(cache_path) < os.path.getmtime(file_path)
+    )
+    if stale:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        df = parse_csv(file_path, settings)
+        tmp_path = cache_path + ".tmp"
+        df.to_parquet(tmp_path, index=False, row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp_path, cache_path)
+
+    return cache_path
+
+
+def get_window(name: str, months_before=None, months_after=None):
+    """
+    Start and end timestamps of a window around the cancellation date
+    """
+    cancellation_date = get_celebrity(name)["cancellation_date"]
+    start = None
+    end = None
+    if months_before is not None:
+        start = cancellation_date - pd.DateOffset(months=months_before)
+    if months_after is not None:
+        end = cancellation_date + pd.DateOffset(months=months_after)
+    return start, end
+
+
+def load_dataset(
+    name: str,
+    source: str,
+    months_before=None,
+    months_after=None,
+    columns: list = None,
+) -> pd.DataFrame:
+    """
+    Load a celebrity's dataset with typed columns, restricted to the window of
+    months_before up to months_after around the cancellation date.
+
+    Crawled Parquet datasets are read directly, with the window pruning the
+    month partitions; CSV files are read through their cached Parquet copy.
+    """
+    settings = SOURCES[source]
+    date_column = settings["date_column"]
+    start, end = get_window(name, months_before, months_after)
+
+    filters = []
+    if date_column is not None:
+        if start is not None:
+            filters.append((date_column, ">=", start))
+        if end is not None:
+            filters.append((date_column, "<", end))
+
+    sink = open_sink(RAW_DATA_PATH, settings["dataset"], name, "parquet", date_column)
+    if sink.exists():
+        path = sink.path
+        if date_column is not None:
+            if start is not None:
+                filters.append(("month", ">=", start.strftime("%Y-%m")))
+            if end is not None:
+                filters.append(("month", "<=", end.strftime("%Y-%m")))
+    else:
+        path = get_cached_copy(name, settings)
+        if path is None:
+            raise FileNotFoundError(f"No {source} data found for {name}")
+
+    if columns is not None and date_column is not None and date_column not in columns:
+        read_columns = columns + [date_column]
+    else:
+        read_columns = columns
+
+    df = pd.read_parquet(path, columns=read_columns, filters=filters or None)
+    df = df.drop(columns=["celebrity", "month"], errors="ignore")
+
+    for column, dtype in settings["dtypes"].items():
+        if column in df.columns and df[column].dtype != dtype:
+            df[column] = df[column].astype(dtype)
+
+    if date_column is not None:
+        df = df.sort_values(date_column, ignore_index=True)
+    if columns is not None:
+        df = df[columns]
+
+    return df
+
+
+def compact_dtypes(settings: dict) -> dict:
+    """
+    The dtypes of a source with its strings Arrow-backed
+    """
+    return {
+        column: ARROW_STRING if dtype == "string" else dtype
+        for column, dtype in settings["dtypes"].items()
+    }
+
+
+def read_csv_chunks(
+    file_path: str,
+    dtypes: dict,
+    date_column: str = None,
+    date_format: str = "ISO8601",
+    columns: list = None,
+    chunk_size: int = CHUNK_SIZE,
+):
+    """
+    Read a CSV file in chunks of compactly typed columns, e.g. a comment dump
+    too large for memory; the index counts the rows of the whole file
+    """
+    dtypes = {
+        column: dtype for column, dtype in dtypes.items() if column != date_column
+    }
+    for df in pd.read_csv(
+        file_path, usecols=columns, dtype=dtypes, chunksize=chunk_size
+    ):
+        if date_column in df.columns:
+            df[date_column] = pd.to_datetime(
+                df[date_column], format=date_format, utc=True
+            )
+        yield df
+
+
+def read_chunks(
+    name: str, source: str, columns: list = None, chunk_size: int = CHUNK_SIZE
+):
+    """
+    Read a celebrity's dataset in chunks of compactly typed columns, in the
+    order of the raw file; the index counts the rows of the whole dataset.
+    Unlike load_dataset no full copy is made, so memory is bounded by the chunk.
+    """
+    settings = SOURCES[source]
+    dtypes = compact_dtypes(settings)
+
+    sink = open_sink(RAW_DATA_PATH, settings["dataset"], name, "parquet")
+    if sink.exists():
+        rows_done = 0
+        for df in sink.read_chunks(columns=columns, chunk_size=chunk_size):
+            df = df.drop(columns=["celebrity", "month"], errors="ignore")
+            for column, dtype in dtypes.items():
+                if column in df.columns:
+                    df[column] = df[column].astype(dtype)
+            df.index = pd.RangeIndex(rows_done, rows_done + len(df))
+            rows_done += len(df)
+            yield df
+        return
+
+    file_path = find_raw_file(name, settings["dataset"])
+    if file_path is None:
+        raise FileNotFoundError(f"No {source} data found for {name}")
+    yield from read_csv_chunks(
+        file_path,
+        dtypes,
+        date_column=settings["date_column"],
+        date_format=settings.get("date_format", "ISO8601"),
+        columns=columns,
+        chunk_size=chunk_size,
+    )
@@ -0,0 +1,243 @@
+"""
+Near-duplicate detection with MinHash and locality-sensitive hashing, e.g. for
+syndicated copies of a news story or copy-pasted comment spam.
+
+Texts are shingled into character k-grams over their concatenated code points,
+and every text gets a MinHash signature. Texts sharing one band of their
+signature are candidates, and a candidate is linked to the first text of its
+band bucket if their signatures agree on at least the threshold share. Each
+connected group is represented by its first text. Sorting the band keys is the
+only superlinear step, so millions of texts take seconds to minutes. Texts can
+be read in chunks, only their signatures are kept, 256 bytes per text with the
+default 64 permutations.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components
+
+from helpers.instrumentation import METRICS
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+# estimated Jaccard similarity of the shingles from which texts are duplicates
+THRESHOLD = 0.8
+# texts whose shingles are held in memory at once
+CHUNK_SIZE = 100000
+
+non_word_pattern = re.compile(r"[\W_]+")
+
+# odd multiplier of the shingle hash, from the golden ratio
+SHINGLE_PRIME = np.uint64(0x9E3779B97F4A7C15)
+
+
+def normalize_texts(texts: pd.Series) -> pd.Series:
+    """
+    Lowercase the texts and collapse everything but letters and digits into
+    single spaces, so that punctuation, emojis and spacing don't count
+    """
+    return (
+        texts.fillna("")
+        .astype(str)
+        .str.lower()
+        .str.replace(non_word_pattern, " ", regex=True)
+        .str.strip()
+    )
+
+
+def get_shingles(texts: pd.Series, shingle_size: int = SHINGLE_SIZE) -> tuple:
+    """
+    Hash the character shingles of the normalized texts, returns the hashes and
+    the offset of each text's first shingle; shorter texts are padded to one
+    shingle
+    """
+    padded = texts.str.pad(shingle_size, side="right")
+    lengths = padded.str.len().to_numpy(dtype=np.int64)
+    codes = np.frombuffer(
+        "".join(padded.tolist()).encode("utf-32-le"), dtype=np.uint32
+    ).astype(np.uint64)
+
+    # polynomial hash of every window of the concatenated texts
+    n_windows = len(codes) - shingle_size + 1
+    hashes = np.zeros(n_windows, dtype=np.uint64)
+    for i in range(shingle_size):
+        hashes = hashes * SHINGLE_PRIME + codes[i : i + n_windows]
+    hashes ^= hashes >> np.uint64(29)
+
+    # drop the windows that cross into the next text
+    n_shingles = lengths - shingle_size + 1
+    is_shingle = np.repeat(
+        np.tile([True, False], len(texts)),
+        np.column_stack([n_shingles, np.full(len(texts), shingle_size - 1)]).ravel(),
+    )[:n_windows]
+    offsets = np.concatenate([[0], np.cumsum(n_shingles)[:-1]])
+    return hashes[is_shingle], offsets
+
+
+def get_permutations(num_perm: int = NUM_PERM, seed: int = 42) -> tuple:
+    """
+    Multipliers and increments of the multiply-shift hash functions standing in
+    for random permutations
+    """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64) * 2 + 1
+    increments = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+    return multipliers, increments
+
+
+def minhash_signatures(
+    texts: pd.Series,
+    shingle_size: int = SHINGLE_SIZE,
+    num_perm: int = NUM_PERM,
+    chunk_size: int = CHUNK_SIZE,
+    seed: int = 42,
+) -> np.ndarray:
+    """
+    MinHash signature of each normalized text, one row of num_perm values per text
+    """
+    multipliers, increments = get_permutations(num_perm, seed)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for start in range(0, len(texts), chunk_size):
+        shingles, offsets = get_shingles(
+            texts.iloc[start : start + chunk_size], shingle_size
+        )
+        for i in range(num_perm):
+            values = (shingles * multipliers[i] + increments[i]) >> np.uint64(32)
+            signatures[start : start + len(offsets), i] = np.minimum.reduceat(
+                values, offsets
+            )
+    return signatures
+
+
+def get_bands(threshold: float, num_perm: int = NUM_PERM) -> tuple:
+    """
+    Number of bands and rows per band of the LSH, the one whose similarity of
+    50% collision chance, about (1 / bands) ** (1 / rows), is closest below the
+    threshold, so that few true duplicates are missed
+    """
+    options = [
+        (num_perm // rows, rows)
+        for rows in range(1, num_perm + 1)
+        if num_perm % rows == 0
+    ]
+    below = [
+        (bands, rows)
+        for bands, rows in options
+        if (1 / bands) ** (1 / rows) <= threshold
+    ]
+    return max(below or options[:1], key=lambda option: option[1])
+
+
+def find_candidates(signatures: np.ndarray, threshold: float) -> tuple:
+    """
+    Pairs of texts sharing a band bucket whose signatures agree on at least the
+    threshold share, each text paired with the first text of its bucket
+    """
+    n_bands, rows = get_bands(threshold, signatures.shape[1])
+    firsts = []
+    seconds = []
+    for band in range(n_bands):
+        keys = np.zeros(len(signatures), dtype=np.uint64)
+        for column in signatures[:, band * rows : (band + 1) * rows].T:
+            keys = (keys ^ column.astype(np.uint64)) * SHINGLE_PRIME
+
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        new_bucket = np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]])
+        # the stable sort puts the first text of a bucket at its head
+        heads = order[np.flatnonzero(new_bucket)[np.cumsum(new_bucket) - 1]]
+        members = ~new_bucket
+        first, second = heads[members], order[members]
+
+        agreement = (signatures[first] == signatures[second]).mean(axis=1)
+        similar = agreement >= threshold
+        firsts.append(first[similar])
+        seconds.append(second[similar])
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def find_representatives(
+    chunks,
+    threshold: float = THRESHOLD,
+    shingle_size: int = SHINGLE_SIZE,
+    num_perm: int = NUM_PERM,
+    chunk_size: int = CHUNK_SIZE,
+    seed: int = 42,
+) -> np.ndarray:
+    """
+    Position of the representative of each text of an iterable of text Series,
+    e.g. the text column of a dataset read in chunks: the first text of its
+    group of near-duplicates, or the text itself. Only the signatures, num_perm
+    uint32 values per text, are kept across chunks, never the texts, so memory
+    grows by 4 * num_perm bytes per row whatever the length of the texts.
+    Texts that are empty after normalization are never duplicates.
+    """
+    signatures = []
+    non_empty = []
+    with METRICS.stage("find_duplicates") as stage:
+        for texts in chunks:
+            normalized = normalize_texts(texts)
+            signatures.append(
+                minhash_signatures(normalized, shingle_size, num_perm, chunk_size, seed)
+            )
+            non_empty.append((normalized.str.len() > 0).to_numpy())
+            stage.rows += len(texts)
+        if not signatures:
+            return np.empty(0, dtype=np.int64)
+
+        signatures = np.concatenate(signatures)
+        non_empty = np.concatenate(non_empty)
+        n_texts = len(signatures)
+        first, second = find_candidates(signatures, threshold)
+
+        # an empty text would share the signature of the padding with all others
+        linked = non_empty[first] & non_empty[second]
+        graph = scipy.sparse.coo_matrix(
+            (np.ones(linked.sum(), dtype=np.int8), (first[linked], second[linked])),
+            shape=(n_texts, n_texts),
+        )
+        _, labels = connected_components(graph, directed=False)
+
+        group_firsts = np.full(labels.max() + 1, n_texts)
+        np.minimum.at(group_firsts, labels, np.arange(n_texts))
+
+    return group_firsts[labels]
+
+
+def find_duplicates(
+    texts,
+    threshold: float = THRESHOLD,
+    shingle_size: int = SHINGLE_SIZE,
+    num_perm: int = NUM_PERM,
+    chunk_size: int = CHUNK_SIZE,
+    seed: int = 42,
+) -> pd.Series:
+    """
+    Index label of the representative of each text, aligned to the input: the
+    first text of its group of near-duplicates, or the text itself.
+    Texts that are empty after normalization are never duplicates.
+    """
+    if not isinstance(texts, pd.Series):
+        texts = pd.Series(list(texts), dtype=object)
+    if texts.empty:
+        return pd.Series(texts.index, index=texts.index)
+
+    chunks = (
+        texts.iloc[start : start + chunk_size]
+        for start in range(0, len(texts), chunk_size)
+    )
+    representatives = find_representatives(
+        chunks, threshold, shingle_size, num_perm, chunk_size, seed
+    )
+    return pd.Series(texts.index[representatives], index=texts.index)
+
+
+def expand_duplicates(values, representatives: pd.Series):
+    """
+    Expand values computed for the representatives only, e.g. sentiment scores
+    indexed like the deduplicated texts, back to every text
+    """
+    return values.reindex(representatives.to_numpy()).set_axis(representatives.index)
@@ -0,0 +1,157 @@
+"""
+Event study of every celebrity's Spotify, Google Trends and YouTube metrics on a
+common axis of months since the cancellation date. Month 0 starts at the
+cancellation date itself, so negative months are before and the others after.
+"""
+
+import numpy as np
+import pandas as pd
+
+from config import get_celebrities
+from dataset_loader import get_celebrity, load_dataset
+
+# metric name -> (dataset_loader source, value column)
+METRICS = {
+    "listeners": ("spotify_listeners", "listeners"),
+    "followers": ("spotify_followers", "followers"),
+    "trend": ("google_trends", "trend"),
+}
+# derived from the monthly means: metric name -> (numerator, denominator)
+RATIOS = {"ratio": ("listeners", "followers")}
+
+STATISTICS = ["n_months", "mean", "std", "min", "max"]
+
+
+def months_since(dates: pd.Series, cancellation_date: pd.Timestamp) -> np.ndarray:
+    """
+    Whole months from the cancellation date to each date; month k covers
+    [cancellation_date + k months, cancellation_date + k + 1 months)
+    """
+    dates = pd.to_datetime(dates, utc=True).dt.tz_convert(None).to_numpy()
+    cancellation = np.datetime64(cancellation_date.tz_convert(None).to_datetime64())
+
+    date_months = dates.astype("datetime64[M]")
+    cancellation_month = cancellation.astype("datetime64[M]")
+    months = (date_months - cancellation_month).astype(np.int64)
+    # step back a month where the date is earlier in its month than the cancellation
+    months -= (dates - date_months) < (cancellation - cancellation_month)
+    return months
+
+
+def get_youtube_views(name: str) -> pd.DataFrame:
+    """
+    Total views of a celebrity's videos per stats snapshot, carrying each
+    video's last snapshot forward; empty without snapshots
+    """
+    try:
+        stats = load_dataset(name, "youtube_stats_snapshots")
+    except FileNotFoundError:
+        return pd.DataFrame(columns=["date", "value"])
+
+    views = stats.pivot_table(
+        index="crawled_at", columns="video_id", values="view_count", aggfunc="last"
+    )
+    total = views.sort_index().ffill().sum(axis=1)
+    return pd.DataFrame({"date": total.index, "value": total.to_numpy(np.float64)})
+
+
+def load_metrics(name: str) -> pd.DataFrame:
+    """
+    Load a celebrity's metrics as rows of metric, month and value
+    """
+    cancellation_date = get_celebrity(name)["cancellation_date"]
+
+    frames = []
+    for metric, (source, column) in METRICS.items():
+        try:
+            df = load_dataset(name, source, columns=["date", column])
+        except FileNotFoundError:
+            print(f"No {source} data found for {name}, skipping.")
+            continue
+        frames.append((metric, df["date"], df[column].to_numpy(np.float64)))
+
+    views = get_youtube_views(name)
+    if not views.empty:
+        frames.append(("youtube_views", views["date"], views["value"].to_numpy()))
+
+    return pd.DataFrame(
+        {
+            "metric": np.concatenate(
+                [np.full(len(values), metric) for metric, _, values in frames]
+            ),
+            "month": np.concatenate(
+                [months_since(dates, cancellation_date) for _, dates, _ in frames]
+            ),
+            "value": np.concatenate([values for _, _, values in frames]),
+        }
+    )
+
+
+def monthly_panel(names: list = None) -> pd.DataFrame:
+    """
+    Monthly means of every celebrity's metrics on the months-since-cancellation
+    axis, with one column per metric including the ratios
+    """
+    if names is None:
+        names = get_celebrities()["name"].tolist()
+
+    df = pd.concat(
+        [load_metrics(name) for name in names],
+        keys=names,
+        names=["celebrity", None],
+    ).reset_index(level=0)
+
+    panel = (
+        df.groupby(["celebrity", "month", "metric"], sort=True)["value"]
+        .mean()
+        .unstack("metric")
+    )
+    for metric, (numerator, denominator) in RATIOS.items():
+        if numerator in panel.columns and denominator in panel.columns:
+            panel[metric] = panel[numerator] / panel[denominator]
+
+    panel.columns.name = "metric"
+    return panel
+
+
+def window_statistics(
+    panel: pd.DataFrame, months_before: int = 6, months_after: int = 6
+) -> pd.DataFrame:
+    """
+    Statistics of the monthly values in the windows of months_before months
+    before and months_after months from the cancellation date, as one tidy row
+    per celebrity, metric and window
+    """
+    months = panel.index.get_level_values("month")
+    in_window = (months >= -months_before) & (months < months_after)
+
+    long = panel[in_window].stack().rename("value").dropna().reset_index()
+    long["window"] = np.where(long["month"] < 0, "pre", "post")
+
+    stats = long.groupby(["celebrity", "metric", "window"], sort=True)["value"].agg(
+        ["count", "mean", "std", "min", "max"]
+    )
+    stats.columns = STATISTICS
+    return stats.reset_index()
+
+
+def event_study(
+    names: list = None, months_before: int = 6, months_after: int = 6
+) -> pd.DataFrame:
+    """
+    Pre/post window statistics of every celebrity and metric
+    """
+    return window_statistics(monthly_panel(names), months_before, months_after)
+
+
+def window_change(stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pre and post means side by side with their absolute and relative change
+    """
+    means = stats.pivot_table(
+        index=["celebrity", "metric"], columns="window", values="mean"
+    )
+    means["change"] = means["post"] - means["pre"]
+    means["relative_change"] = means["change"] / means["pre"]
+    means.columns.name = None
+    return means.reset_index()
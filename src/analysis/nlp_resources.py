@@ -0,0 +1,92 @@
+"""
+NLP models and corpora, loaded on first use and kept for the life of the process.
+NLTK data is looked up locally first and only downloaded when it is missing, so
+importing the analysis modules neither loads a model nor touches the network.
+"""
+
+import functools
+import json
+import os
+
+SPACY_MODEL = "en_core_web_sm"
+# character trigram counts per language, see build_language_profiles.py
+LANGUAGE_PROFILES_FILE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "language_profiles.json"
+)
+
+# NLTK package -> path of its data as looked up by nltk.data.find
+NLTK_RESOURCES = {
+    "vader_lexicon": "sentiment/vader_lexicon.zip",
+    "punkt": "tokenizers/punkt",
+    "punkt_tab": "tokenizers/punkt_tab",
+    "wordnet": "corpora/wordnet",
+    "stopwords": "corpora/stopwords",
+    "averaged_perceptron_tagger": "taggers/averaged_perceptron_tagger",
+}
+
+
+@functools.cache
+def ensure_nltk_data(package):
+    """
+    Make sure an NLTK package is available, downloading it only if it is missing
+    """
+    import nltk
+
+    try:
+        nltk.data.find(NLTK_RESOURCES[package])
+    except LookupError:
+        print(f"NLTK data {package} not found locally, downloading it.")
+        nltk.download(package, quiet=True)
+
+
+@functools.cache
+def get_nlp():
+    """
+    Get the spaCy pipeline, only lemmas are needed so the dependency parser and
+    named entities are skipped
+    """
+    import spacy
+
+    return spacy.load(SPACY_MODEL, disable=["parser", "ner"])
+
+
+@functools.cache
+def get_stop_words():
+    """
+    Get the English NLTK stopwords
+    """
+    ensure_nltk_data("stopwords")
+    from nltk.corpus import stopwords
+
+    return frozenset(stopwords.words("english"))
+
+
+@functools.cache
+def get_word_tokenizer():
+    """
+    Get NLTK's word_tokenize, Punkt sentences split by the Treebank rules
+    """
+    ensure_nltk_data("punkt_tab")
+    from nltk.tokenize import word_tokenize
+
+    return word_tokenize
+
+
+@functools.cache
+def get_sentiment_analyzer():
+    """
+    Get the VADER sentiment analyzer
+    """
+    ensure_nltk_data("vader_lexicon")
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+    return SentimentIntensityAnalyzer()
+
+
+@functools.cache
+def get_language_profiles():
+    """
+    Get the character trigram counts per language that ship with the package
+    """
+    with open(LANGUAGE_PROFILES_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,304 @@
+"""
+The stages of the pipeline as nodes of the stage runner: per celebrity of
+config.json crawl -> preprocess -> score for comments and articles, and the
+event study over all celebrities. Normalizing, translating and lemmatizing are
+one preprocess node, as the streaming pipeline runs them chunk by chunk
+without intermediate files.
+"""
+
+from datetime import datetime, timezone
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import CACHE_DATA_PATH, PROCESSED_DATA_PATH, RAW_DATA_PATH
+from dataset_loader import SOURCES as DATASETS, find_raw_file, get_celebrity
+from helpers.file_functions import SINKS, open_sink
+from helpers.stage_runner import Node
+from nlp_resources import LANGUAGE_PROFILES_FILE
+from preprocessing_pipeline import CHUNK_SIZE, SOURCES
+
+STATE_FILE = os.path.join(CACHE_DATA_PATH, "stages.json")
+ANALYSIS_PATH = os.path.dirname(os.path.realpath(__file__))
+SRC_PATH = os.path.dirname(ANALYSIS_PATH)
+
+EVENT_STUDY_SOURCES = ["spotify_listeners", "spotify_followers", "google_trends"]
+EVENT_STUDY_OUTPUT = os.path.join(PROCESSED_DATA_PATH, "event_study.csv")
+EVENT_STUDY_CHANGE_OUTPUT = os.path.join(PROCESSED_DATA_PATH, "event_study_change.csv")
+
+
+def analysis_file(file_name: str) -> str:
+    return os.path.join(ANALYSIS_PATH, file_name)
+
+
+def src_file(file_name: str) -> str:
+    return os.path.join(SRC_PATH, file_name)
+
+
+def raw_paths(name: str, dataset: str) -> list:
+    """
+    The Parquet and CSV locations of a raw dataset, as either may hold it
+    """
+    paths = [open_sink(RAW_DATA_PATH, dataset, name, format).path for format in SINKS]
+    if os.path.isdir(RAW_DATA_PATH):
+        # hand-downloaded CSV files differ in case, e.g. marilyn_Manson_...
+        paths[-1] = find_raw_file(name, dataset) or paths[-1]
+    return paths
+
+
+def processed_path(name: str, source: str) -> str:
+    return os.path.join(
+        PROCESSED_DATA_PATH, SOURCES[source]["output"].format(name=name)
+    )
+
+
+def sentiment_path(name: str, source: str) -> str:
+    return processed_path(name, source).replace("_processed.csv", "_sentiment.csv")
+
+
+def config_row(name: str) -> dict:
+    """
+    A celebrity's config.json row, so that editing one celebrity only makes
+    its own nodes stale
+    """
+    return {key: str(value) for key, value in get_celebrity(name).items()}
+
+
+def crawl_youtube(name: str) -> None:
+    """
+    Crawl the new comments and changed video stats of a celebrity
+    """
+    from data_crawlers.youtube_data_crawler import (
+        YOUTUBE_HOST,
+        YOUTUBE_HOST_LIMIT,
+        process_single_celebrity,
+    )
+    from helpers.request_scheduler import RequestScheduler
+
+    with RequestScheduler(host_limits={YOUTUBE_HOST: YOUTUBE_HOST_LIMIT}) as scheduler:
+        process_single_celebrity(get_celebrity(name).to_dict(), scheduler)
+
+
+def crawl_articles(name: str) -> None:
+    """
+    Crawl the news articles of a celebrity, resuming an interrupted crawl
+    """
+    from data_crawlers.gnews_data_crawler import DATE_FORMAT, crawl_gnews_data
+
+    celebrity = get_celebrity(name)
+    crawl_gnews_data(
+        name,
+        celebrity["search_term"],
+        celebrity["start_date"].strftime(DATE_FORMAT),
+        celebrity["end_date"].strftime(DATE_FORMAT),
+    )
+
+
+def preprocess(
+    name: str,
+    source: str,
+    chunk_size: int = CHUNK_SIZE,
+    n_process: int = 1,
+    resume: bool = False,
+) -> None:
+    """
+    Preprocess a celebrity's raw file from scratch, or continue an interrupted run
+    """
+    from preprocessing_pipeline import preprocess_file
+
+    preprocess_file(
+        name, source, chunk_size=chunk_size, n_process=n_process, restart=not resume
+    )
+
+
+def score(
+    name: str, source: str, chunk_size: int = CHUNK_SIZE, n_process: int = 1
+) -> None:
+    """
+    Score the lemmas of a celebrity's processed file with VADER into one row of
+    row_id and sentiment scores per processed row
+    """
+    from sentiment_functions import SENTIMENT_COLUMNS, get_sentiment_scores
+
+    output_path = sentiment_path(name, source)
+    tmp_path = output_path + ".tmp"
+    reader = pd.read_csv(
+        processed_path(name, source),
+        usecols=lambda column: column in ["row_id", "lemmatization"],
+        chunksize=chunk_size * max(n_process, 1),
+    )
+    header = True
+    rows_done = 0
+    for chunk in reader:
+        scores = get_sentiment_scores(
+            chunk["lemmatization"], n_process=n_process, chunk_size=chunk_size
+        )
+        df = pd.DataFrame(scores, columns=SENTIMENT_COLUMNS)
+        # files of the notebooks have no row_id, their rows are numbered instead
+        if "row_id" in chunk.columns:
+            row_ids = chunk["row_id"].to_numpy(np.int64)
+        else:
+            row_ids = np.arange(rows_done, rows_done + len(chunk))
+        df.insert(0, "row_id", row_ids)
+        rows_done += len(chunk)
+        df.to_csv(tmp_path, mode="w" if header else "a", header=header, index=False)
+        header = False
+    if header:
+        pd.DataFrame(columns=["row_id", *SENTIMENT_COLUMNS]).to_csv(
+            tmp_path, index=False
+        )
+    os.replace(tmp_path, output_path)
+    print(f"Data successfully saved to {output_path}")
+
+
+def run_event_study(names: list, months_before: int = 6, months_after: int = 6):
+    """
+    Write the pre/post window statistics of all celebrities and their changes
+    """
+    from event_study import event_study, window_change
+
+    stats = event_study(names, months_before, months_after)
+    for path, df in [
+        (EVENT_STUDY_OUTPUT, stats),
+        (EVENT_STUDY_CHANGE_OUTPUT, window_change(stats)),
+    ]:
+        df.to_csv(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+        print(f"Data successfully saved to {path}")
+
+
+def build_nodes(
+    names: list,
+    sources: list = tuple(SOURCES),
+    crawl: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+    n_process: int = 1,
+    months_before: int = 6,
+    months_after: int = 6,
+    refresh_crawl: bool = False,
+) -> list:
+    """
+    The nodes of the pipeline for the given celebrities. Without crawl the raw
+    datasets are plain inputs; crawling needs the network and API quota, so the
+    crawl nodes only run on request. The crawl nodes read no files, so the UTC
+    date is one of their parameters and they run again once a day, or on every
+    run with refresh_crawl.
+    """
+    now = datetime.now(timezone.utc)
+    crawl_time = now.isoformat() if refresh_crawl else now.strftime("%Y-%m-%d")
+    preprocess_code = [
+        analysis_file(file_name)
+        for file_name in [
+            "preprocessing_pipeline.py",
+            "analyzer_functions.py",
+            "text_normalization.py",
+            "deduplication.py",
+            "translate_client.py",
+            "nlp_resources.py",
+        ]
+    ] + [LANGUAGE_PROFILES_FILE]
+    score_code = [
+        analysis_file("pipeline_stages.py"),
+        analysis_file("sentiment_functions.py"),
+        analysis_file("nlp_resources.py"),
+    ]
+
+    nodes = []
+    for name in names:
+        if crawl:
+            nodes.append(
+                Node(
+                    f"crawl_youtube:{name}",
+                    crawl_youtube,
+                    {"name": name},
+                    outputs=[
+                        open_sink(RAW_DATA_PATH, dataset, name).path
+                        for dataset in [
+                            "youtube_comments",
+                            "youtube_stats",
+                            "youtube_stats_snapshots",
+                        ]
+                    ],
+                    code=[src_file("data_crawlers/youtube_data_crawler.py")],
+                    params={"config": config_row(name), "crawled": crawl_time},
+                    exclusive="youtube",
+                )
+            )
+            nodes.append(
+                Node(
+                    f"crawl_articles:{name}",
+                    crawl_articles,
+                    {"name": name},
+                    outputs=[open_sink(RAW_DATA_PATH, "articles_gnews", name).path],
+                    code=[src_file("data_crawlers/gnews_data_crawler.py")],
+                    params={"config": config_row(name), "crawled": crawl_time},
+                    exclusive="gnews",
+                )
+            )
+
+        for source in sources:
+            settings = SOURCES[source]
+            nodes.append(
+                Node(
+                    f"preprocess_{source}:{name}",
+                    preprocess,
+                    {
+                        "name": name,
+                        "source": source,
+                        "chunk_size": chunk_size,
+                        "n_process": n_process,
+                    },
+                    inputs=raw_paths(name, settings["dataset"]),
+                    outputs=[processed_path(name, source)],
+                    code=preprocess_code,
+                    params={"duplicate_threshold": settings["duplicate_threshold"]},
+                    resume_kwarg="resume",
+                )
+            )
+            nodes.append(
+                Node(
+                    f"score_{source}:{name}",
+                    score,
+                    {
+                        "name": name,
+                        "source": source,
+                        "chunk_size": chunk_size,
+                        "n_process": n_process,
+                    },
+                    inputs=[processed_path(name, source)],
+                    outputs=[sentiment_path(name, source)],
+                    code=score_code,
+                )
+            )
+
+    event_study_inputs = [
+        path
+        for name in names
+        for source in [*EVENT_STUDY_SOURCES, "youtube_stats_snapshots"]
+        for path in raw_paths(name, DATASETS[source]["dataset"])
+    ]
+    nodes.append(
+        Node(
+            "event_study",
+            run_event_study,
+            {
+                "names": list(names),
+                "months_before": months_before,
+                "months_after": months_after,
+            },
+            inputs=event_study_inputs,
+            outputs=[EVENT_STUDY_OUTPUT, EVENT_STUDY_CHANGE_OUTPUT],
+            code=[
+                analysis_file("pipeline_stages.py"),
+                analysis_file("event_study.py"),
+                analysis_file("dataset_loader.py"),
+            ],
+            params={
+                "config": [config_row(name) for name in names],
+                "months_before": months_before,
+                "months_after": months_after,
+            },
+        )
+    )
+    return nodes
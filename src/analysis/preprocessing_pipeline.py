@@ -0,0 +1,230 @@
+"""
+Streaming preprocessing pipeline: emoji -> language -> translate -> stopwords ->
+lemma over fixed-size chunks of the raw comment and article datasets (Parquet or
+CSV). Near-duplicate rows are found up front and only their representative goes
+through the chain.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import RAW_DATA_PATH, PROCESSED_DATA_PATH
+from helpers.file_functions import find_sink
+from helpers.instrumentation import METRICS
+from analyzer_functions import detect_english_series, get_lemma_batch
+from deduplication import find_representatives
+from text_normalization import remove_emojis_series, remove_stopwords_series
+from translation_cache import TranslationCache, translate_with_cache
+
+CHUNK_SIZE = 5000
+
+SOURCES = {
+    "youtube_comments": {
+        "dataset": "youtube_comments",
+        "output": "{name}_youtube_comments_processed.csv",
+        "columns": ["text", "updateDt", "video_id"],
+        "rename": {},
+        "text_column": "text",
+        "remove_emoji": True,
+        # copy-pasted spam, but not short comments that merely look alike
+        "duplicate_threshold": 0.9,
+    },
+    "articles": {
+        "dataset": "articles_gnews",
+        "output": "{name}_articles_processed.csv",
+        "columns": ["title", "published_on"],
+        "rename": {"published_on": "updateDt"},
+        "text_column": "title",
+        "remove_emoji": False,
+        # syndicated copies of a story with small edits to the headline
+        "duplicate_threshold": 0.8,
+    },
+}
+
+
+def is_not_blank(texts):
+    """
+    Mask of texts that are not null, empty or whitespace only
+    """
+    return texts.notnull() & texts.astype(str).str.strip().astype(bool)
+
+
+def preprocess_chunk(df, source, cache, n_process=1):
+    """
+    Run the full preprocessing chain on one chunk
+    """
+    settings = SOURCES[source]
+    df = df.rename(columns=settings["rename"])
+    df = df[df[settings["text_column"]].notnull()]
+
+    text = df[settings["text_column"]]
+    if settings["remove_emoji"]:
+        df["remove_emoji"] = remove_emojis_series(text)
+        df = df[is_not_blank(df["remove_emoji"])]
+        text = df["remove_emoji"]
+
+    # only texts that are not certainly English need LibreTranslate
+    english = detect_english_series(text)
+    df["source"] = "en"
+    df["translated"] = text
+    if not english.all():
+        results = translate_with_cache(text[~english], cache=cache)
+        df.loc[~english, "source"] = [source_language for source_language, _ in results]
+        df.loc[~english, "translated"] = [translated for _, translated in results]
+
+    df["remove_stopword"] = remove_stopwords_series(df["translated"])
+    df["lemmatization"] = get_lemma_batch(df["remove_stopword"], n_process=n_process)
+
+    return df[is_not_blank(df["lemmatization"])]
+
+
+def load_progress(progress_path):
+    """
+    Load the progress of an interrupted run
+    """
+    if not os.path.exists(progress_path):
+        return {"chunks_done": 0, "rows_done": 0, "output_bytes": 0}
+    with open(progress_path, "r") as f:
+        return json.load(f)
+
+
+def save_progress(progress_path, progress):
+    """
+    Atomically save the progress after a finished chunk
+    """
+    tmp_path = progress_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, progress_path)
+
+
+def load_duplicates(sink, settings, chunk_size, duplicates_path, threshold):
+    """
+    Map the near-duplicate rows of a raw file to their representative rows, both
+    as row_id, the position in the order the chunks are read. The mapping is
+    saved next to the processed file, so an interrupted run skips the same rows.
+    """
+    if os.path.exists(duplicates_path):
+        return pd.read_csv(duplicates_path)
+
+    # only the MinHash signatures of the texts are kept, not the texts
+    text_column = settings["text_column"]
+    chunks = sink.read_chunks(columns=[text_column], chunk_size=chunk_size)
+    representatives = find_representatives(
+        (chunk[text_column] for chunk in chunks), threshold=threshold
+    )
+
+    row_ids = np.flatnonzero(representatives != np.arange(len(representatives)))
+    duplicates = pd.DataFrame(
+        {"row_id": row_ids, "representative_id": representatives[row_ids]}
+    )
+    tmp_path = duplicates_path + ".tmp"
+    duplicates.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, duplicates_path)
+    print(f"{len(duplicates)} of {len(representatives)} rows are near-duplicates")
+
+    return duplicates
+
+
+def preprocess_file(
+    name: str,
+    source: str,
+    chunk_size: int = CHUNK_SIZE,
+    n_process: int = 1,
+    cache: TranslationCache = None,
+    restart: bool = False,
+    duplicate_threshold: float = None,
+):
+    """
+    Stream one celebrity's raw file through the preprocessing chain and append
+    each finished chunk to the processed file. An interrupted run resumes after
+    the last finished chunk.
+
+    Near-duplicate rows are skipped, the processed rows keep their row_id and
+    the number of rows they represent in duplicates; the mapping of skipped rows
+    to their representatives is saved as *_duplicates.csv. duplicate_threshold
+    overrides the source's threshold: 1 only collapses rows with the same
+    shingles, above 1 keeps all rows.
+    """
+    settings = SOURCES[source]
+    sink = find_sink(RAW_DATA_PATH, settings["dataset"], name)
+    output_path = os.path.join(
+        PROCESSED_DATA_PATH, settings["output"].format(name=name)
+    )
+    progress_path = output_path + ".progress"
+    duplicates_path = os.path.splitext(output_path)[0] + "_duplicates.csv"
+
+    if sink is None:
+        print(f"Could not find {name}'s {settings['dataset']} data, skipping.")
+        return None
+
+    if cache is None:
+        cache = TranslationCache()
+
+    if restart:
+        for path in [progress_path, duplicates_path]:
+            if os.path.exists(path):
+                os.remove(path)
+    elif os.path.exists(output_path) and not os.path.exists(progress_path):
+        print(f"{output_path} is already complete, use restart to rebuild it.")
+        return output_path
+
+    progress = load_progress(progress_path)
+    # resuming has to use the chunk boundaries of the interrupted run
+    chunk_size = progress.setdefault("chunk_size", chunk_size)
+    save_progress(progress_path, progress)
+
+    # drop a chunk that was written but not recorded before the crash
+    with open(output_path, "a+b") as f:
+        f.truncate(progress["output_bytes"])
+
+    if duplicate_threshold is None:
+        duplicate_threshold = settings["duplicate_threshold"]
+    with METRICS.stage(f"deduplicate.{source}"):
+        duplicates = load_duplicates(
+            sink, settings, chunk_size, duplicates_path, duplicate_threshold
+        )
+    skipped = duplicates["row_id"].to_numpy()
+    group_sizes = duplicates["representative_id"].value_counts()
+
+    print(f"Preprocessing {sink.path} from row {progress['rows_done']}...")
+
+    reader = sink.read_chunks(columns=settings["columns"], chunk_size=chunk_size)
+    for i, chunk in enumerate(reader):
+        if i < progress["chunks_done"]:
+            continue
+
+        row_ids = pd.RangeIndex(
+            progress["rows_done"], progress["rows_done"] + len(chunk)
+        )
+        chunk.insert(0, "row_id", row_ids)
+        chunk["duplicates"] = 1 + group_sizes.reindex(row_ids, fill_value=0).to_numpy()
+        representatives = chunk[~np.isin(row_ids, skipped)]
+
+        with METRICS.stage(f"preprocess.{source}", len(representatives)):
+            processed = preprocess_chunk(
+                representatives, source, cache, n_process=n_process
+            )
+        with METRICS.stage("write.processed", len(processed)):
+            processed.to_csv(
+                output_path,
+                mode="a",
+                header=progress["output_bytes"] == 0,
+                index=False,
+            )
+
+        progress["chunks_done"] += 1
+        progress["rows_done"] += len(chunk)
+        progress["output_bytes"] = os.path.getsize(output_path)
+        save_progress(progress_path, progress)
+        print(f"{name} {source}: {progress['rows_done']} rows processed")
+
+    # a finished file has no progress marker
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    print(f"Data successfully saved to {output_path}")
+
+    return output_path
@@ -0,0 +1,214 @@
+"""
+Bootstrap and permutation tests of the difference in means between the samples
+before and after a cancellation date. Comparisons with the same metric columns
+are resampled together: each block of resamples is one index matrix over the
+concatenated samples, reduced per sample with np.add.reduceat.
+"""
+
+import numpy as np
+import pandas as pd
+
+from dataset_loader import get_celebrity, get_window
+
+N_RESAMPLES = 2000
+# upper bound of resampled rows held in memory at once
+MAX_BLOCK_SIZE = 2**22
+
+RESULT_COLUMNS = [
+    "key",
+    "metric",
+    "n_before",
+    "n_after",
+    "mean_before",
+    "mean_after",
+    "difference",
+    "ci_low",
+    "ci_high",
+    "p_value",
+]
+
+
+def split_at_cancellation(
+    df: pd.DataFrame,
+    name: str,
+    date_column: str,
+    months_before=None,
+    months_after=None,
+):
+    """
+    Split a celebrity's rows into the samples before and after the cancellation
+    date, optionally limited to a number of months on either side
+    """
+    dates = pd.to_datetime(df[date_column], utc=True)
+    cancellation_date = get_celebrity(name)["cancellation_date"]
+    start, end = get_window(name, months_before, months_after)
+
+    before = dates < cancellation_date
+    after = ~before
+    if start is not None:
+        before &= dates >= start
+    if end is not None:
+        after &= dates < end
+
+    return df[before], df[after]
+
+
+def to_frame(sample) -> pd.DataFrame:
+    """
+    Turn a sample into a float64 DataFrame of metric columns without null rows
+    """
+    if isinstance(sample, pd.Series):
+        sample = sample.to_frame(sample.name if sample.name is not None else "value")
+    elif not isinstance(sample, pd.DataFrame):
+        sample = np.asarray(sample)
+        if sample.ndim == 1:
+            sample = pd.DataFrame({"value": sample})
+        else:
+            sample = pd.DataFrame(sample)
+
+    return sample.apply(pd.to_numeric, errors="coerce").astype(np.float64).dropna()
+
+
+def group_samples(samples: dict) -> dict:
+    """
+    Group the comparisons by their metric columns, so each group is resampled
+    with one index matrix shared by all of its metrics
+    """
+    groups = {}
+    for key, (before, after) in samples.items():
+        before = to_frame(before)
+        after = to_frame(after)
+        columns = tuple(column for column in before.columns if column in after.columns)
+        if len(before) == 0 or len(after) == 0 or not columns:
+            print(f"Skipping {key}: empty sample")
+            continue
+        groups.setdefault(columns, []).append(
+            (key, before[list(columns)].to_numpy(), after[list(columns)].to_numpy())
+        )
+    return groups
+
+
+def resample_index(starts, lengths, method, block, rng):
+    """
+    Index matrix of shape (block, n_rows) resampling every sample.
+
+    The samples are contiguous row ranges, sample 2i is the before and 2i + 1
+    the after sample of comparison i.
+    """
+    total = lengths.sum()
+
+    if method == "bootstrap":
+        # draw every sample's rows with replacement from its own range
+        index = np.empty((block, total), dtype=np.int64)
+        for start, length in zip(starts, lengths):
+            index[:, start : start + length] = rng.integers(
+                start, start + length, size=(block, length)
+            )
+        return index
+
+    if method == "permutation":
+        # shuffle the pooled before and after rows of each comparison
+        index = np.broadcast_to(np.arange(total), (block, total))
+        index = index.copy()
+        for start, end in zip(starts[0::2], starts[1::2] + lengths[1::2]):
+            rng.permuted(index[:, start:end], axis=1, out=index[:, start:end])
+        return index
+
+    raise ValueError(f"Unknown method: {method}")
+
+
+def resample_group(comparisons, method, n_resamples, rng):
+    """
+    Observed and resampled differences in means of comparisons sharing metrics
+    """
+    samples = [sample for _, before, after in comparisons for sample in (before, after)]
+    values = np.concatenate(samples)
+    lengths = np.array([len(sample) for sample in samples], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    means = np.add.reduceat(values, starts, axis=0) / lengths[:, None]
+    observed = means[1::2] - means[0::2]
+
+    # gather whole float64 rows as single opaque items, one copy per index
+    n_metrics = values.shape[1]
+    rows = np.ascontiguousarray(values, dtype=np.float64)
+    rows = rows.view(np.dtype((np.void, rows.itemsize * n_metrics))).ravel()
+
+    block_size = max(1, MAX_BLOCK_SIZE // len(values))
+    differences = []
+    for done in range(0, n_resamples, block_size):
+        block = min(block_size, n_resamples - done)
+        index = resample_index(starts, lengths, method, block, rng)
+        resampled = rows[index].view(np.float64).reshape(block, -1, n_metrics)
+        resampled = np.add.reduceat(resampled, starts, axis=1) / lengths[:, None]
+        differences.append(resampled[:, 1::2] - resampled[:, 0::2])
+
+    return means, observed, np.concatenate(differences)
+
+
+def resample_test(
+    samples: dict,
+    method: str = "bootstrap",
+    n_resamples: int = N_RESAMPLES,
+    confidence: float = 0.95,
+    seed: int = 42,
+) -> pd.DataFrame:
+    """
+    Test the difference in means (after - before) of every comparison and metric.
+
+    samples maps a key, e.g. ("kanye_west", "ratio"), to a (before, after) pair
+    of arrays, Series or DataFrames; DataFrames are tested per column. The
+    confidence interval is the percentile interval of the bootstrap differences
+    ("bootstrap") or of the difference under the null hypothesis
+    ("permutation"). The p-value is two-sided.
+    """
+    rng = np.random.default_rng(seed)
+    alpha = 1 - confidence
+
+    results = []
+    for columns, comparisons in group_samples(samples).items():
+        means, observed, differences = resample_group(
+            comparisons, method, n_resamples, rng
+        )
+        if method == "bootstrap":
+            # shift the bootstrap distribution to the null hypothesis
+            extreme = np.abs(differences - observed) >= np.abs(observed)
+        else:
+            extreme = np.abs(differences) >= np.abs(observed)
+
+        ci_low = np.quantile(differences, alpha / 2, axis=0)
+        ci_high = np.quantile(differences, 1 - alpha / 2, axis=0)
+        p_value = (extreme.sum(axis=0) + 1) / (n_resamples + 1)
+
+        for i, (key, before, after) in enumerate(comparisons):
+            for j, metric in enumerate(columns):
+                results.append(
+                    {
+                        "key": key,
+                        "metric": metric,
+                        "n_before": len(before),
+                        "n_after": len(after),
+                        "mean_before": means[2 * i, j],
+                        "mean_after": means[2 * i + 1, j],
+                        "difference": observed[i, j],
+                        "ci_low": ci_low[i, j],
+                        "ci_high": ci_high[i, j],
+                        "p_value": p_value[i, j],
+                    }
+                )
+
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+
+def bootstrap_test(samples: dict, **kwargs) -> pd.DataFrame:
+    """
+    Bootstrap confidence intervals and p-values, see resample_test
+    """
+    return resample_test(samples, method="bootstrap", **kwargs)
+
+
+def permutation_test(samples: dict, **kwargs) -> pd.DataFrame:
+    """
+    Permutation p-values, see resample_test
+    """
+    return resample_test(samples, method="permutation", **kwargs)
@@ -0,0 +1,143 @@
+"""
+Balanced samples before and after the cancellation date in a single pass over
+chunks of rows, so comment dumps larger than memory can be sampled.
+
+Every row gets a uniform random key from a generator seeded with random_state,
+and each side of the cancellation date keeps the rows with the smallest keys
+(bottom-k reservoir sampling). The k smallest keys are a uniform sample without
+replacement, and the n smallest of them for any n up to k as well, so the
+sample size can be settled once both sides are counted. The keys follow the
+order of the rows, so the sample does not depend on the chunk size.
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from dataset_loader import get_celebrity
+from helpers.instrumentation import METRICS
+
+MAX_SAMPLES = 10000
+RANDOM_STATE = 42
+
+
+def concat_frames(frames: list) -> pd.DataFrame:
+    """
+    Concatenate frames keeping categorical columns categorical, even where
+    the chunks have different categories
+    """
+    frames = [df for df in frames if df is not None]
+    categorical = [
+        column
+        for column in frames[0].columns
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype)
+    ]
+    if categorical and len(frames) > 1:
+        frames = [df.copy() for df in frames]
+        for column in categorical:
+            categories = union_categoricals(
+                [df[column] for df in frames], ignore_order=True
+            ).categories
+            for df in frames:
+                df[column] = df[column].cat.set_categories(categories)
+    return pd.concat(frames)
+
+
+class Reservoir:
+    """
+    Uniform sample without replacement of up to size rows of a stream, the
+    rows with the smallest random keys
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+        self.rows = None
+        self.keys = np.empty(0)
+
+    def add(self, df: pd.DataFrame, keys: np.ndarray) -> None:
+        self.count += len(df)
+        if self.size == 0:
+            return
+        if len(self.keys) == self.size:
+            # rows with larger keys than the whole reservoir can't get in
+            can_enter = keys < self.keys.max()
+            df = df[can_enter]
+            keys = keys[can_enter]
+        rows = concat_frames([self.rows, df])
+        keys = np.concatenate([self.keys, keys])
+        if len(keys) > self.size:
+            keep = np.argpartition(keys, self.size - 1)[: self.size]
+            rows = rows.iloc[keep]
+            keys = keys[keep]
+        self.rows = rows
+        self.keys = keys
+
+    def take(self, n_samples: int) -> pd.DataFrame:
+        """
+        The n_samples rows with the smallest keys, in random order like
+        sklearn.utils.resample
+        """
+        order = np.argsort(self.keys, kind="stable")[:n_samples]
+        return self.rows.iloc[order]
+
+
+def iter_chunks(data, chunk_size: int):
+    """
+    Chunks of a DataFrame, or the chunks of an iterable as they are
+    """
+    if isinstance(data, pd.DataFrame):
+        for start in range(0, max(len(data), 1), chunk_size):
+            yield data.iloc[start : start + chunk_size]
+    else:
+        yield from data
+
+
+def balance_dataset(
+    data,
+    name: str,
+    max_samples: int = MAX_SAMPLES,
+    random_state: int = RANDOM_STATE,
+    date_column: str = "updateDt",
+    chunk_size: int = 100000,
+) -> pd.DataFrame:
+    """
+    Sample the same number of rows before and after a celebrity's cancellation
+    date, as many as the smaller side has but at most max_samples, without
+    replacement. data is a DataFrame or an iterable of chunks, e.g.
+    dataset_loader.read_chunks(name, "youtube_comments"); only one chunk and
+    max_samples rows per side are held in memory. Rows without a date are left
+    out. The same random_state gives the same sample.
+    """
+    split_date = get_celebrity(name)["cancellation_date"]
+    print(f"{name}'s canceled date: {split_date}")
+
+    rng = np.random.default_rng(random_state)
+    before = Reservoir(max_samples)
+    after = Reservoir(max_samples)
+
+    with METRICS.stage("balance_dataset") as stage:
+        columns = None
+        for chunk in iter_chunks(data, chunk_size):
+            columns = chunk.columns
+            keys = rng.random(len(chunk))
+            dates = pd.to_datetime(chunk[date_column], utc=True, format="ISO8601")
+            is_before = (dates < split_date).to_numpy()
+            is_after = (dates >= split_date).to_numpy()
+            before.add(chunk[is_before], keys[is_before])
+            after.add(chunk[is_after], keys[is_after])
+            stage.rows += len(chunk)
+
+    print(
+        f"{name}'s Before canceled date data: {before.count}, After canceled date data: {after.count}"
+    )
+    if before.rows is None:
+        return pd.DataFrame(columns=columns)
+
+    n_samples = min(before.count, after.count, max_samples)
+    df_balanced = concat_frames([before.take(n_samples), after.take(n_samples)])
+
+    print(
+        f"{name}'s Before canceled date data: {n_samples}, After canceled date data: {n_samples}\n"
+    )
+    return df_balanced
@@ -0,0 +1,56 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+from helpers.instrumentation import METRICS
+from nlp_resources import get_sentiment_analyzer
+
+SENTIMENT_COLUMNS = ["neg", "neu", "pos", "compound"]
+
+
+def score_texts(texts):
+    """
+    Score a list of texts with VADER into a float32 array of neg/neu/pos/compound
+    """
+    senti_analyzer = get_sentiment_analyzer()
+
+    scores = np.empty((len(texts), len(SENTIMENT_COLUMNS)), dtype=np.float32)
+    for i, text in enumerate(texts):
+        senti_scores = senti_analyzer.polarity_scores(str(text))
+        scores[i] = [senti_scores[column] for column in SENTIMENT_COLUMNS]
+
+    return scores
+
+
+def get_sentiment_scores(texts, n_process=1, chunk_size=5000):
+    """
+    Score a whole column of texts, optionally across a process pool
+    """
+    if isinstance(texts, pd.Series):
+        texts = texts.tolist()
+    else:
+        texts = list(texts)
+
+    with METRICS.stage("sentiment", len(texts)):
+        if n_process <= 1 or len(texts) <= chunk_size:
+            return score_texts(texts)
+
+        chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        with ProcessPoolExecutor(max_workers=n_process) as executor:
+            results = list(executor.map(score_texts, chunks))
+
+        return np.concatenate(results)
+
+
+def sentiment_ttest(scores_before, scores_after, column="compound", paired=False):
+    """
+    Run a t-test on one score column of the before and after arrays
+    """
+    index = SENTIMENT_COLUMNS.index(column)
+    before = scores_before[:, index].astype(np.float64)
+    after = scores_after[:, index].astype(np.float64)
+
+    if paired:
+        return scipy.stats.ttest_rel(before, after)
+    return scipy.stats.ttest_ind(before, after)
@@ -0,0 +1,61 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import pandas as pd
+
+from analyzer_functions import remove_emojis, remove_stopwords
+from helpers.instrumentation import METRICS
+
+
+def apply_to_texts(function, texts):
+    """
+    Apply a text function to a list of texts
+    """
+    return [function(text) for text in texts]
+
+
+def apply_to_series(function, texts, n_process=1, chunk_size=50000):
+    """
+    Apply a text function to the non-null values of a Series, aligned to its index.
+    With n_process > 1 the values are split into chunks across a process pool.
+    """
+    if not isinstance(texts, pd.Series):
+        texts = pd.Series(list(texts), dtype=object)
+
+    mask = texts.notnull()
+    values = texts[mask]
+    result = pd.Series(pd.NA, index=texts.index, dtype=object)
+    if values.empty:
+        return result
+
+    values_list = values.astype(str).tolist()
+    with METRICS.stage(function.__name__, len(values_list)):
+        if n_process <= 1 or len(values_list) <= chunk_size:
+            processed = apply_to_texts(function, values_list)
+        else:
+            chunks = [
+                values_list[i : i + chunk_size]
+                for i in range(0, len(values_list), chunk_size)
+            ]
+            with ProcessPoolExecutor(max_workers=n_process) as executor:
+                processed = [
+                    text
+                    for chunk in executor.map(apply_to_texts, repeat(function), chunks)
+                    for text in chunk
+                ]
+
+    result[mask] = processed
+    return result
+
+
+def remove_emojis_series(texts, n_process=1, chunk_size=50000):
+    """
+    Remove emojis from every text of a Series
+    """
+    return apply_to_series(remove_emojis, texts, n_process, chunk_size)
+
+
+def remove_stopwords_series(texts, n_process=1, chunk_size=50000):
+    """
+    Remove stopwords from every text of a Series
+    """
+    return apply_to_series(remove_stopwords, texts, n_process, chunk_size)
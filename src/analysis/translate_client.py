@@ -0,0 +1,164 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import asyncio
+import time
+
+import aiohttp
+
+from helpers.instrumentation import METRICS
+
+LIBRE_TRANSLATE_URL = "http://127.0.0.1:5000/translate"
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LibreTranslateClient:
+    """
+    Asyncio LibreTranslate client with a persistent session, a concurrency limit
+    and multi-text requests
+    """
+
+    def __init__(
+        self,
+        url: str = LIBRE_TRANSLATE_URL,
+        concurrency: int = 4,
+        batch_size: int = 32,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 120,
+    ):
+        self.url = url
+        self.host = urlsplit(url).netloc
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = None
+        self.stats = {
+            "texts": 0,
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "elapsed": 0.0,
+        }
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    async def translate_batch(self, texts, semaphore):
+        """
+        Translate one batch of texts in a single request, retrying with backoff
+        """
+        payload = {"q": texts, "source": "auto", "target": "en"}
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                async with semaphore:
+                    self.stats["requests"] += 1
+                    start = time.perf_counter()
+                    async with self.session.post(self.url, json=payload) as response:
+                        body = await response.read()
+                        METRICS.record_request(
+                            self.host,
+                            time.perf_counter() - start,
+                            response.status,
+                            len(body),
+                            retries=1 if attempt else 0,
+                        )
+                        if response.status in RETRY_STATUS_CODES:
+                            continue
+                        if response.status != 200:
+                            break
+                        data = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                elapsed = time.perf_counter() - start
+                METRICS.record_request(
+                    self.host, elapsed, type(e).__name__, retries=1 if attempt else 0
+                )
+                print(f"Error translating batch of {len(texts)} texts: {e}")
+                continue
+
+            detected = data["detectedLanguage"]
+            if isinstance(detected, dict):
+                detected = [detected] * len(texts)
+            return [
+                (language["language"], translated)
+                for language, translated in zip(detected, data["translatedText"])
+            ]
+
+        self.stats["failures"] += len(texts)
+        return [("error", text) for text in texts]
+
+    async def translate(self, texts):
+        """
+        Translate texts and return a list of (source, translated) in input order
+        """
+        texts = list(texts)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batches = [
+            texts[i : i + self.batch_size]
+            for i in range(0, len(texts), self.batch_size)
+        ]
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(self.translate_batch(batch, semaphore) for batch in batches)
+        )
+        self.stats["elapsed"] += time.perf_counter() - start
+        self.stats["texts"] += len(texts)
+
+        return [result for batch in results for result in batch]
+
+    def throughput(self):
+        """
+        Translated texts and requests per second so far
+        """
+        elapsed = self.stats["elapsed"] or float("nan")
+        return {
+            **self.stats,
+            "texts_per_second": self.stats["texts"] / elapsed,
+            "requests_per_second": self.stats["requests"] / elapsed,
+        }
+
+
+async def translate_texts_async(texts, **kwargs):
+    """
+    Translate texts with a fresh client and print its throughput
+    """
+    async with LibreTranslateClient(**kwargs) as client:
+        results = await client.translate(texts)
+
+    stats = client.throughput()
+    print(
+        f"Translated {stats['texts']} texts in {stats['elapsed']:.1f}s "
+        f"({stats['texts_per_second']:.1f} texts/s, {stats['requests']} requests, "
+        f"{stats['retries']} retries, {stats['failures']} failed)"
+    )
+    return results
+
+
+def translate_texts(texts, **kwargs):
+    """
+    Blocking wrapper around translate_texts_async that also works inside notebooks
+    """
+    coroutine = translate_texts_async(texts, **kwargs)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # a Jupyter kernel already runs an event loop in this thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import sqlite3
+import time
+import unicodedata
+
+from config import CACHE_DATA_PATH
+from helpers.instrumentation import METRICS
+from translate_client import translate_texts
+
+DEFAULT_CACHE_FILE = os.path.join(CACHE_DATA_PATH, "translations.sqlite")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def normalize_text(text):
+    """
+    Normalize a text before hashing so trivial variants share a cache entry
+    """
+    return " ".join(unicodedata.normalize("NFC", str(text)).split())
+
+
+def text_key(text):
+    """
+    Content hash of the normalized text
+    """
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class TranslationCache:
+    """
+    On-disk SQLite cache of LibreTranslate results keyed by text hash
+    """
+
+    def __init__(self, file_path=DEFAULT_CACHE_FILE, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # the stage runner preprocesses celebrities in parallel processes
+        self.connection = sqlite3.connect(
+            file_path, timeout=60, check_same_thread=False
+        )
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                translated TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """)
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)"
+        )
+        self.connection.commit()
+
+    def get_many(self, keys):
+        """
+        Look up keys, returning a dict of key -> (source, translated) for the hits
+        """
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i : i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT key, source, translated FROM translations WHERE key IN ({placeholders})",
+                chunk,
+            )
+            for key, source, translated in rows:
+                found[key] = (source, translated)
+
+        if found:
+            now = time.time()
+            self.connection.executemany(
+                "UPDATE translations SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+            self.connection.commit()
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        """
+        Store a dict of key -> (source, translated) and evict if over the size limit
+        """
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+            [
+                (key, source, translated, len(translated.encode("utf-8")) + 64, now)
+                for key, (source, translated) in items.items()
+            ],
+        )
+        self.connection.commit()
+        self.evict()
+
+    def size(self):
+        """
+        Approximate size of the cached entries in bytes
+        """
+        (total,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM translations"
+        ).fetchone()
+        return total
+
+    def evict(self):
+        """
+        Drop the least recently used entries until the cache fits in max_bytes
+        """
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return 0
+
+        evicted = []
+        rows = self.connection.execute(
+            "SELECT key, size FROM translations ORDER BY last_used"
+        )
+        for key, size in rows:
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+
+        self.connection.executemany("DELETE FROM translations WHERE key = ?", evicted)
+        self.connection.commit()
+        return len(evicted)
+
+    def stats(self):
+        """
+        Hit/miss statistics of this cache instance
+        """
+        (entries,) = self.connection.execute(
+            "SELECT COUNT(*) FROM translations"
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self.size(),
+        }
+
+    def close(self):
+        self.connection.close()
+
+
+def translate_with_cache(texts, cache=None, **client_kwargs):
+    """
+    Translate texts through the cache, sending each unique uncached text only once.
+    Returns a list of (source, translated) aligned to the input.
+    """
+    if cache is None:
+        cache = TranslationCache()
+
+    texts = list(texts)
+    keys = [text_key(text) for text in texts]
+
+    # deduplicate within the batch before touching the cache or the API
+    unique = {}
+    for key, text in zip(keys, texts):
+        unique.setdefault(key, text)
+
+    results = cache.get_many(unique)
+    missing = [key for key in unique if key not in results]
+    print(f"Translation cache: {len(results)} hits, {len(missing)} to translate")
+
+    if missing:
+        with METRICS.stage("translate", len(missing)):
+            translated = translate_texts(
+                [unique[key] for key in missing], **client_kwargs
+            )
+
+        new_results = {
+            key: result
+            for key, result in zip(missing, translated)
+            if result[0] != "error"
+        }
+        cache.set_many(new_results)
+        results.update(zip(missing, translated))
+
+    return [results[key] for key in keys]
@@ -0,0 +1,513 @@
+"""
+Throughput benchmarks of the crawlers against local stub services and of the
+preprocessing stages on synthetic corpora of 10k to 1M rows. The results are
+written as JSON with one entry per benchmark and corpus size, tagged with the
+git commit, so runs can be compared across commits.
+"""
+
+from datetime import date, datetime, timezone
+import argparse
+import contextlib
+import functools
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, SRC_PATH)
+sys.path.insert(0, os.path.join(SRC_PATH, "analysis"))
+sys.path.insert(0, os.path.join(SRC_PATH, "data_crawlers"))
+
+import pandas as pd
+
+from config import CWD
+from helpers.file_functions import open_sink
+from helpers.http_cache import HttpCache, set_http_cache
+from helpers.instrumentation import METRICS
+from helpers.rate_limiter import TokenBucket
+from helpers.request_scheduler import RequestScheduler
+from stub_services import (
+    BILLBOARD_FIRST_DATE,
+    CHART_SIZE,
+    BillboardStub,
+    GNewsStub,
+    LibreTranslateStub,
+    YouTubeStub,
+)
+from synthetic_data import generate_articles, generate_comments
+
+BENCHMARK_DATA_PATH = os.path.join(CWD, "data", "benchmarks")
+SIZES = [10_000, 100_000, 1_000_000]
+COMMENTS_PER_VIDEO = 1000
+# stands in for a config.json row
+CELEBRITY = {
+    "name": "benchmark",
+    "search_term": "benchmark",
+    "start_date": pd.Timestamp("2020-01-01", tz="UTC"),
+    "end_date": pd.Timestamp("2023-01-01", tz="UTC"),
+}
+
+# benchmark name -> (function, largest corpus size it runs on)
+BENCHMARKS = {}
+
+
+def benchmark(name: str, max_size: int = None):
+    """
+    Register a benchmark function, called with the corpus size and the command
+    line arguments and returning its measured seconds, rows and request stats
+    """
+
+    def register(function):
+        BENCHMARKS[name] = (function, max_size)
+        return function
+
+    return register
+
+
+@functools.cache
+def get_comment_corpus(size: int) -> pd.DataFrame:
+    """
+    Synthetic comments, at most MAX_VIDEO_COUNT videos as the crawler takes
+    """
+    from youtube_data_crawler import MAX_VIDEO_COUNT
+
+    n_videos = min(max(size // COMMENTS_PER_VIDEO, 1), MAX_VIDEO_COUNT)
+    return generate_comments(size, n_videos)
+
+
+@functools.cache
+def get_article_corpus(size: int) -> pd.DataFrame:
+    return generate_articles(size)
+
+
+@contextlib.contextmanager
+def patched(module, **values):
+    """
+    Temporarily replace module globals, e.g. the API URL and data path of a crawler
+    """
+    original = {key: getattr(module, key) for key in values}
+    for key, value in values.items():
+        setattr(module, key, value)
+    try:
+        yield module
+    finally:
+        for key, value in original.items():
+            setattr(module, key, value)
+
+
+def timed(function, *args, **kwargs):
+    """
+    Call a function, returns its result and the elapsed seconds
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def get_client_rate_limiter(args) -> TokenBucket:
+    """
+    Client side rate limiter matching the stub's limit, effectively none without
+    """
+    return TokenBucket(args.rate_limit or 1e9)
+
+
+def check_rows(rows: int, expected: int, what: str) -> None:
+    """
+    Fail a benchmark whose crawler lost rows, its throughput would be misleading
+    """
+    if rows != expected:
+        raise ValueError(f"crawled {rows} of {expected} {what}")
+
+
+@contextlib.contextmanager
+def temporary_http_cache(directory: str, mode: str = "off"):
+    """
+    Route the crawlers' requests through an HTTP cache in a temporary directory,
+    by default bypassed so every request reaches the stub
+    """
+    cache = HttpCache(os.path.join(directory, "http_cache.sqlite"), mode=mode)
+    previous = set_http_cache(cache)
+    try:
+        yield cache
+    finally:
+        set_http_cache(previous)
+        cache.close()
+
+
+def crawl_youtube(stub: YouTubeStub, raw_path: str, args) -> tuple:
+    """
+    Crawl the stub's comments from scratch, returns their count and the seconds
+    """
+    import youtube_data_crawler as crawler
+
+    with patched(crawler, YOUTUBE_API_URL=stub.api_url, RAW_DATA_PATH=raw_path):
+        with RequestScheduler(
+            max_workers=args.max_workers, host_limits={stub.host: args.host_limit}
+        ) as scheduler:
+            (comment_count, _), seconds = timed(
+                crawler.process_single_celebrity,
+                CELEBRITY,
+                scheduler,
+                mode="restart",
+            )
+    return comment_count, seconds
+
+
+@benchmark("crawler.youtube", max_size=1_000_000)
+def benchmark_youtube_crawler(size, args):
+    comments = get_comment_corpus(size)
+    with YouTubeStub(
+        comments, latency=args.latency, rate_limit=args.rate_limit
+    ) as stub, tempfile.TemporaryDirectory() as raw_path:
+        with temporary_http_cache(raw_path):
+            comment_count, seconds = crawl_youtube(stub, raw_path, args)
+        check_rows(comment_count, len(comments), "comments")
+        return {"seconds": seconds, "rows": comment_count, **stub.stats}
+
+
+@benchmark("crawler.youtube_replay", max_size=1_000_000)
+def benchmark_youtube_replay(size, args):
+    """
+    The YouTube crawl again from the HTTP cache in offline mode
+    """
+    comments = get_comment_corpus(size)
+    with YouTubeStub(
+        comments, latency=args.latency, rate_limit=args.rate_limit
+    ) as stub, tempfile.TemporaryDirectory() as raw_path:
+        with temporary_http_cache(raw_path, mode="normal") as cache:
+            crawl_youtube(stub, raw_path, args)
+            cache.mode = "offline"
+            requests_before = stub.stats["requests"]
+            comment_count, seconds = crawl_youtube(stub, raw_path, args)
+        return {
+            "seconds": seconds,
+            "rows": comment_count,
+            "requests": stub.stats["requests"] - requests_before,
+            "cache": dict(cache.stats),
+        }
+
+
+@benchmark("crawler.gnews", max_size=100_000)
+def benchmark_gnews_crawler(size, args):
+    import gnews_data_crawler as crawler
+
+    articles = get_article_corpus(size)
+    with GNewsStub(
+        articles, latency=args.latency, rate_limit=args.rate_limit
+    ) as stub, tempfile.TemporaryDirectory() as raw_path:
+        with patched(
+            crawler, GNEWS_API_URL=stub.api_url, RAW_DATA_PATH=raw_path
+        ), temporary_http_cache(raw_path):
+            _, seconds = timed(
+                crawler.crawl_gnews_data,
+                CELEBRITY["name"],
+                CELEBRITY["search_term"],
+                CELEBRITY["start_date"].strftime(crawler.DATE_FORMAT),
+                CELEBRITY["end_date"].strftime(crawler.DATE_FORMAT),
+                mode="restart",
+                rate_limiter=get_client_rate_limiter(args),
+                max_workers=args.max_workers,
+            )
+        rows = len(
+            open_sink(raw_path, "articles_gnews", CELEBRITY["name"]).read(["link"])
+        )
+        check_rows(rows, len(articles), "articles")
+        return {"seconds": seconds, "rows": rows, **stub.stats}
+
+
+@benchmark("crawler.billboard", max_size=50_000)
+def benchmark_billboard_crawler(size, args):
+    import billboard_data_crawler as crawler
+
+    # every chart has CHART_SIZE rows, and only charts up to today are fetched
+    available_weeks = (date.today() - BILLBOARD_FIRST_DATE).days // 7 + 1
+    n_weeks = min(math.ceil(size / CHART_SIZE), available_weeks)
+    with BillboardStub(
+        n_weeks, latency=args.latency, rate_limit=args.rate_limit
+    ) as stub, tempfile.TemporaryDirectory() as tmp_path:
+        csv_file = os.path.join(tmp_path, "billboard.csv")
+        with patched(
+            crawler, BILLBOARD_URL=stub.url, CSV_FILE=csv_file
+        ), temporary_http_cache(tmp_path):
+            _, seconds = timed(
+                crawler.fetch_and_save_billboard_data,
+                incremental=False,
+                max_workers=args.max_workers,
+            )
+        rows = len(pd.read_csv(csv_file)) if os.path.exists(csv_file) else 0
+        return {"seconds": seconds, "rows": rows, **stub.stats}
+
+
+@benchmark("stage.remove_emojis", max_size=1_000_000)
+def benchmark_remove_emojis(size, args):
+    from analyzer_functions import remove_emojis
+
+    texts = get_comment_corpus(size)["text"].tolist()
+    _, seconds = timed(lambda: [remove_emojis(text) for text in texts])
+    return {"seconds": seconds, "rows": len(texts)}
+
+
+@benchmark("stage.detect_english", max_size=1_000_000)
+def benchmark_detect_english(size, args):
+    from analyzer_functions import detect_english_series, get_trigram_model
+
+    texts = get_comment_corpus(size)["text"]
+    get_trigram_model()  # load the profiles outside the measurement
+    english, seconds = timed(detect_english_series, texts)
+    # the share of rows left for LibreTranslate
+    return {"seconds": seconds, "rows": len(texts), "to_translate": 1 - english.mean()}
+
+
+@benchmark("stage.find_duplicates", max_size=1_000_000)
+def benchmark_find_duplicates(size, args):
+    from deduplication import find_duplicates
+
+    texts = get_comment_corpus(size)["text"]
+    representatives, seconds = timed(find_duplicates, texts)
+    duplicates = (representatives.to_numpy() != representatives.index).mean()
+    return {"seconds": seconds, "rows": len(texts), "duplicates": duplicates}
+
+
+@benchmark("stage.balance_dataset")
+def benchmark_balance_dataset(size, args):
+    from dataset_loader import SOURCES, compact_dtypes, read_csv_chunks
+    from sampling import balance_dataset
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "comments.csv")
+        get_comment_corpus(size).to_csv(file_path, index=False)
+        chunks = read_csv_chunks(
+            file_path, compact_dtypes(SOURCES["youtube_comments"]), "updateDt"
+        )
+        sample, seconds = timed(balance_dataset, chunks, "kanye_west")
+        return {"seconds": seconds, "rows": size, "sampled": len(sample)}
+
+
+@benchmark("stage.libre_translate", max_size=10_000)
+def benchmark_libre_translate(size, args):
+    from analyzer_functions import libre_translate
+
+    texts = get_comment_corpus(size)["text"].tolist()
+    with LibreTranslateStub(latency=args.latency, rate_limit=args.rate_limit) as stub:
+        _, seconds = timed(
+            lambda: [libre_translate(text, stub.api_url) for text in texts]
+        )
+        return {"seconds": seconds, "rows": len(texts), **stub.stats}
+
+
+@benchmark("stage.translate_texts", max_size=1_000_000)
+def benchmark_translate_texts(size, args):
+    from translate_client import translate_texts
+
+    texts = get_comment_corpus(size)["text"].tolist()
+    with LibreTranslateStub(latency=args.latency, rate_limit=args.rate_limit) as stub:
+        _, seconds = timed(translate_texts, texts, url=stub.api_url)
+        return {"seconds": seconds, "rows": len(texts), **stub.stats}
+
+
+@benchmark("stage.remove_stopwords", max_size=1_000_000)
+def benchmark_remove_stopwords(size, args):
+    from analyzer_functions import remove_stopwords
+
+    texts = get_comment_corpus(size)["text"].tolist()
+    remove_stopwords("")  # load the stopwords outside the measurement
+    _, seconds = timed(lambda: [remove_stopwords(text) for text in texts])
+    return {"seconds": seconds, "rows": len(texts)}
+
+
+@benchmark("stage.get_lemma_batch", max_size=100_000)
+def benchmark_get_lemma_batch(size, args):
+    from analyzer_functions import get_lemma_batch
+    from nlp_resources import get_nlp
+
+    texts = get_comment_corpus(size)["text"]
+    get_nlp()  # load the model outside the measurement
+    _, seconds = timed(get_lemma_batch, texts, n_process=args.n_process)
+    return {"seconds": seconds, "rows": len(texts)}
+
+
+@benchmark("stage.sentiment", max_size=1_000_000)
+def benchmark_sentiment(size, args):
+    from nlp_resources import get_sentiment_analyzer
+    from sentiment_functions import get_sentiment_scores
+
+    texts = get_comment_corpus(size)["text"]
+    get_sentiment_analyzer()  # load the lexicon outside the measurement
+    _, seconds = timed(get_sentiment_scores, texts, n_process=args.n_process)
+    return {"seconds": seconds, "rows": len(texts)}
+
+
+def run_benchmark(name: str, size: int, args) -> dict:
+    """
+    Run one benchmark on one corpus size, a missing model or corpus skips it
+    """
+    function, max_size = BENCHMARKS[name]
+    result = {"benchmark": name, "size": size}
+    if max_size is not None and size > max_size:
+        return {**result, "status": "skipped", "error": f"above {max_size} rows"}
+
+    output = sys.stdout if args.verbose else io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            measurement = function(size, args)
+    except (LookupError, OSError, ImportError) as e:
+        # NLTK frames its messages with lines of asterisks
+        message = [line.strip() for line in str(e).splitlines() if line.strip(" *")]
+        return {**result, "status": "skipped", "error": " ".join(message[:1])}
+    except Exception as e:
+        return {**result, "status": "failed", "error": f"{type(e).__name__}: {e}"}
+
+    seconds = measurement["seconds"]
+    return {
+        **result,
+        "status": "ok",
+        **measurement,
+        "rows_per_second": measurement["rows"] / seconds if seconds else None,
+    }
+
+
+def get_git_commit() -> dict:
+    """
+    Get the checked out commit and whether the working tree has changes
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=CWD,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=CWD,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+
+def run_benchmarks(names: list, sizes: list, args) -> dict:
+    """
+    Run the benchmarks on every corpus size and collect the results with the
+    environment they were measured in
+    """
+    report = {
+        **get_git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "options": {
+            "latency": args.latency,
+            "rate_limit": args.rate_limit,
+            "max_workers": args.max_workers,
+            "host_limit": args.host_limit,
+            "n_process": args.n_process,
+        },
+        "results": [],
+    }
+
+    for size in sizes:
+        for name in names:
+            result = run_benchmark(name, size, args)
+            report["results"].append(result)
+            if result["status"] == "ok":
+                summary = f"{result['rows_per_second']:,.0f} rows/s"
+            else:
+                summary = f"{result['status']}: {result['error']}"
+            print(f"{name} ({size} rows): {summary}", file=sys.stderr)
+
+    # request latencies and stage timings behind the throughput numbers
+    report["metrics"] = METRICS.summary()
+    return report
+
+
+def compare_reports(baseline: dict, report: dict) -> pd.DataFrame:
+    """
+    Rows per second of two reports side by side, with the speedup of the second
+    """
+    frames = [
+        pd.DataFrame(r["results"])
+        .query("status == 'ok'")
+        .set_index(["benchmark", "size"])["rows_per_second"]
+        .rename(label)
+        for r, label in [(baseline, "baseline"), (report, "current")]
+    ]
+    comparison = pd.concat(frames, axis=1)
+    comparison["speedup"] = comparison["current"] / comparison["baseline"]
+    return comparison
+
+
+def get_output_path(report: dict) -> str:
+    commit = (report["commit"] or "unknown")[:10]
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return os.path.join(BENCHMARK_DATA_PATH, f"benchmark_{commit}_{timestamp}.json")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark crawlers and stages")
+    parser.add_argument(
+        "--benchmark",
+        action="append",
+        help="benchmark name or prefix, e.g. crawler or stage.sentiment (default all)",
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=SIZES, help="corpus sizes in rows"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="stub response latency in seconds"
+    )
+    parser.add_argument(
+        "--rate-limit", type=float, help="stub requests per second before 429s"
+    )
+    parser.add_argument("--max-workers", type=int, default=16)
+    parser.add_argument("--host-limit", type=int, default=8)
+    parser.add_argument("--n-process", type=int, default=1)
+    parser.add_argument("--output", help="JSON results file, - for stdout")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "RESULTS"),
+        help="compare two results files instead of running the benchmarks",
+    )
+    parser.add_argument("--verbose", action="store_true", help="show crawler output")
+    args = parser.parse_args()
+
+    if args.compare:
+        reports = []
+        for file_path in args.compare:
+            with open(file_path, "r") as f:
+                reports.append(json.load(f))
+        print(compare_reports(*reports).to_string(float_format="{:,.2f}".format))
+        sys.exit()
+
+    names = [
+        name
+        for name in BENCHMARKS
+        if not args.benchmark
+        or any(name.startswith(prefix) for prefix in args.benchmark)
+    ]
+    report = run_benchmarks(names, args.sizes, args)
+
+    if args.output == "-":
+        print(json.dumps(report, indent=2))
+    else:
+        output_path = args.output or get_output_path(report)
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {output_path}", file=sys.stderr)
+
+    # e.g. a crawler that lost rows, so the run can gate a change
+    if any(result["status"] == "failed" for result in report["results"]):
+        sys.exit(1)
@@ -0,0 +1,337 @@
+"""
+Local stand-ins for the APIs the crawlers and the preprocessing depend on: GNews,
+YouTube via lemnoslife, the Billboard charts on GitHub raw and LibreTranslate.
+They serve synthetic data in the shape of the real responses, optionally after
+a fixed latency and with 429 responses above a request rate.
+"""
+
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import json
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from helpers.rate_limiter import TokenBucket
+
+BILLBOARD_FIRST_DATE = date(2015, 1, 3)
+CHART_SIZE = 100
+
+
+class StubService:
+    """
+    Threaded HTTP server on a free local port.
+
+    Subclasses set routes, a list of (method, path prefix, handler name); a
+    handler gets the path, the query parameters and the JSON body and returns
+    the status code and the JSON payload of the response.
+    """
+
+    routes = []
+
+    def __init__(self, latency: float = 0.0, rate_limit: float = None):
+        self.latency = latency
+        self.rate_limiter = (
+            TokenBucket(rate_limit, capacity=rate_limit) if rate_limit else None
+        )
+        self.stats = {"requests": 0, "rate_limited": 0}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.get_handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def host(self) -> str:
+        return urlsplit(self.url).netloc
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, like the real APIs
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                service.respond(self, "GET")
+
+            def do_POST(self):
+                service.respond(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def respond(self, request: BaseHTTPRequestHandler, method: str) -> None:
+        """
+        Route a request to its handler and write the JSON response
+        """
+        url = urlsplit(request.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(request.headers.get("Content-Length") or 0)
+        body = json.loads(request.rfile.read(length)) if length else None
+
+        with self.lock:
+            self.stats["requests"] += 1
+
+        if self.rate_limiter is not None and not self.rate_limiter.try_acquire():
+            with self.lock:
+                self.stats["rate_limited"] += 1
+            status, payload = 429, {"error": "Too many requests"}
+        else:
+            if self.latency:
+                time.sleep(self.latency)
+            status, payload = 404, {"error": "Not found"}
+            for route_method, prefix, handler in self.routes:
+                if route_method == method and url.path.startswith(prefix):
+                    status, payload = getattr(self, handler)(url.path, query, body)
+                    break
+
+        data = json.dumps(payload).encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+
+class GNewsStub(StubService):
+    """
+    GNews search API serving the articles published within the from/to range
+    """
+
+    routes = [("GET", "/api/v4/search", "search")]
+
+    def __init__(self, articles: pd.DataFrame, **kwargs):
+        super().__init__(**kwargs)
+        self.articles = articles.sort_values("published_on", ignore_index=True)
+        self.published = pd.to_datetime(self.articles["published_on"], utc=True)
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.url}/api/v4/search"
+
+    def search(self, path, query, body):
+        first = self.published.searchsorted(pd.Timestamp(query["from"]), side="left")
+        last = self.published.searchsorted(pd.Timestamp(query["to"]), side="right")
+        page_size = int(query.get("max", 10))
+        start = first + (int(query.get("page", 1)) - 1) * page_size
+        rows = self.articles.iloc[start : min(start + page_size, last)]
+
+        return 200, {
+            "totalArticles": int(last - first),
+            "articles": [
+                {
+                    "title": row.title,
+                    "description": row.content[:200],
+                    "content": row.content,
+                    "url": row.link,
+                    "image": None,
+                    "publishedAt": row.published_on,
+                    # the source URL is the outlet's homepage, shared by its articles
+                    "source": {"name": row.source, "url": row.source_url},
+                }
+                for row in rows.itertuples()
+            ],
+        }
+
+
+class YouTubeStub(StubService):
+    """
+    lemnoslife YouTube API serving search results, comment threads newest
+    first and video statistics
+    """
+
+    routes = [
+        ("GET", "/noKey/search", "search"),
+        ("GET", "/noKey/commentThreads", "comment_threads"),
+        ("GET", "/noKey/videos", "videos"),
+    ]
+
+    def __init__(self, comments: pd.DataFrame, **kwargs):
+        super().__init__(**kwargs)
+        comments = comments.sort_values("updateDt", ascending=False, kind="stable")
+        self.comments = {
+            video_id: (group["text"].tolist(), group["updateDt"].tolist())
+            for video_id, group in comments.groupby("video_id", sort=True)
+        }
+        self.video_ids = list(self.comments)
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.url}/noKey"
+
+    def search(self, path, query, body):
+        start = int(query.get("pageToken", 0))
+        end = start + int(query.get("maxResults", 5))
+        payload = {
+            "items": [
+                {
+                    "id": {"kind": "youtube#video", "videoId": video_id},
+                    "snippet": {"title": f"Video {video_id}"},
+                }
+                for video_id in self.video_ids[start:end]
+            ]
+        }
+        if end < len(self.video_ids):
+            payload["nextPageToken"] = str(end)
+        return 200, payload
+
+    def comment_threads(self, path, query, body):
+        video_id = query["videoId"]
+        if video_id not in self.comments:
+            return 404, {"error": {"code": 404, "message": "Video not found"}}
+
+        texts, dates = self.comments[video_id]
+        start = int(query.get("pageToken", 0))
+        end = start + int(query.get("maxResults", 20))
+        payload = {
+            "items": [
+                {
+                    "id": f"{video_id}-{start + i}",
+                    "snippet": {
+                        "videoId": video_id,
+                        "topLevelComment": {
+                            "snippet": {
+                                "textDisplay": text,
+                                "textOriginal": text,
+                                "likeCount": 0,
+                                "publishedAt": updated,
+                                "updatedAt": updated,
+                            }
+                        },
+                        "totalReplyCount": 0,
+                    },
+                }
+                for i, (text, updated) in enumerate(
+                    zip(texts[start:end], dates[start:end])
+                )
+            ]
+        }
+        if end < len(texts):
+            payload["nextPageToken"] = str(end)
+        return 200, payload
+
+    def videos(self, path, query, body):
+        items = []
+        for video_id in query["id"].split(","):
+            if video_id not in self.comments:
+                continue
+            # stable counts per video
+            seed = zlib.crc32(video_id.encode("utf-8"))
+            items.append(
+                {
+                    "id": video_id,
+                    "statistics": {
+                        "viewCount": str(seed % 10**7),
+                        "likeCount": str(seed % 10**5),
+                        "commentCount": str(len(self.comments[video_id][0])),
+                    },
+                }
+            )
+        return 200, {"items": items}
+
+
+class BillboardStub(StubService):
+    """
+    Billboard Hot 100 charts as served from GitHub raw, one chart per week
+    """
+
+    routes = [
+        ("GET", "/valid_dates.json", "valid_dates"),
+        ("GET", "/date/", "chart"),
+    ]
+
+    def __init__(
+        self, n_weeks: int, n_songs: int = 2000, n_artists: int = 500, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.dates = [
+            (BILLBOARD_FIRST_DATE + timedelta(weeks=week)).isoformat()
+            for week in range(n_weeks)
+        ]
+        rng = np.random.default_rng(42)
+        main = rng.integers(0, n_artists, size=n_songs)
+        featured = rng.integers(0, n_artists, size=n_songs)
+        self.songs = [f"Song {i}" for i in range(n_songs)]
+        self.artists = [
+            f"Artist {main[i]}"
+            + (f" Featuring Artist {featured[i]}" if i % 5 == 0 else "")
+            for i in range(n_songs)
+        ]
+
+    def valid_dates(self, path, query, body):
+        return 200, self.dates
+
+    def chart(self, path, query, body):
+        chart_date = path.rsplit("/", 1)[-1].removesuffix(".json")
+        if chart_date not in self.dates:
+            return 404, {"error": "Not found"}
+
+        rng = np.random.default_rng(zlib.crc32(chart_date.encode("utf-8")))
+        songs = rng.choice(len(self.songs), size=CHART_SIZE, replace=False)
+        last_week = rng.integers(1, CHART_SIZE + 1, size=CHART_SIZE)
+        return 200, {
+            "date": chart_date,
+            "data": [
+                {
+                    "song": self.songs[song],
+                    "artist": self.artists[song],
+                    "this_week": rank + 1,
+                    "last_week": None if rank % 10 == 9 else int(last_week[rank]),
+                    "peak_position": int(min(rank + 1, last_week[rank])),
+                    "weeks_on_chart": int(song % 52 + 1),
+                }
+                for rank, song in enumerate(songs.tolist())
+            ],
+        }
+
+
+class LibreTranslateStub(StubService):
+    """
+    LibreTranslate API, texts with non-ASCII letters are detected as Spanish and
+    returned unchanged like English ones
+    """
+
+    routes = [("POST", "/translate", "translate")]
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.url}/translate"
+
+    @staticmethod
+    def detect(text: str) -> dict:
+        foreign = not text.isascii() and any(
+            char.isalpha() and not char.isascii() for char in text
+        )
+        return {"confidence": 90.0, "language": "es" if foreign else "en"}
+
+    def translate(self, path, query, body):
+        texts = body["q"]
+        if isinstance(texts, str):
+            return 200, {
+                "detectedLanguage": self.detect(texts),
+                "translatedText": texts,
+            }
+        return 200, {
+            "detectedLanguage": [self.detect(text) for text in texts],
+            "translatedText": texts,
+        }
@@ -0,0 +1,153 @@
+"""
+Synthetic comment and article corpora for the benchmarks. Texts are drawn from
+Zipf-distributed vocabularies with emojis mixed in, and a share of the texts is
+in other languages, so every preprocessing stage has realistic work to do.
+"""
+
+import numpy as np
+import pandas as pd
+
+ENGLISH_WORDS = (
+    "the a an and or but is are was were be been have has had do does did not no "
+    "i you he she it we they me him her us them my your his its our their this that "
+    "these those what who which when where why how all any both each few more most "
+    "other some such only own same so than too very can will just should now song "
+    "album music video artist fan fans love hate new old best worst great good bad "
+    "never always still again really think know feel listen listening watch watched "
+    "cancel cancelled canceled culture apology sorry support boycott career comeback "
+    "concert tour record label stream streams chart charts hit single track lyrics "
+    "people everyone nobody someone internet news media twitter youtube tiktok "
+    "problematic controversy scandal allegations trial court statement interview "
+    "amazing terrible beautiful disgusting legend genius talent talented iconic "
+    "classic forever miss missed remember nostalgia vibe vibes mood energy beat "
+    "voice sound production producer feature remix live performance stage award"
+).split()
+# Spanish, German, Portuguese and Korean words of the texts that need translation
+FOREIGN_WORDS = (
+    "la el de que y en los se del las un por con una su para es al lo como más "
+    "canción música artista nunca siempre mejor peor amor odio increíble "
+    "der die und ist nicht das ich du lied musik künstler immer besser liebe "
+    "não você muito cantor sempre melhor saudade incrível "
+    "노래 음악 가수 최고 사랑 진짜 대박 응원 너무 좋아"
+).split()
+EMOJIS = list("😂😍🔥❤💯🙏😭👏🤔😡💀🎶🎵👑✨🙌😢😎🥺🤮")
+
+COMMENT_WORDS = (3, 40)
+TITLE_WORDS = (5, 15)
+CONTENT_WORDS = (80, 400)
+FOREIGN_SHARE = 0.1
+EMOJI_SHARE = 0.03
+
+
+def zipf_probabilities(n_words: int, share: float = 1.0) -> np.ndarray:
+    """
+    Probabilities of n_words ranked words under Zipf's law, summing to share
+    """
+    zipf = 1 / np.arange(1, n_words + 1)
+    return share * zipf / zipf.sum()
+
+
+def draw_words(words: list, size: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Draw Zipf-distributed words with EMOJI_SHARE of emojis among them
+    """
+    vocabulary = np.array(words + EMOJIS, dtype=object)
+    probabilities = np.concatenate(
+        [
+            zipf_probabilities(len(words), 1 - EMOJI_SHARE),
+            zipf_probabilities(len(EMOJIS), EMOJI_SHARE),
+        ]
+    )
+    return vocabulary[rng.choice(len(vocabulary), size=size, p=probabilities)]
+
+
+def generate_texts(
+    n_rows: int,
+    rng: np.random.Generator,
+    word_range: tuple = COMMENT_WORDS,
+    foreign_share: float = FOREIGN_SHARE,
+) -> list:
+    """
+    Generate texts with a uniform number of words in word_range, foreign_share
+    of them in other languages than English
+    """
+    lengths = rng.integers(word_range[0], word_range[1] + 1, size=n_rows)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+
+    # draw all words at once, then join each text's slice
+    foreign = np.repeat(rng.random(n_rows) < foreign_share, lengths)
+    tokens = draw_words(ENGLISH_WORDS, ends[-1], rng)
+    tokens[foreign] = draw_words(FOREIGN_WORDS, foreign.sum(), rng)
+
+    tokens = tokens.tolist()
+    return [
+        " ".join(tokens[start:end])
+        for start, end in zip(starts.tolist(), ends.tolist())
+    ]
+
+
+def generate_dates(
+    n_rows: int, start: str, end: str, rng: np.random.Generator
+) -> pd.DatetimeIndex:
+    """
+    Uniformly distributed UTC timestamps between start and end, sorted
+    """
+    start = pd.Timestamp(start, tz="UTC").value // 10**9
+    end = pd.Timestamp(end, tz="UTC").value // 10**9
+    seconds = np.sort(rng.integers(start, end, size=n_rows))
+    return pd.to_datetime(seconds, unit="s", utc=True)
+
+
+def generate_comments(
+    n_rows: int,
+    n_videos: int,
+    start: str = "2020-01-01",
+    end: str = "2023-01-01",
+    seed: int = 42,
+) -> pd.DataFrame:
+    """
+    Comments in the shape of the crawled YouTube comments, spread over
+    n_videos videos
+    """
+    rng = np.random.default_rng(seed)
+    video_ids = np.array([f"video{i:07d}" for i in range(n_videos)], dtype=object)
+    dates = generate_dates(n_rows, start, end, rng).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    return pd.DataFrame(
+        {
+            "text": generate_texts(n_rows, rng, COMMENT_WORDS),
+            "updateDt": dates,
+            "video_id": video_ids[rng.integers(0, n_videos, size=n_rows)],
+        }
+    )
+
+
+def generate_articles(
+    n_rows: int, start: str = "2020-01-01", end: str = "2023-01-01", seed: int = 42
+) -> pd.DataFrame:
+    """
+    Articles in the shape of the crawled GNews articles
+    """
+    rng = np.random.default_rng(seed)
+    n_sources = 200
+    sources = np.array([f"News Site {i}" for i in range(n_sources)], dtype=object)
+    source_urls = np.array(
+        [f"https://news-site-{i}.example.com" for i in range(n_sources)], dtype=object
+    )
+    dates = generate_dates(n_rows, start, end, rng).strftime("%Y-%m-%dT%H:%M:%SZ")
+    outlets = rng.integers(0, n_sources, size=n_rows)
+
+    return pd.DataFrame(
+        {
+            "title": generate_texts(n_rows, rng, TITLE_WORDS),
+            "content": generate_texts(n_rows, rng, CONTENT_WORDS),
+            "published_on": dates,
+            # like GNews, every article has its own URL on its outlet's site
+            "link": [
+                f"{source_urls[outlet]}/article/{i}" for i, outlet in enumerate(outlets)
+            ],
+            "source": sources[outlets],
+            "source_url": source_urls[outlets],
+        }
+    )
@@ -1,31 +1,58 @@
-from datetime import datetime, time
+import functools
 import os
-from helpers.file_functions import load_json
-import pandas as pd
-
-# Load environment variables
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# API Keys
-GNEWS_API_KEY = os.getenv("GNEWS_API_KEY")
-SERP_API_KEY = os.getenv("SERP_API_KEY")
 
 # File Paths
 CWD = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 RAW_DATA_PATH = os.path.join(CWD, "data", "raw")
 PROCESSED_DATA_PATH = os.path.join(CWD, "data", "processed")
+CACHE_DATA_PATH = os.path.join(CWD, "data", "cache")
+METRICS_DATA_PATH = os.path.join(CWD, "data", "metrics")
 
-# Celebrities
 config_path = os.path.join(CWD, "config.json")
-CELEBRITIES = pd.DataFrame(load_json(config_path))
+
+# API keys read from the environment or the .env file
+API_KEYS = ["GNEWS_API_KEY", "SERP_API_KEY"]
+
+# CELEBRITIES and the API keys are loaded on first access, see __getattr__
+__all__ = [
+    "CWD",
+    "RAW_DATA_PATH",
+    "PROCESSED_DATA_PATH",
+    "CACHE_DATA_PATH",
+    "METRICS_DATA_PATH",
+    "config_path",
+    "CELEBRITIES",
+    *API_KEYS,
+    "get_api_key",
+    "get_celebrities",
+    "prepare_celebrities",
+]
+
+
+@functools.cache
+def load_environment():
+    """
+    Load the environment variables of the .env file once
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+
+def get_api_key(name):
+    """
+    Get an API key from the environment or the .env file
+    """
+    load_environment()
+    return os.getenv(name)
 
 
 def prepare_celebrities(df):
     """
     Prepare the celebrities dataframe
     """
+    import pandas as pd
+
     df["name"] = df["name"].str.lower()
     df["search_term"] = df["search_term"].str.lower()
 
@@ -38,5 +65,23 @@ def prepare_celebrities(df):
     return df
 
 
-# Prepare the CELEBRITIES dataframe
-CELEBRITIES = prepare_celebrities(CELEBRITIES)
+@functools.cache
+def get_celebrities():
+    """
+    Get the prepared celebrities of config.json, parsed once per process
+    """
+    import pandas as pd
+    from helpers.file_functions import load_json
+
+    return prepare_celebrities(pd.DataFrame(load_json(config_path)))
+
+
+def __getattr__(name):
+    """
+    Load CELEBRITIES and the API keys on first access
+    """
+    if name == "CELEBRITIES":
+        return get_celebrities()
+    if name in API_KEYS:
+        return get_api_key(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,18 +1,101 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import argparse
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
 import sys
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 from config import RAW_DATA_PATH
+from helpers.http_cache import MODES, cached_get_json, get_http_cache
+from helpers.instrumentation import METRICS, write_run_summary
 
+BILLBOARD_URL = "https://raw.githubusercontent.com/mhollingshead/billboard-hot-100/main"
+CSV_FILE = os.path.join(RAW_DATA_PATH, "billboard_charts_2015_to_today.csv")
+CSV_COLUMNS = [
+    "date",
+    "song",
+    "artist",
+    "this_week",
+    "last_week",
+    "peak_position",
+    "weeks_on_chart",
+]
 
-def fetch_and_save_billboard_data():
-    # Step 1: Read the valid dates from the provided JSON file
-    valid_dates_url = "https://raw.githubusercontent.com/mhollingshead/billboard-hot-100/main/valid_dates.json"
-    response = requests.get(valid_dates_url)
-    valid_dates = response.json()
+
+def create_session(max_workers: int) -> requests.Session:
+    """
+    Create a session whose connection pool fits all workers, with retries
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=max_workers,
+        max_retries=Retry(
+            total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_valid_dates(session: requests.Session) -> list:
+    """
+    Get the chart dates, the cached list is refreshed daily
+    """
+    url = f"{BILLBOARD_URL}/valid_dates.json"
+    return cached_get_json("billboard_dates", url, session=session) or []
+
+
+def fetch_chart(session: requests.Session, date: str) -> list:
+    """
+    Get the rows of one weekly chart
+    """
+    url = f"{BILLBOARD_URL}/date/{date}.json"
+    chart = cached_get_json("billboard_charts", url, session=session)
+    if chart is None:
+        return []
+
+    return [
+        {
+            "date": chart["date"],
+            "song": entry["song"],
+            "artist": entry["artist"],
+            "this_week": entry["this_week"],
+            "last_week": entry.get("last_week", None),
+            "peak_position": entry["peak_position"],
+            "weeks_on_chart": entry["weeks_on_chart"],
+        }
+        for entry in chart["data"]
+    ]
+
+
+def load_existing_rows(csv_file: str) -> list:
+    """
+    Read the rows of the existing dataset
+    """
+    if not os.path.exists(csv_file):
+        return []
+    with open(csv_file, "r", newline="", encoding="utf-8") as csvfile:
+        return list(csv.DictReader(csvfile))
+
+
+def fetch_and_save_billboard_data(incremental: bool = True, max_workers: int = 8):
+    """
+    Fetch the weekly Billboard Hot 100 charts since 2015 into a CSV file.
+
+    In incremental mode only the dates missing from the existing dataset are
+    fetched. Charts are fetched concurrently over one pooled session through the
+    shared HTTP cache, so a rebuild in the offline cache mode needs no network.
+    """
+    session = create_session(max_workers)
+
+    # Step 1: Read the valid dates
+    valid_dates = get_valid_dates(session)
 
     # Step 2: Filter the dates to include only those from 2015 until today
     start_date = datetime.strptime("2015-01-01", "%Y-%m-%d")
@@ -23,48 +106,62 @@ def fetch_and_save_billboard_data():
         if start_date <= datetime.strptime(date, "%Y-%m-%d") <= end_date
     ]
 
-    # Step 3: Fetch the chart data for each filtered date
-    chart_data = []
-    for date in filtered_dates:
-        chart_url = f"https://raw.githubusercontent.com/mhollingshead/billboard-hot-100/main/date/{date}.json"
-        response = requests.get(chart_url)
-        if response.status_code == 200:
-            chart = response.json()
-            for entry in chart["data"]:
-                chart_data.append(
-                    {
-                        "date": chart["date"],
-                        "song": entry["song"],
-                        "artist": entry["artist"],
-                        "this_week": entry["this_week"],
-                        "last_week": entry.get("last_week", None),
-                        "peak_position": entry["peak_position"],
-                        "weeks_on_chart": entry["weeks_on_chart"],
-                    }
-                )
-
-    # Step 4: Save the fetched data into a CSV file
-    csv_file = os.path.join(RAW_DATA_PATH, "billboard_charts_2015_to_today.csv")
-    csv_columns = [
-        "date",
-        "song",
-        "artist",
-        "this_week",
-        "last_week",
-        "peak_position",
-        "weeks_on_chart",
-    ]
+    existing_rows = load_existing_rows(CSV_FILE) if incremental else []
+    existing_dates = {row["date"] for row in existing_rows}
+    missing_dates = [date for date in filtered_dates if date not in existing_dates]
+    print(f"{len(existing_dates)} charts already saved, fetching {len(missing_dates)}")
+
+    if not missing_dates:
+        print("Billboard data is up to date")
+        return
+
+    # Step 3: Fetch the chart data for each missing date concurrently
+    with METRICS.stage("billboard.fetch") as stage:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            charts = executor.map(
+                lambda date: fetch_chart(session, date), missing_dates
+            )
+            chart_data = [row for chart in charts for row in chart]
+        stage.rows = len(chart_data)
+
+    # Step 4: Append newer charts, otherwise rewrite the file in date order
+    last_date = max(existing_dates, default="")
+    append = existing_rows and all(row["date"] > last_date for row in chart_data)
+    if not append:
+        chart_data = sorted(existing_rows + chart_data, key=lambda row: row["date"])
 
     try:
-        with open(csv_file, "w", newline="", encoding="utf-8") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=csv_columns)
-            writer.writeheader()
+        with METRICS.stage("write.billboard", len(chart_data)), open(
+            CSV_FILE, "a" if append else "w", newline="", encoding="utf-8"
+        ) as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=CSV_COLUMNS)
+            if not append:
+                writer.writeheader()
             for data in chart_data:
                 writer.writerow(data)
-        print(f"Data successfully saved to {csv_file}")
+        print(f"Data successfully saved to {CSV_FILE}")
     except IOError:
         print("I/O error")
 
 
 if __name__ == "__main__":
-    fetch_and_save_billboard_data()
+    parser = argparse.ArgumentParser(description="Fetch the Billboard Hot 100 charts")
+    parser.add_argument("--full", action="store_true", help="rebuild the whole dataset")
+    parser.add_argument(
+        "--offline", action="store_true", help="same as --cache-mode offline"
+    )
+    parser.add_argument(
+        "--cache-mode", choices=MODES, default=None, help="HTTP cache mode"
+    )
+    parser.add_argument("--max-workers", type=int, default=8)
+    args = parser.parse_args()
+    if args.offline:
+        args.cache_mode = "offline"
+    if args.cache_mode is not None:
+        get_http_cache().mode = args.cache_mode
+
+    fetch_and_save_billboard_data(
+        incremental=not args.full, max_workers=args.max_workers
+    )
+    print(f"HTTP cache: {get_http_cache().stats}")
+    write_run_summary("billboard_crawler")
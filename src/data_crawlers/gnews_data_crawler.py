@@ -1,14 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-import requests
+import argparse
+import json
+import pandas as pd
 import os
-import time as t
 import sys
 import math
+import threading
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
-from config import GNEWS_API_KEY, RAW_DATA_PATH, CELEBRITIES
-from helpers.file_functions import append_to_csv
+from config import RAW_DATA_PATH, get_api_key, get_celebrities
+from helpers.file_functions import load_json, open_sink, open_writer
+from helpers.http_cache import MODES, cached_get_json, get_http_cache
+from helpers.instrumentation import METRICS, write_run_summary
+from helpers.rate_limiter import TokenBucket
+
+GNEWS_API_URL = "https://gnews.io/api/v4/search"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+PAGE_SIZE = 50  # this is the maximum
+GNEWS_RATE_LIMIT = 6  # requests per second
 
 
 def get_gnews_data(
@@ -17,113 +28,355 @@ def get_gnews_data(
     end_date: datetime,
     search_term: str,
     page: int = 1,
+    rate_limiter: TokenBucket = None,
 ):
     """
-    Get news articles from GNews API.
+    Get news articles from GNews API, through the shared HTTP cache.
     """
-    url = "https://gnews.io/api/v4/search"
     params = {
         "apikey": api_key,
-        "from": begin_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
-        "to": end_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "from": begin_date.strftime(DATE_FORMAT),
+        "to": end_date.strftime(DATE_FORMAT),
         "q": search_term,
-        "max": 50,  # this is the maximum
+        "max": PAGE_SIZE,
         "expand": "content",
         "sortby": "relevance",  # "relevance", "publishedAt
         "page": page,
     }
-    response = requests.get(url, params=params)
+    # cached responses don't take a rate limiter token
+    return cached_get_json(
+        "gnews",
+        GNEWS_API_URL,
+        params,
+        before_fetch=rate_limiter.acquire if rate_limiter is not None else None,
+    )
+
+
+def load_checkpoint(checkpoint_path: str, search_term: str, output_format: str) -> dict:
+    """
+    Load the crawl checkpoint of a celebrity
+    """
+    checkpoint = load_json(checkpoint_path) if os.path.exists(checkpoint_path) else None
+    if (
+        not checkpoint
+        or checkpoint.get("search_term") != search_term
+        or checkpoint.get("output_format", "csv") != output_format
+    ):
+        return {
+            "search_term": search_term,
+            "output_format": output_format,
+            "windows": {},
+        }
+
+    # older checkpoints counted the pages instead of listing them
+    for window in checkpoint["windows"].values():
+        if isinstance(window["pages_done"], int):
+            window["pages_done"] = list(range(1, window["pages_done"] + 1))
 
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path: str, checkpoint: dict) -> None:
+    """
+    Atomically save the crawl checkpoint
+    """
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def has_article_links(sink) -> bool:
+    """
+    Whether the crawled articles link to themselves; older crawls stored the
+    outlet's homepage as link, which doesn't tell the articles of an outlet apart
+    """
+    return not sink.exists() or "source_url" in sink.columns()
+
+
+def load_crawled_articles(sink) -> tuple:
+    """
+    Get the links and the latest publish date of the already crawled articles
+    """
+    df = sink.read(columns=["published_on", "link"])
+    if df.empty:
+        return set(), None
+
+    last_published_on = pd.to_datetime(df["published_on"], utc=True).max()
+    return set(df["link"].dropna()), last_published_on.tz_convert(None).to_pydatetime()
+
+
+def get_windows(start_date: datetime, end_date: datetime) -> list:
+    """
+    Split the date range into 30 day windows
+    """
+    windows = []
+    current_start_date = start_date
+    while current_start_date < end_date:
+        current_end_date = min(current_start_date + timedelta(days=30), end_date)
+        windows.append((current_start_date, current_end_date))
+        current_start_date = current_end_date + timedelta(seconds=1)
+    return windows
 
 
 def crawl_gnews_data(
-    name: str, search_term: str, start_date: str, end_date: str
+    name: str,
+    search_term: str,
+    start_date: str,
+    end_date: str,
+    mode: str = "resume",
+    rate_limiter: TokenBucket = None,
+    max_workers: int = 4,
+    output_format: str = "parquet",
 ) -> None:
     """
     Crawl news articles from GNews API and save them to a CSV file.
+
+    mode "resume" skips the windows and pages recorded in the checkpoint,
+    "incremental" only crawls after the latest crawled article and
+    "restart" deletes the previous results.
+
+    Windows are crawled concurrently, and once a window's totalArticles is
+    known its remaining pages are fetched in parallel. The rate limiter is
+    shared by all requests.
+
+    Articles are buffered and written in batches, as a Parquet dataset
+    partitioned by celebrity and month or, with output_format "csv", to
+    the legacy CSV file. The checkpoint only records pages whose articles
+    have been flushed.
     """
-    start_date = datetime.strptime(start_date, "%Y-%m-%dT%H:%M:%SZ")
-    end_date = datetime.strptime(end_date, "%Y-%m-%dT%H:%M:%SZ")
-    file_path = os.path.join(RAW_DATA_PATH, f"{name}_articles_gnews.csv")
+    start_date = datetime.strptime(start_date, DATE_FORMAT)
+    end_date = datetime.strptime(end_date, DATE_FORMAT)
+    sink = open_sink(
+        RAW_DATA_PATH, "articles_gnews", name, output_format, "published_on"
+    )
+    checkpoint_path = os.path.join(
+        RAW_DATA_PATH, f"{name}_articles_gnews.checkpoint.json"
+    )
 
-    print("Crawling GNews data...")
-    print(f"Search term: {search_term}")
-    print(f"Begin date: {start_date}")
-    print(f"End date: {end_date}")
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(GNEWS_RATE_LIMIT)
 
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    if mode != "restart" and not has_article_links(sink):
+        # these crawls kept one article per outlet and can't be resumed
+        print(f"[{name}] Crawled articles link to their outlets only, restarting")
+        mode = "restart"
 
-    current_start_date = start_date
-    while current_start_date < end_date:
-        # 30 days at a time
-        current_end_date = current_start_date + timedelta(days=30)
-        if current_end_date > end_date:
-            current_end_date = end_date
-
-        print(f"range: {current_start_date} to {current_end_date}")
-
-        page = 1
-        total_articles = 0
-        total_articles_showed = False
-        articles_processed = 0
-
-        while True:
-            articles = get_gnews_data(
-                api_key=GNEWS_API_KEY,
-                begin_date=current_start_date,
-                end_date=current_end_date,
-                search_term=search_term,
-                page=page,
-            )
+    if mode == "restart":
+        sink.remove()
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
 
-            if not articles:
-                break
+    checkpoint = load_checkpoint(checkpoint_path, search_term, output_format)
+    seen_links, last_published_on = load_crawled_articles(sink)
+
+    if mode == "incremental" and last_published_on is not None:
+        start_date = max(start_date, last_published_on + timedelta(seconds=1))
+
+    print(f"[{name}] Crawling GNews data...")
+    print(f"[{name}] Search term: {search_term}")
+    print(f"[{name}] Begin date: {start_date}")
+    print(f"[{name}] End date: {end_date}")
+    print(f"[{name}] Mode: {mode}, {len(seen_links)} articles already crawled")
 
-            if not total_articles_showed:
-                total_articles = articles["totalArticles"]
-                print(f"A total of {total_articles} articles found to crawl")
-                total_articles_showed = True
+    # the writer, the checkpoint and seen_links are shared by all threads
+    lock = threading.Lock()
+    # pages and windows whose articles are still in the write buffer
+    pending_pages = []
+    pending_windows = []
 
+    def commit_checkpoint():
+        for window, page in pending_pages:
+            window["pages_done"].append(page)
+        for window in pending_windows:
+            window["complete"] = True
+        pending_pages.clear()
+        pending_windows.clear()
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    writer = open_writer(
+        RAW_DATA_PATH,
+        "articles_gnews",
+        name,
+        output_format,
+        "published_on",
+        batch_size=1000,
+        on_flush=commit_checkpoint,
+    )
+    # stop sending requests after the first failure, e.g. an exhausted quota
+    failed = threading.Event()
+
+    def fetch_page(window_start, window_end, page):
+        if failed.is_set():
+            return None
+        articles = get_gnews_data(
+            api_key=get_api_key("GNEWS_API_KEY"),
+            begin_date=window_start,
+            end_date=window_end,
+            search_term=search_term,
+            page=page,
+            rate_limiter=rate_limiter,
+        )
+        if not articles:
+            failed.set()
+        return articles
+
+    def save_page(window, page, articles):
+        with lock:
             data = []
-            if len(articles["articles"]) == 0:
-                break
             for article in articles["articles"]:
+                link = article["url"]
+                if link in seen_links:
+                    continue
+                seen_links.add(link)
                 data.append(
                     {
                         "title": article["title"],
                         "content": article["content"],
                         "published_on": article["publishedAt"],
-                        "link": article["source"]["url"],
+                        "link": link,
                         "source": article["source"]["name"],
+                        "source_url": article["source"]["url"],
                     }
                 )
-            append_to_csv(file_path, data)
+            pending_pages.append((window, page))
+            writer.append(data)
+            return len(data)
 
-            articles_processed += len(data)
-            print(
-                f"Page {page}/{math.ceil(total_articles/50)} crawled. processed articles: {articles_processed}"
+    def crawl_window(window_start, window_end, page_executor):
+        window_key = window_start.strftime(DATE_FORMAT)
+        with lock:
+            window = checkpoint["windows"].setdefault(
+                window_key,
+                {
+                    "end": None,
+                    "total_articles": None,
+                    "pages_done": [],
+                    "complete": False,
+                },
             )
+            # the last window grows when end_date moves, so it has to be crawled again
+            if window["end"] != window_end.strftime(DATE_FORMAT):
+                window.update(
+                    end=window_end.strftime(DATE_FORMAT),
+                    total_articles=None,
+                    pages_done=[],
+                    complete=False,
+                )
 
-            page += 1
+        if window["complete"]:
+            return 0
 
-            # Pause for 0.2 second to avoid exceeding the rate limit of 6 requests per second
-            t.sleep(0.2)
+        processed = 0
+        if window.get("total_articles") is None:
+            articles = fetch_page(window_start, window_end, 1)
+            if not articles:
+                return processed
+            window["total_articles"] = articles["totalArticles"]
+            processed += save_page(window, 1, articles)
 
-        current_start_date = current_end_date + timedelta(seconds=1)
+        total_pages = math.ceil(window["total_articles"] / PAGE_SIZE)
+        pages = [
+            page
+            for page in range(1, total_pages + 1)
+            if page not in window["pages_done"]
+        ]
+        results = page_executor.map(
+            lambda page: fetch_page(window_start, window_end, page), pages
+        )
+        for page, articles in zip(pages, results):
+            if not articles:
+                return processed
+            processed += save_page(window, page, articles)
+
+        with lock:
+            pending_windows.append(window)
+
+        print(
+            f"[{name}] range: {window_start} to {window_end}, "
+            f"{window['total_articles']} articles found, {processed} new"
+        )
+        return processed
+
+    articles_processed = 0
+    try:
+        with METRICS.stage("gnews.crawl") as stage:
+            with ThreadPoolExecutor(max_workers=max_workers) as page_executor:
+                with ThreadPoolExecutor(max_workers=max_workers) as window_executor:
+                    futures = [
+                        window_executor.submit(
+                            crawl_window, window_start, window_end, page_executor
+                        )
+                        for window_start, window_end in get_windows(
+                            start_date, end_date
+                        )
+                    ]
+                    for future in as_completed(futures):
+                        articles_processed += future.result()
+                        stage.rows = articles_processed
+    finally:
+        with lock:
+            writer.close()
+
+    if failed.is_set():
+        print(f"[{name}] A request failed, run again with mode resume to continue.")
+    print(f"[{name}] Total new articles retrieved: {articles_processed}")
 
-    print(f"Total articles retrieved: {total_articles}")
+
+def crawl_celebrities(
+    celebrities: pd.DataFrame,
+    mode: str = "resume",
+    max_workers: int = 4,
+    output_format: str = "parquet",
+):
+    """
+    Crawl all celebrities concurrently under one shared rate limit
+    """
+    rate_limiter = TokenBucket(GNEWS_RATE_LIMIT)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(celebrities))) as executor:
+        futures = {
+            executor.submit(
+                crawl_gnews_data,
+                celebrity["name"],
+                celebrity["search_term"],
+                celebrity["start_date"].strftime(DATE_FORMAT),
+                celebrity["end_date"].strftime(DATE_FORMAT),
+                mode=mode,
+                rate_limiter=rate_limiter,
+                max_workers=max_workers,
+                output_format=output_format,
+            ): celebrity["name"]
+            for celebrity in celebrities.to_dict("records")
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"An error occurred while crawling {futures[future]}: {e}")
 
 
 if __name__ == "__main__":
-    for celebrity in CELEBRITIES:
-        crawl_gnews_data(
-            celebrity["name"],
-            celebrity["search_term"],
-            celebrity["start_date"],
-            celebrity["end_date"],
-        )
+    parser = argparse.ArgumentParser(description="Crawl GNews articles")
+    parser.add_argument(
+        "--mode", choices=["resume", "incremental", "restart"], default="resume"
+    )
+    parser.add_argument(
+        "--max-workers", type=int, default=4, help="concurrent windows per celebrity"
+    )
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument(
+        "--cache-mode", choices=MODES, default=None, help="HTTP cache mode"
+    )
+    args = parser.parse_args()
+    if args.cache_mode is not None:
+        get_http_cache().mode = args.cache_mode
+
+    crawl_celebrities(
+        get_celebrities(),
+        mode=args.mode,
+        max_workers=args.max_workers,
+        output_format=args.format,
+    )
+    print(f"HTTP cache: {get_http_cache().stats}")
+    write_run_summary("gnews_crawler")
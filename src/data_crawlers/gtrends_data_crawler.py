@@ -7,12 +7,14 @@ NOTE: not used in the final project. use the website to get the data instead.
 import pandas as pd
 import os
 import sys
-from serpapi import GoogleSearch
 from datetime import datetime
 from pytrends.request import TrendReq
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-from config import RAW_DATA_PATH, CELEBRITIES, SERP_API_KEY
+from config import RAW_DATA_PATH, get_api_key, get_celebrities
+from helpers.http_cache import cached_get_json
+
+SERPAPI_URL = "https://serpapi.com/search.json"
 
 
 def get_trends_pytrends(keyword: str, start_date: str, end_date: str) -> pd.DataFrame:
@@ -42,16 +44,16 @@ def get_trends_serpapi(keyword: str, start_date: str, end_date: str) -> pd.DataF
     """
     Get Google Trends data for the given keyword and timeframe using SERPAPI
     """
-    timeframe = [f"{start_date} {end_date}"]
+    timeframe = f"{start_date} {end_date}"
 
     params = {
         "engine": "google_trends",
         "q": keyword,
         "date": timeframe,
-        "api_key": SERP_API_KEY,
+        "api_key": get_api_key("SERP_API_KEY"),
     }
-    search = GoogleSearch(params)
-    results = search.get_dict()
+    # the search API over the shared HTTP cache instead of the serpapi client
+    results = cached_get_json("serpapi", SERPAPI_URL, params) or {}
 
     if "timeline_data" in results.get("interest_over_time", {}):
         trends_data = results["interest_over_time"]["timeline_data"]
@@ -76,7 +78,7 @@ def convert_date_format(date_str):
 
 
 if __name__ == "__main__":
-    for celebrity in CELEBRITIES:
+    for celebrity in get_celebrities():
         name = celebrity["name"]
         search_term = celebrity["search_term"]
         start_date = convert_date_format(celebrity["start_date"])
@@ -1,28 +1,62 @@
+import argparse
+import json
+import math
 import os
 import pandas as pd
 import numpy as np
-import requests
+import pyarrow as pa
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed, ProcessPoolExecutor
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-from config import RAW_DATA_PATH, CELEBRITIES
-
+from config import RAW_DATA_PATH, get_celebrities
+from helpers.file_functions import ColumnarWriter, load_json, open_sink, open_writer
+from helpers.http_cache import MODES, get_http_cache
+from helpers.instrumentation import METRICS, write_run_summary
+from helpers.request_scheduler import RequestScheduler
+
+YOUTUBE_API_URL = "https://yt.lemnoslife.com/noKey"
+YOUTUBE_HOST = "yt.lemnoslife.com"
+YOUTUBE_HOST_LIMIT = 8
 MAX_VIDEO_COUNT = 500
 MAX_COMMENTS_PER_VIDEO = 5000
+# the videos endpoint accepts up to 50 comma separated IDs
+STATS_BATCH_SIZE = 50
+# the latest stats, one row per video, and time-stamped changes of them
+STATS_DATASETS = ["youtube_stats", "youtube_stats_snapshots"]
+COMMENT_COLUMNS = ["text", "updateDt", "video_id"]
+COMMENT_TYPES = {
+    "text": pa.string(),
+    "updateDt": pa.timestamp("us", tz="UTC"),
+    "video_id": pa.string(),
+}
+# comments held in memory per celebrity before they are written out
+COMMENT_BATCH_SIZE = 20000
+
+
+def to_rfc3339(value) -> str:
+    """
+    Format a date-like value as the RFC 3339 timestamp the search endpoint expects
+    """
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("UTC")
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
 def get_video_id(
-    publish_after: str,
-    publish_before: str,
+    publish_after,
+    publish_before,
     search_term: str,
+    scheduler: RequestScheduler,
     max_video_count: int = MAX_VIDEO_COUNT,
 ):
     """
     Get the video IDs of the videos up to a maximum count
     """
     video_id_list = []
-    url = "https://yt.lemnoslife.com/noKey/search"
+    url = f"{YOUTUBE_API_URL}/search"
 
     print(f"Getting video IDs up to a maximum of {max_video_count} videos...")
 
@@ -31,14 +65,13 @@ def get_video_id(
         "maxResults": "50",
         "q": search_term,
         "type": "video",
-        "publishedBefore": publish_before,
-        "publishedAfter": publish_after,
+        "publishedBefore": to_rfc3339(publish_before),
+        "publishedAfter": to_rfc3339(publish_after),
         "order": "relevance",
     }
 
     while len(video_id_list) < max_video_count:
-        res = requests.get(url, params=params)
-        data = res.json()
+        data = scheduler.get_json(url, params=params, source="youtube_search")
 
         if "items" in data:
             df = pd.json_normalize(data["items"])
@@ -65,178 +98,484 @@ def get_video_id(
     return video_ids
 
 
-def fetch_comments(video_id: str, max_comments_per_video: int = MAX_COMMENTS_PER_VIDEO):
-    list_text = []
-    list_date = []
-    list_video_id = []
-    url = "https://yt.lemnoslife.com/noKey/commentThreads"
+def load_state(state_path: str, search_term: str, output_format: str):
+    """
+    Load the crawl state of a celebrity, None if there is no usable state
+    """
+    state = load_json(state_path) if os.path.exists(state_path) else None
+    if (
+        not state
+        or state.get("search_term") != search_term
+        or state.get("output_format") != output_format
+    ):
+        return None
+    return state
+
+
+def save_state(state_path: str, state: dict) -> None:
+    """
+    Atomically save the crawl state
+    """
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def fetch_comment_pages(
+    video_id: str,
+    scheduler: RequestScheduler,
+    page_token: str = None,
+    max_pages: int = None,
+    order: str = "relevance",
+):
+    """
+    Yield the comment pages of a video in the given order, "relevance" or
+    "time" for newest first, from a page token on
+    """
+    url = f"{YOUTUBE_API_URL}/commentThreads"
 
     parameters = {
         "part": "id,snippet",
         "maxResults": "50",
         "videoId": video_id,
-        "order": "relevance",
+        "order": order,
     }
-    total_comments = 0
+    if page_token is not None:
+        parameters["pageToken"] = page_token
 
-    while total_comments < max_comments_per_video:
-        res = requests.get(url, params=parameters)
-        comment_list = res.json()
+    pages = 0
+    while max_pages is None or pages < max_pages:
+        comment_list = scheduler.get_json(
+            url, params=parameters, source="youtube_comments"
+        )
+        items = comment_list.get("items")
 
-        if "items" in comment_list:
-            comment_df = pd.json_normalize(comment_list["items"])
+        if items is None:
+            print(f"Video ID {video_id}: No items found in response.")
+            return
 
-            if not comment_df.empty:
-                comment_df["updateDate"] = pd.to_datetime(
-                    comment_df["snippet.topLevelComment.snippet.updatedAt"]
-                ).dt.date
-                comment_df["video_id"] = video_id
+        pages += 1
+        next_page_token = comment_list.get("nextPageToken")
+        yield items, next_page_token
 
-                list_text.extend(
-                    comment_df["snippet.topLevelComment.snippet.textOriginal"]
-                )
-                list_date.extend(comment_df["updateDate"])
-                list_video_id.extend(comment_df["video_id"])
+        if not items or next_page_token is None:
+            return
+        parameters["pageToken"] = next_page_token
 
-                total_comments += len(comment_df)
 
-                print(
-                    f"Video ID {video_id}: Found {len(comment_df)} comments, total: {total_comments}"
-                )
+def fetch_comments(
+    video_id: str,
+    video_state: dict,
+    scheduler: RequestScheduler,
+    save_page,
+    max_comments_per_video: int = MAX_COMMENTS_PER_VIDEO,
+):
+    """
+    Fetch the comments of a video that are not crawled yet, returns their count.
+
+    A new video is crawled by relevance up to max_comments_per_video comments,
+    continuing from the stored page token after an interruption. A known video
+    is first topped up newest first, only until its newest known comment; the
+    crawl by relevance then leaves out the comments published after the newest
+    comment before the first top-up, the cutoff, which is kept until the crawl
+    by relevance is complete, as every top-up since then saved them.
+    """
+    total_comments = 0
 
-                if (
-                    "nextPageToken" in comment_list
-                    and total_comments < max_comments_per_video
-                ):
-                    parameters["pageToken"] = comment_list["nextPageToken"]
-                else:
-                    break
-            else:
-                print(f"Video ID {video_id}: No comments found in this response.")
+    def extract(items):
+        texts = []
+        dates = []
+        published = []
+        for item in items:
+            snippet = item["snippet"]["topLevelComment"]["snippet"]
+            texts.append(snippet["textOriginal"])
+            dates.append(snippet["updatedAt"])
+            published.append(snippet["publishedAt"])
+        return texts, dates, published
+
+    newest = video_state["newest"]
+    # states written before the cutoff was kept don't have it
+    cutoff = video_state.get("cutoff")
+    if newest is not None:
+        latest = newest
+        max_pages = math.ceil(max_comments_per_video / 50)
+        pages = fetch_comment_pages(
+            video_id, scheduler, max_pages=max_pages, order="time"
+        )
+        for items, _ in pages:
+            texts, dates, published = extract(items)
+            new = [i for i, date in enumerate(published) if date > newest]
+            latest = max([latest] + published)
+            save_page(video_id, [texts[i] for i in new], [dates[i] for i in new], {})
+            total_comments += len(new)
+            # the rest of the pages are older than the newest known comment
+            if len(new) < len(items):
+                break
+        if cutoff is None:
+            cutoff = newest
+        # only move the newest comment once all new pages are saved, so an
+        # interrupted run fetches them again instead of leaving a gap
+        save_page(video_id, [], [], {"newest": latest, "cutoff": cutoff})
+        newest = latest
+
+    if not video_state["complete"] and video_state["count"] < max_comments_per_video:
+        count = video_state["count"]
+        pages = fetch_comment_pages(video_id, scheduler, video_state["page_token"])
+        for items, next_page_token in pages:
+            items = items[: max_comments_per_video - count]
+            texts, dates, published = extract(items)
+            count += len(items)
+            if cutoff is not None:
+                old = [i for i, date in enumerate(published) if date <= cutoff]
+                texts = [texts[i] for i in old]
+                dates = [dates[i] for i in old]
+            elif published and (newest is None or max(published) > newest):
+                # by relevance, any page can hold the newest comment
+                newest = max(published)
+            update = {
+                "page_token": next_page_token,
+                "count": count,
+                "complete": next_page_token is None or count >= max_comments_per_video,
+            }
+            if cutoff is None:
+                update["newest"] = newest
+            save_page(video_id, texts, dates, update)
+            total_comments += len(texts)
+            if update["complete"]:
                 break
-        else:
-            print(f"Video ID {video_id}: No items found in response.")
-            break
 
-    return (
-        list_text[:max_comments_per_video],
-        list_date[:max_comments_per_video],
-        list_video_id[:max_comments_per_video],
-    )
+    if total_comments:
+        print(f"Video ID {video_id}: Found {total_comments} new comments")
 
+    return total_comments
 
-def get_comments(video_ids: list):
+
+def get_comments(
+    video_ids: list,
+    state: dict,
+    scheduler: RequestScheduler,
+    writer: ColumnarWriter,
+    pending: list,
+    max_comments_per_video: int = MAX_COMMENTS_PER_VIDEO,
+):
     """
-    Get comments from the videos
+    Stream the new comments of the videos into the writer, one task per video on
+    the shared scheduler; only the writer's current batch is held in memory.
+
+    A page's state update is queued in pending and only applied once its
+    comments have been flushed.
     """
-    results = []
     print("Getting comments from videos...")
 
-    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        futures = {
-            executor.submit(fetch_comments, video_id): video_id
-            for video_id in video_ids
-        }
-        for future in as_completed(futures):
-            results.append(future.result())
-
-    list_text, list_date, list_video_id = zip(*results)
-    df_text = pd.concat([pd.Series(x) for x in list_text], axis=0, ignore_index=True)
-    df_date = pd.concat([pd.Series(x) for x in list_date], axis=0, ignore_index=True)
-    df_video_id = pd.concat(
-        [pd.Series(x) for x in list_video_id], axis=0, ignore_index=True
+    # the writer and pending are shared by all video tasks of a celebrity
+    lock = threading.Lock()
+
+    def save_page(video_id, texts, dates, update):
+        with lock:
+            pending.append((video_id, update))
+            writer.append_columns(
+                {"text": texts, "updateDt": dates, "video_id": [video_id] * len(texts)}
+            )
+
+    video_states = {
+        video_id: state["videos"].setdefault(
+            video_id,
+            {
+                "newest": None,
+                "cutoff": None,
+                "page_token": None,
+                "count": 0,
+                "complete": False,
+            },
+        )
+        for video_id in video_ids
+    }
+    counts = scheduler.map(
+        lambda video_id: fetch_comments(
+            video_id,
+            dict(video_states[video_id]),
+            scheduler,
+            save_page,
+            max_comments_per_video,
+        ),
+        video_ids,
     )
+    with lock:
+        writer.flush()
 
-    df = pd.concat([df_text, df_date, df_video_id], axis=1)
-    df.columns = ["text", "updateDt", "video_id"]
+    total_comments = sum(counts)
+    print(
+        f"Total new comments found: {total_comments} in {sum(count > 0 for count in counts)} videos"
+    )
 
-    print(f"Total comments found: {len(df)} in {len(df['video_id'].unique())} videos")
+    return total_comments
 
-    return df
 
+def fetch_video_stats(video_ids: list, scheduler: RequestScheduler):
+    """
+    Get the view and like counts of up to STATS_BATCH_SIZE videos in one request,
+    with the time the response was fetched at, which is earlier if it was cached
+    """
+    url = f"{YOUTUBE_API_URL}/videos"
+    parameters = {"part": "id,statistics", "id": ",".join(video_ids)}
+    video_data, fetched_at = scheduler.get_timed_json(
+        url, params=parameters, source="youtube_stats"
+    )
 
-def fetch_video_stats(video_id):
-    url = "https://yt.lemnoslife.com/noKey/videos"
-    parameters = {"part": "id,snippet,statistics", "id": video_id}
-    res = requests.get(url, params=parameters)
-    video_data = res.json()
+    statistics = {
+        item.get("id"): item.get("statistics", {})
+        for item in video_data.get("items", [])
+    }
 
-    try:
-        view_count = int(video_data["items"][0]["statistics"]["viewCount"])
-        like_count = int(video_data["items"][0]["statistics"]["likeCount"])
-        return [video_id, view_count, like_count]
-    except (KeyError, IndexError):
-        return [video_id, np.nan, np.nan]
+    stats = []
+    for video_id in video_ids:
+        try:
+            view_count = int(statistics[video_id]["viewCount"])
+            like_count = int(statistics[video_id]["likeCount"])
+            stats.append([video_id, view_count, like_count, fetched_at])
+        except KeyError:
+            stats.append([video_id, np.nan, np.nan, fetched_at])
+    return stats
 
 
-def get_video_stats(video_ids: list):
+def get_video_stats(video_ids: list, scheduler: RequestScheduler):
     """
-    Get the video stats of the videos
+    Get the video stats of the videos in batched requests, with the time each
+    was fetched at in crawled_at
     """
-    stats = []
     print("Getting video stats...")
 
-    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        futures = {
-            executor.submit(fetch_video_stats, video_id): video_id
-            for video_id in video_ids
-        }
-        for future in as_completed(futures):
-            stats.append(future.result())
+    video_ids = list(video_ids)
+    batches = [
+        video_ids[i : i + STATS_BATCH_SIZE]
+        for i in range(0, len(video_ids), STATS_BATCH_SIZE)
+    ]
+    results = scheduler.map(lambda batch: fetch_video_stats(batch, scheduler), batches)
+    stats = [row for batch in results for row in batch]
 
-    stats_df = pd.DataFrame(stats, columns=["video_id", "view_count", "like_count"])
+    stats_df = pd.DataFrame(
+        stats, columns=["video_id", "view_count", "like_count", "crawled_at"]
+    )
+    stats_df["crawled_at"] = pd.to_datetime(stats_df["crawled_at"], unit="s", utc=True)
     print(f"Total video stats found: {len(stats_df)}")
 
     return stats_df
 
 
-def process_single_celebrity(celebrity):
+def get_stats_snapshot(stats_df: pd.DataFrame, state: dict) -> pd.DataFrame:
+    """
+    Keep the stats of new videos and of videos whose counts changed since the
+    last snapshot, stamped with the time their response was fetched. Videos
+    without stats are left out, as nothing was observed.
+    """
+    stats_df = stats_df.dropna(subset=["view_count", "like_count"]).astype(
+        {"view_count": "int64", "like_count": "int64"}
+    )
+    changed = [
+        state["stats"].get(video_id) != [view_count, like_count]
+        for video_id, view_count, like_count in zip(
+            stats_df["video_id"],
+            stats_df["view_count"].tolist(),
+            stats_df["like_count"].tolist(),
+        )
+    ]
+    return stats_df[changed]
+
+
+def process_single_celebrity(
+    celebrity: dict,
+    scheduler: RequestScheduler,
+    output_format: str = "parquet",
+    batch_size: int = COMMENT_BATCH_SIZE,
+    mode: str = "incremental",
+    refresh_search: bool = False,
+):
+    """
+    Crawl the new comments and the stats of a celebrity's videos, replacing
+    the latest stats and adding snapshots of the changed ones.
+
+    The video IDs, the newest comment and backfill page token of every video
+    and the last stats are kept in a state file, so a later run only fetches
+    what changed. mode "restart", or a missing state, deletes the previous
+    results and crawls from scratch.
+    """
     name = celebrity["name"]
     search_term = celebrity["search_term"]
     start_date = celebrity["start_date"]
     end_date = celebrity["end_date"]
-    comments_file_path = os.path.join(RAW_DATA_PATH, f"{name}_youtube_comments.csv")
-    stats_file_path = os.path.join(RAW_DATA_PATH, f"{name}_youtube_stats.csv")
+    state_path = os.path.join(RAW_DATA_PATH, f"{name}_youtube.state.json")
 
     print(f"Processing {name}...")
     print(f"Search Term: {search_term}")
     print(f"Start Date: {start_date}")
     print(f"End Date: {end_date}")
 
-    video_ids = get_video_id(start_date, end_date, search_term)
-    stats_df = get_video_stats(video_ids)
-    comments_df = get_comments(video_ids)
+    state = None
+    if mode != "restart":
+        state = load_state(state_path, search_term, output_format)
+    if state is None:
+        # results without a state cannot be continued, e.g. older crawls
+        for dataset in STATS_DATASETS + ["youtube_comments"]:
+            open_sink(RAW_DATA_PATH, dataset, name, output_format).remove()
+        state = {
+            "search_term": search_term,
+            "output_format": output_format,
+            "video_ids": [],
+            "videos": {},
+            "stats": {},
+        }
 
-    comments_df.to_csv(comments_file_path, index=False)
-    stats_df.to_csv(stats_file_path, index=False)
+    if refresh_search or not state["video_ids"]:
+        with METRICS.stage("youtube.search") as stage:
+            video_ids = get_video_id(start_date, end_date, search_term, scheduler)
+            stage.rows = len(video_ids)
+        known = set(state["video_ids"])
+        state["video_ids"] += [
+            video_id for video_id in video_ids if video_id not in known
+        ]
+    print(f"{name}: {len(state['video_ids'])} videos")
+
+    with METRICS.stage("youtube.stats", len(state["video_ids"])):
+        stats_df = get_video_stats(state["video_ids"], scheduler)
+    with open_writer(
+        RAW_DATA_PATH, "youtube_stats", name, output_format, overwrite=True
+    ) as writer:
+        writer.append_df(stats_df.drop(columns="crawled_at"))
+    snapshot = get_stats_snapshot(stats_df, state)
+    with open_writer(
+        RAW_DATA_PATH, "youtube_stats_snapshots", name, output_format, "crawled_at"
+    ) as writer:
+        writer.append_df(snapshot)
+    for video_id, view_count, like_count in zip(
+        snapshot["video_id"],
+        snapshot["view_count"].tolist(),
+        snapshot["like_count"].tolist(),
+    ):
+        state["stats"][video_id] = [view_count, like_count]
+    save_state(state_path, state)
+    print(f"{name}: {len(snapshot)} changed video stats")
+
+    # video states of pages whose comments are still in the write buffer
+    pending = []
+
+    def commit_state():
+        for video_id, update in pending:
+            state["videos"][video_id].update(update)
+        pending.clear()
+        save_state(state_path, state)
+
+    with open_writer(
+        RAW_DATA_PATH,
+        "youtube_comments",
+        name,
+        output_format,
+        "updateDt",
+        batch_size=batch_size,
+        on_flush=commit_state,
+        columns=COMMENT_COLUMNS,
+        types=COMMENT_TYPES,
+    ) as writer, METRICS.stage("youtube.comments") as stage:
+        comment_count = get_comments(
+            state["video_ids"], state, scheduler, writer, pending
+        )
+        stage.rows = comment_count
 
-    return comments_df, stats_df
+    return comment_count, snapshot
 
 
-def process_celebrities(celebrities: list):
+def process_celebrities(
+    celebrities: pd.DataFrame,
+    output_format: str = "parquet",
+    max_workers: int = 16,
+    host_limit: int = YOUTUBE_HOST_LIMIT,
+    batch_size: int = COMMENT_BATCH_SIZE,
+    mode: str = "incremental",
+    refresh_search: bool = False,
+):
     """
-    Process the celebrities
+    Process the celebrities concurrently.
+
+    All requests go through one scheduler, so the video stat and comment page
+    requests of every celebrity share its workers, session and host limit.
+    Returns the new comment count per celebrity and the stats snapshots.
     """
-    results = []
-    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
-        futures = {
-            executor.submit(process_single_celebrity, celeb): celeb
-            for celeb in celebrities
-        }
-        for future in as_completed(futures):
-            try:
-                results.append(future.result())
-            except Exception as e:
-                print(f"An error occurred: {e}")
-
-    if results:
-        comments_dfs, stats_dfs = zip(*results)
-        return pd.concat(comments_dfs, ignore_index=True), pd.concat(
-            stats_dfs, ignore_index=True
-        )
+    comment_counts = {}
+    stats_dfs = []
+    with RequestScheduler(
+        max_workers=max_workers, host_limits={YOUTUBE_HOST: host_limit}
+    ) as scheduler:
+        # these threads only coordinate, the requests run on the scheduler
+        with ThreadPoolExecutor(max_workers=max(1, len(celebrities))) as executor:
+            futures = {
+                executor.submit(
+                    process_single_celebrity,
+                    celebrity,
+                    scheduler,
+                    output_format,
+                    batch_size,
+                    mode,
+                    refresh_search,
+                ): celebrity["name"]
+                for celebrity in celebrities.to_dict("records")
+            }
+            for future in as_completed(futures):
+                try:
+                    comment_count, stats_df = future.result()
+                    comment_counts[futures[future]] = comment_count
+                    stats_dfs.append(stats_df)
+                except Exception as e:
+                    print(f"An error occurred while crawling {futures[future]}: {e}")
+
+        print(f"Scheduler stats: {scheduler.stats}")
+
+    if stats_dfs:
+        return comment_counts, pd.concat(stats_dfs, ignore_index=True)
     else:
-        return pd.DataFrame(), pd.DataFrame()
+        return comment_counts, pd.DataFrame()
 
 
 if __name__ == "__main__":
-    process_celebrities(CELEBRITIES)
+    parser = argparse.ArgumentParser(description="Crawl YouTube comments and stats")
+    parser.add_argument(
+        "--mode", choices=["incremental", "restart"], default="incremental"
+    )
+    parser.add_argument(
+        "--refresh-search",
+        action="store_true",
+        help="search again for videos published in the celebrity's date range",
+    )
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument(
+        "--max-workers", type=int, default=16, help="shared request workers"
+    )
+    parser.add_argument(
+        "--host-limit",
+        type=int,
+        default=YOUTUBE_HOST_LIMIT,
+        help="concurrent requests against the YouTube API host",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=COMMENT_BATCH_SIZE,
+        help="comments held in memory per celebrity before writing",
+    )
+    parser.add_argument(
+        "--cache-mode", choices=MODES, default=None, help="HTTP cache mode"
+    )
+    args = parser.parse_args()
+    if args.cache_mode is not None:
+        get_http_cache().mode = args.cache_mode
+
+    process_celebrities(
+        get_celebrities(),
+        output_format=args.format,
+        max_workers=args.max_workers,
+        host_limit=args.host_limit,
+        batch_size=args.batch_size,
+        mode=args.mode,
+        refresh_search=args.refresh_search,
+    )
+    print(f"HTTP cache: {get_http_cache().stats}")
+    write_run_summary("youtube_crawler")
@@ -1,6 +1,10 @@
 import json
 import pandas as pd
 import os
+import shutil
+import uuid
+
+from helpers.instrumentation import METRICS
 
 
 def append_to_csv(file_path, articles):
@@ -29,3 +33,258 @@ def load_json(file_path):
             f"Could not parse the JSON file at {file_path}. Please ensure the file contains valid JSON."
         )
         return None
+
+
+class CsvSink:
+    """
+    Legacy sink appending to one CSV file per celebrity and dataset
+    """
+
+    def __init__(self, base_path, dataset, name, timestamp_column=None):
+        self.path = os.path.join(base_path, f"{name}_{dataset}.csv")
+        self.dataset = dataset
+        self.timestamp_column = timestamp_column
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.path)
+
+    def write(self, df):
+        append_to_csv(self.path, df)
+
+    def read(self, columns=None):
+        if not self.exists():
+            return pd.DataFrame(columns=columns)
+        return self.parse(pd.read_csv(self.path, usecols=columns))
+
+    def columns(self):
+        return list(pd.read_csv(self.path, nrows=0).columns)
+
+    def read_chunks(self, columns=None, chunk_size=10000):
+        for df in pd.read_csv(self.path, usecols=columns, chunksize=chunk_size):
+            yield self.parse(df)
+
+    def parse(self, df):
+        if self.timestamp_column in df.columns:
+            df[self.timestamp_column] = pd.to_datetime(
+                df[self.timestamp_column], utc=True
+            )
+        return df
+
+
+class ParquetSink:
+    """
+    Parquet dataset partitioned by celebrity and, given a timestamp column, by month
+    """
+
+    def __init__(self, base_path, dataset, name, timestamp_column=None):
+        self.path = os.path.join(base_path, "parquet", dataset, f"celebrity={name}")
+        self.dataset = dataset
+        self.timestamp_column = timestamp_column
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def remove(self):
+        if self.exists():
+            shutil.rmtree(self.path)
+
+    def write(self, df):
+        if self.timestamp_column is None:
+            self.write_part(df, self.path)
+            return
+
+        df[self.timestamp_column] = pd.to_datetime(df[self.timestamp_column], utc=True)
+        months = df[self.timestamp_column].dt.strftime("%Y-%m")
+        for month, part in df.groupby(months, sort=False):
+            self.write_part(part, os.path.join(self.path, f"month={month}"))
+
+    def write_part(self, df, path):
+        os.makedirs(path, exist_ok=True)
+        df.to_parquet(
+            os.path.join(path, f"part-{uuid.uuid4().hex}.parquet"), index=False
+        )
+
+    def read(self, columns=None, filters=None):
+        if not self.exists():
+            return pd.DataFrame(columns=columns)
+        return pd.read_parquet(self.path, columns=columns, filters=filters)
+
+    def columns(self):
+        import pyarrow.dataset as ds
+
+        return ds.dataset(self.path, format="parquet").schema.names
+
+    def read_chunks(self, columns=None, chunk_size=10000):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(self.path, format="parquet", partitioning="hive")
+        # regroup the per-file batches into chunks of exactly chunk_size rows
+        batches = []
+        rows = 0
+        for batch in dataset.to_batches(columns=columns, batch_size=chunk_size):
+            batches.append(batch)
+            rows += batch.num_rows
+            while rows >= chunk_size:
+                table = pa.Table.from_batches(batches)
+                yield table.slice(0, chunk_size).to_pandas()
+                batches = table.slice(chunk_size).to_batches()
+                rows -= chunk_size
+        if rows:
+            yield pa.Table.from_batches(batches).to_pandas()
+
+
+SINKS = {"parquet": ParquetSink, "csv": CsvSink}
+
+
+class BufferedWriter:
+    """
+    Buffer rows in memory and write them to a sink in batches
+    """
+
+    def __init__(self, sink, batch_size=10000, on_flush=None):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.buffer = []
+
+    def append(self, rows):
+        """
+        Append a list of row dicts, flushing once the batch is full
+        """
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def append_df(self, df):
+        self.append(df.to_dict("records"))
+
+    def flush(self):
+        """
+        Write the buffered rows; on_flush runs afterwards even without rows so
+        callers can record progress that is now durable
+        """
+        if self.buffer:
+            with METRICS.stage(f"write.{self.sink.dataset}", len(self.buffer)):
+                self.sink.write(pd.DataFrame(self.buffer))
+            self.buffer = []
+        if self.on_flush is not None:
+            self.on_flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ColumnarWriter(BufferedWriter):
+    """
+    Buffer values per column as typed Arrow arrays instead of one dict per row,
+    for high-volume datasets with a fixed set of columns. Each appended batch
+    is converted right away, so strings sit in contiguous buffers instead of
+    Python objects; types maps columns to Arrow types their values are cast to,
+    e.g. timestamps from ISO strings.
+    """
+
+    def __init__(self, sink, columns, batch_size=10000, on_flush=None, types=None):
+        super().__init__(sink, batch_size=batch_size, on_flush=on_flush)
+        self.columns = columns
+        self.types = types or {}
+        self.buffer = {column: [] for column in columns}
+        self.rows = 0
+
+    def append_columns(self, values):
+        """
+        Append a dict of equally long value lists, flushing once the batch is full
+        """
+        import pyarrow as pa
+
+        n_rows = len(values[self.columns[0]])
+        if not n_rows:
+            return
+        for column in self.columns:
+            array = pa.array(values[column])
+            dtype = self.types.get(column)
+            if dtype is not None and array.type != dtype:
+                array = array.cast(dtype)
+            self.buffer[column].append(array)
+        self.rows += n_rows
+        if self.rows >= self.batch_size:
+            self.flush()
+
+    def append(self, rows):
+        self.append_columns(
+            {column: [row[column] for row in rows] for column in self.columns}
+        )
+
+    def append_df(self, df):
+        self.append_columns({column: df[column].tolist() for column in self.columns})
+
+    def flush(self):
+        import pyarrow as pa
+
+        if self.rows:
+            table = pa.table(
+                {
+                    column: pa.chunked_array(self.buffer[column])
+                    for column in self.columns
+                }
+            )
+            with METRICS.stage(f"write.{self.sink.dataset}", self.rows):
+                self.sink.write(table.to_pandas())
+            self.buffer = {column: [] for column in self.columns}
+            self.rows = 0
+        if self.on_flush is not None:
+            self.on_flush()
+
+
+def open_writer(
+    base_path,
+    dataset,
+    name,
+    format="parquet",
+    timestamp_column=None,
+    batch_size=10000,
+    overwrite=False,
+    on_flush=None,
+    columns=None,
+    types=None,
+):
+    """
+    Open a buffered writer for one celebrity's dataset, e.g. "articles_gnews".
+    Given the columns, values are buffered per column as Arrow arrays of types.
+    """
+    sink = SINKS[format](base_path, dataset, name, timestamp_column)
+    if overwrite:
+        sink.remove()
+    if columns is not None:
+        return ColumnarWriter(
+            sink, columns, batch_size=batch_size, on_flush=on_flush, types=types
+        )
+    return BufferedWriter(sink, batch_size=batch_size, on_flush=on_flush)
+
+
+def open_sink(base_path, dataset, name, format="parquet", timestamp_column=None):
+    """
+    Open a sink for reading back one celebrity's dataset
+    """
+    return SINKS[format](base_path, dataset, name, timestamp_column)
+
+
+def find_sink(base_path, dataset, name, timestamp_column=None):
+    """
+    Open the existing sink of a dataset, preferring Parquet over legacy CSV
+    """
+    for format in SINKS:
+        sink = open_sink(base_path, dataset, name, format, timestamp_column)
+        if sink.exists():
+            return sink
+    return None
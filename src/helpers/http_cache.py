@@ -0,0 +1,244 @@
+"""
+On-disk cache of the crawlers' JSON API responses, shared by every crawler.
+
+Entries are keyed by the URL and the sorted query parameters without API keys.
+Each source has its own time to live. Modes:
+- "normal" replays fresh entries and fetches the rest;
+- "refresh" always fetches and stores;
+- "offline" only replays cached entries, however old;
+- "off" bypasses the cache.
+A failed fetch falls back to a stale entry if there is one.
+"""
+
+from urllib.parse import urlencode, urlsplit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+
+from config import CACHE_DATA_PATH
+from helpers.instrumentation import METRICS
+
+HTTP_CACHE_FILE = os.path.join(CACHE_DATA_PATH, "http_cache.sqlite")
+MODES = ["normal", "refresh", "offline", "off"]
+
+# query parameters that never become part of a cache key
+SECRET_PARAMS = {"apikey", "api_key", "key", "token", "access_token"}
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+# seconds a response stays fresh per source, None never expires
+DEFAULT_TTLS = {
+    "gnews": 7 * DAY,
+    "serpapi": 7 * DAY,
+    "youtube_search": 7 * DAY,
+    "youtube_comments": 6 * HOUR,
+    "youtube_stats": 6 * HOUR,
+    "billboard_dates": DAY,
+    # published charts never change
+    "billboard_charts": None,
+}
+DEFAULT_TTL = DAY
+
+
+def make_key(url: str, params: dict = None) -> str:
+    """
+    Hash of the URL and its sorted query parameters, without API keys
+    """
+    items = []
+    for key, value in (params or {}).items():
+        if key.lower() in SECRET_PARAMS or value is None:
+            continue
+        values = value if isinstance(value, (list, tuple)) else [value]
+        items.extend((key, str(value)) for value in values)
+    canonical = f"{url}?{urlencode(sorted(items))}"
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+class HttpCache:
+    """
+    SQLite store of zlib-compressed response bodies, safe to share between threads
+    """
+
+    def __init__(
+        self, file_path: str = HTTP_CACHE_FILE, mode: str = "normal", ttls: dict = None
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode: {mode}")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.file_path = file_path
+        self.mode = mode
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "stale": 0}
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        # many small writes from crawler threads, durability per entry is not needed
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                url TEXT NOT NULL,
+                body BLOB NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            """)
+        self.connection.commit()
+
+    def lookup(self, key: str):
+        """
+        Get the body and fetch time of an entry, None if there is none
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body, fetched_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0]), row[1]
+
+    def store(
+        self, key: str, source: str, url: str, body: bytes, fetched_at: float
+    ) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, source, url, zlib.compress(body, 1), fetched_at),
+            )
+            self.connection.commit()
+            self.stats["stores"] += 1
+
+    def is_fresh(self, source: str, fetched_at: float) -> bool:
+        ttl = self.ttls.get(source, DEFAULT_TTL)
+        return ttl is None or time.time() - fetched_at < ttl
+
+    def get_json(self, source: str, url: str, params: dict, fetch):
+        """
+        Get a JSON response through the cache; fetch is called without
+        arguments on a miss and returns the body bytes of a successful response,
+        or None. Returns None if there is neither a response nor a cached entry.
+        """
+        return self.get_timed_json(source, url, params, fetch)[0]
+
+    def get_timed_json(self, source: str, url: str, params: dict, fetch):
+        """
+        Like get_json, but returns the response and the time it was fetched at,
+        in seconds since the epoch, e.g. to date a cached snapshot; (None, None)
+        if there is neither a response nor a cached entry
+        """
+        if self.mode == "off":
+            fetched_at = time.time()
+            return parse_json(url, fetch()), fetched_at
+
+        key = make_key(url, params)
+        cached = self.lookup(key) if self.mode != "refresh" else None
+        if cached is not None and (
+            self.mode == "offline" or self.is_fresh(source, cached[1])
+        ):
+            with self.lock:
+                self.stats["hits"] += 1
+            return json.loads(cached[0]), cached[1]
+
+        with self.lock:
+            self.stats["misses"] += 1
+        if self.mode == "offline":
+            return None, None
+
+        fetched_at = time.time()
+        body = fetch()
+        data = parse_json(url, body)
+        if data is not None:
+            self.store(key, source, url, body, fetched_at)
+            return data, fetched_at
+
+        if cached is None and self.mode == "refresh":
+            cached = self.lookup(key)
+        if cached is not None:
+            # a stale response beats none, e.g. when the API is down
+            with self.lock:
+                self.stats["stale"] += 1
+            return json.loads(cached[0]), cached[1]
+        return None, None
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def parse_json(url: str, body: bytes):
+    """
+    Parse a response body, None if there is none or it is not JSON
+    """
+    if body is None:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        print(f"Invalid JSON from {url}: {e}")
+        return None
+
+
+http_cache = None
+
+
+def get_http_cache() -> HttpCache:
+    """
+    The cache shared by all crawlers of this process, in the HTTP_CACHE_MODE
+    environment variable's mode if set
+    """
+    global http_cache
+    if http_cache is None:
+        http_cache = HttpCache(mode=os.getenv("HTTP_CACHE_MODE", "normal"))
+    return http_cache
+
+
+def set_http_cache(cache: HttpCache) -> HttpCache:
+    """
+    Replace the shared cache, e.g. with one in another file, returns the previous one
+    """
+    global http_cache
+    previous, http_cache = http_cache, cache
+    return previous
+
+
+def fetch_body(url: str, params: dict = None, session=None, timeout: float = 60):
+    """
+    GET a URL, returns the body of a 200 response and None otherwise
+    """
+    start = time.perf_counter()
+    try:
+        response = (session or requests).get(url, params=params, timeout=timeout)
+    except requests.RequestException as e:
+        elapsed = time.perf_counter() - start
+        METRICS.record_request(urlsplit(url).netloc, elapsed, type(e).__name__)
+        print(f"Request to {url} failed: {e}")
+        return None
+
+    METRICS.record_response(response, time.perf_counter() - start)
+    if response.status_code != 200:
+        print(f"Could not fetch {url}: status {response.status_code}")
+        return None
+    return response.content
+
+
+def cached_get_json(
+    source: str, url: str, params: dict = None, session=None, before_fetch=None
+):
+    """
+    GET a JSON document through the shared cache, None if it is neither
+    available nor cached; before_fetch runs only before an actual request,
+    e.g. to take a rate limiter token
+    """
+
+    def fetch():
+        if before_fetch is not None:
+            before_fetch()
+        return fetch_body(url, params, session)
+
+    return get_http_cache().get_json(source, url, params, fetch)
@@ -0,0 +1,427 @@
+"""
+Run metrics shared by the crawlers and the preprocessing stages:
+- HTTP latency histograms, status codes, retries and bytes per host;
+- the time spent waiting on rate limiters and host slots;
+- the rows per second and peak memory of named stages.
+
+Recording one request or stage is a dictionary update under a lock, cheap
+enough to stay on in production. At the end of a run the summary is written
+as JSON and as a Prometheus textfile.
+"""
+
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+import bisect
+import copy
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# upper bounds in seconds of the request latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PREFIX = "cancel_culture"
+
+
+def get_peak_memory() -> int:
+    """
+    Peak resident memory of the process in bytes, None where unsupported
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Histogram:
+    """
+    Counts of observations per bucket, like a Prometheus histogram
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> list:
+        """
+        Observations up to each bucket bound, the last one is +Inf
+        """
+        total = 0
+        counts = []
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-quantile
+        """
+        if not self.count:
+            return None
+        i = bisect.bisect_left(self.cumulative_counts(), q * self.count)
+        return self.buckets[i] if i < len(self.buckets) else float("inf")
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(
+                zip([*map(str, self.buckets), "+Inf"], self.cumulative_counts())
+            ),
+        }
+
+
+class Stage:
+    """
+    A running stage, rows can be set or added while it runs
+    """
+
+    def __init__(self, metrics: "Metrics", name: str, rows: int = 0):
+        self.metrics = metrics
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record_stage(
+            self.name, time.perf_counter() - self.start, self.rows
+        )
+
+
+class Metrics:
+    """
+    Thread-safe registry of the metrics of one run
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc)
+        self.requests = {}
+        self.waits = {}
+        self.stages = {}
+
+    def record_request(
+        self, host: str, seconds: float, status, n_bytes: int = 0, retries: int = 0
+    ) -> None:
+        """
+        Record one request; status is the HTTP status code or the exception name
+        of a request without a response
+        """
+        with self.lock:
+            metrics = self.requests.get(host)
+            if metrics is None:
+                metrics = self.requests[host] = {
+                    "latency": Histogram(),
+                    "status": {},
+                    "retries": 0,
+                    "bytes": 0,
+                }
+            metrics["latency"].observe(seconds)
+            metrics["status"][str(status)] = metrics["status"].get(str(status), 0) + 1
+            metrics["retries"] += retries
+            metrics["bytes"] += n_bytes
+
+    def record_response(self, response, seconds: float) -> None:
+        """
+        Record a requests response, including the retries urllib3 made for it
+        """
+        retries = getattr(response.raw, "retries", None)
+        self.record_request(
+            urlsplit(response.url).netloc,
+            seconds,
+            response.status_code,
+            len(response.content),
+            len(retries.history) if retries is not None else 0,
+        )
+
+    def record_wait(self, name: str, seconds: float) -> None:
+        """
+        Record time spent waiting, e.g. on a rate limiter
+        """
+        with self.lock:
+            metrics = self.waits.setdefault(name, {"count": 0, "seconds": 0.0})
+            metrics["count"] += 1
+            metrics["seconds"] += seconds
+
+    def record_stage(self, name: str, seconds: float, rows: int = 0) -> None:
+        """
+        Record one run of a stage with the rows it processed
+        """
+        peak_memory = get_peak_memory()
+        with self.lock:
+            metrics = self.stages.setdefault(
+                name, {"calls": 0, "rows": 0, "seconds": 0.0, "peak_memory": None}
+            )
+            metrics["calls"] += 1
+            metrics["rows"] += rows
+            metrics["seconds"] += seconds
+            if peak_memory is not None:
+                metrics["peak_memory"] = max(metrics["peak_memory"] or 0, peak_memory)
+
+    def stage(self, name: str, rows: int = 0) -> Stage:
+        """
+        Time a block of code as a stage, e.g.
+        with METRICS.stage("lemmatize", rows=len(texts)): ...
+        """
+        return Stage(self, name, rows)
+
+    def reset(self) -> None:
+        """
+        Forget the metrics recorded so far, e.g. in a worker process before its
+        next task
+        """
+        with self.lock:
+            self.requests = {}
+            self.waits = {}
+            self.stages = {}
+
+    def snapshot(self) -> dict:
+        """
+        Picklable copy of the recorded metrics, to merge them into the metrics
+        of another process
+        """
+        with self.lock:
+            return copy.deepcopy(
+                {"requests": self.requests, "waits": self.waits, "stages": self.stages}
+            )
+
+    def merge(self, snapshot: dict) -> None:
+        """
+        Add the metrics of a snapshot, e.g. the ones a worker process recorded
+        """
+        with self.lock:
+            for host, metrics in snapshot["requests"].items():
+                if host not in self.requests:
+                    self.requests[host] = copy.deepcopy(metrics)
+                    continue
+                target = self.requests[host]
+                target["latency"].merge(metrics["latency"])
+                for status, count in metrics["status"].items():
+                    target["status"][status] = target["status"].get(status, 0) + count
+                target["retries"] += metrics["retries"]
+                target["bytes"] += metrics["bytes"]
+            for name, metrics in snapshot["waits"].items():
+                target = self.waits.setdefault(name, {"count": 0, "seconds": 0.0})
+                target["count"] += metrics["count"]
+                target["seconds"] += metrics["seconds"]
+            for name, metrics in snapshot["stages"].items():
+                target = self.stages.setdefault(
+                    name, {"calls": 0, "rows": 0, "seconds": 0.0, "peak_memory": None}
+                )
+                for key in ["calls", "rows", "seconds"]:
+                    target[key] += metrics[key]
+                if metrics["peak_memory"] is not None:
+                    target["peak_memory"] = max(
+                        target["peak_memory"] or 0, metrics["peak_memory"]
+                    )
+
+    def summary(self) -> dict:
+        """
+        All metrics of the run so far
+        """
+        with self.lock:
+            elapsed = (datetime.now(timezone.utc) - self.started_at).total_seconds()
+            return {
+                "started_at": self.started_at.isoformat(),
+                "elapsed_seconds": elapsed,
+                "peak_memory": get_peak_memory(),
+                "requests": {
+                    host: {**metrics, "latency": metrics["latency"].to_dict()}
+                    for host, metrics in self.requests.items()
+                },
+                "waits": {name: dict(metrics) for name, metrics in self.waits.items()},
+                "stages": {
+                    name: {
+                        **metrics,
+                        "rows_per_second": (
+                            metrics["rows"] / metrics["seconds"]
+                            if metrics["seconds"]
+                            else None
+                        ),
+                    }
+                    for name, metrics in self.stages.items()
+                },
+            }
+
+    def to_prometheus(self, run: str) -> str:
+        """
+        The summary in the Prometheus text format, every series labeled with the run
+        """
+        summary = self.summary()
+        lines = []
+
+        def add(name, kind, help_text, samples):
+            name = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                labels = {"run": run, **labels}
+                label_text = ",".join(
+                    f'{key}="{escape_label(value)}"' for key, value in labels.items()
+                )
+                lines.append(f"{name}{suffix}{{{label_text}}} {format_value(value)}")
+
+        requests = summary["requests"]
+        add(
+            "http_request_duration_seconds",
+            "histogram",
+            "HTTP request latency including retries.",
+            [
+                ("_bucket", {"host": host, "le": bound}, count)
+                for host, metrics in requests.items()
+                for bound, count in metrics["latency"]["buckets"].items()
+            ]
+            + [
+                (suffix, {"host": host}, metrics["latency"][key])
+                for host, metrics in requests.items()
+                for suffix, key in [("_sum", "sum"), ("_count", "count")]
+            ],
+        )
+        add(
+            "http_responses_total",
+            "counter",
+            "HTTP requests by status code or exception.",
+            [
+                ("", {"host": host, "status": status}, count)
+                for host, metrics in requests.items()
+                for status, count in metrics["status"].items()
+            ],
+        )
+        add(
+            "http_retries_total",
+            "counter",
+            "HTTP retries.",
+            [("", {"host": host}, m["retries"]) for host, m in requests.items()],
+        )
+        add(
+            "http_response_bytes_total",
+            "counter",
+            "HTTP response body bytes.",
+            [("", {"host": host}, m["bytes"]) for host, m in requests.items()],
+        )
+        add(
+            "wait_seconds_total",
+            "counter",
+            "Time spent waiting on rate limiters and host slots.",
+            [("", {"name": n}, m["seconds"]) for n, m in summary["waits"].items()],
+        )
+        for key, kind, help_text in [
+            ("seconds", "counter", "Time spent in the stage."),
+            ("rows", "counter", "Rows processed by the stage."),
+            ("calls", "counter", "Runs of the stage."),
+            ("peak_memory", "gauge", "Peak resident memory in bytes after the stage."),
+        ]:
+            suffix = "_bytes" if key == "peak_memory" else "_total"
+            add(
+                f"stage_{key}{suffix}",
+                kind,
+                help_text,
+                [
+                    ("", {"stage": name}, metrics[key])
+                    for name, metrics in summary["stages"].items()
+                    if metrics[key] is not None
+                ],
+            )
+        add(
+            "run_elapsed_seconds",
+            "gauge",
+            "Duration of the run.",
+            [("", {}, summary["elapsed_seconds"])],
+        )
+        add(
+            "run_finished_timestamp_seconds",
+            "gauge",
+            "Time the summary was written.",
+            [("", {}, time.time())],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write_summary(self, run: str, directory: str) -> str:
+        """
+        Write the summary as {run}.json and {run}.prom into a directory,
+        returns the JSON path
+        """
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, f"{run}.json")
+        for path, content in [
+            (json_path, json.dumps({"run": run, **self.summary()}, indent=2)),
+            (os.path.join(directory, f"{run}.prom"), self.to_prometheus(run)),
+        ]:
+            # textfile collectors must never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        return json_path
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# the metrics of this process
+METRICS = Metrics()
+
+
+def write_run_summary(run: str, directory: str = None) -> str:
+    """
+    Write this process's metrics to the metrics directory and print a summary
+    """
+    if directory is None:
+        from config import METRICS_DATA_PATH
+
+        directory = METRICS_DATA_PATH
+
+    summary = METRICS.summary()
+    for host, metrics in summary["requests"].items():
+        latency = metrics["latency"]
+        print(
+            f"{host}: {latency['count']} requests, mean {latency['mean']:.3f}s, "
+            f"p90 <= {latency['p90']}s, {metrics['retries']} retries, "
+            f"status {metrics['status']}"
+        )
+    for name, metrics in summary["waits"].items():
+        print(f"waiting on {name}: {metrics['seconds']:.1f}s")
+    for name, metrics in summary["stages"].items():
+        rows_per_second = metrics["rows_per_second"] or 0
+        print(
+            f"{name}: {metrics['rows']} rows in {metrics['seconds']:.1f}s "
+            f"({rows_per_second:.0f} rows/s)"
+        )
+
+    json_path = METRICS.write_summary(run, directory)
+    print(f"Metrics saved to {json_path}")
+    return json_path
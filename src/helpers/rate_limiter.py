@@ -0,0 +1,59 @@
+import threading
+import time
+
+from helpers.instrumentation import METRICS
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` requests per second.
+
+    With the default capacity of 1 the requests are spread evenly, so no
+    one-second window ever sees more than `rate` requests.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self) -> None:
+        """
+        Add the tokens earned since the last update, the lock must be held
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1) -> None:
+        """
+        Block until the tokens are available and take them
+        """
+        start = None
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    if start is not None:
+                        METRICS.record_wait("rate_limiter", time.monotonic() - start)
+                    return
+
+                wait = (tokens - self.tokens) / self.rate
+
+            if start is None:
+                start = time.monotonic()
+            time.sleep(wait)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Take the tokens if they are available right now, without blocking
+        """
+        with self.lock:
+            self.refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
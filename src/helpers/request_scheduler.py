@@ -0,0 +1,141 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from helpers.http_cache import get_http_cache, parse_json
+from helpers.instrumentation import METRICS
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class RequestScheduler:
+    """
+    One shared worker pool and keep-alive session for all requests of a crawl.
+
+    Every request holds a slot of its host, so no host ever sees more than its
+    limit of concurrent requests, however many tasks are queued. Failed
+    requests are retried with exponential backoff by the session.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 16,
+        host_limits: dict = None,
+        default_host_limit: int = 8,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 30,
+    ):
+        self.host_limits = host_limits or {}
+        self.default_host_limit = default_host_limit
+        self.timeout = timeout
+        self.host_slots = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "failures": 0}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max(len(self.host_limits), 1),
+            pool_maxsize=max_workers,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=RETRY_STATUS_CODES,
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def get_slots(self, host: str) -> threading.Semaphore:
+        """
+        Get the semaphore limiting the concurrent requests of a host
+        """
+        with self.lock:
+            if host not in self.host_slots:
+                limit = self.host_limits.get(host, self.default_host_limit)
+                self.host_slots[host] = threading.Semaphore(limit)
+            return self.host_slots[host]
+
+    def get_json(self, url: str, params: dict = None, source: str = None) -> dict:
+        """
+        GET a JSON document, an empty dict if it failed after all retries.
+        With a source it goes through the shared HTTP cache under that source's
+        time to live, and a cached response holds no host slot.
+        """
+        if source is None:
+            data = parse_json(url, self.fetch(url, params))
+        else:
+            data = get_http_cache().get_json(
+                source, url, params, lambda: self.fetch(url, params)
+            )
+        return data if data is not None else {}
+
+    def get_timed_json(self, url: str, params: dict = None, source: str = None):
+        """
+        Like get_json, but also returns the time the response was fetched at, in
+        seconds since the epoch; for a cached response the time it was cached
+        """
+        if source is None:
+            fetched_at = time.time()
+            data = parse_json(url, self.fetch(url, params))
+        else:
+            data, fetched_at = get_http_cache().get_timed_json(
+                source, url, params, lambda: self.fetch(url, params)
+            )
+        return (data if data is not None else {}), fetched_at
+
+    def fetch(self, url: str, params: dict = None) -> bytes:
+        """
+        GET the body of a successful response, None if it failed after all retries
+        """
+        host = urlsplit(url).netloc
+        waiting = time.perf_counter()
+        with self.get_slots(host):
+            start = time.perf_counter()
+            METRICS.record_wait("host_slot", start - waiting)
+            with self.lock:
+                self.stats["requests"] += 1
+            response = None
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                METRICS.record_response(response, time.perf_counter() - start)
+                response.raise_for_status()
+                return response.content
+            except requests.RequestException as e:
+                if response is None:
+                    elapsed = time.perf_counter() - start
+                    METRICS.record_request(host, elapsed, type(e).__name__)
+                print(f"Request to {url} failed: {e}")
+                with self.lock:
+                    self.stats["failures"] += 1
+                return None
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Run a task on the shared worker pool
+        """
+        return self.executor.submit(function, *args, **kwargs)
+
+    def map(self, function, items) -> list:
+        """
+        Run a task per item on the shared worker pool and wait for the results.
+        Only call it from outside the pool, a waiting task would block a worker.
+        """
+        futures = [self.submit(function, item) for item in items]
+        return [future.result() for future in futures]
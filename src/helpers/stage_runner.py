@@ -0,0 +1,305 @@
+"""
+Make-like runner of pipeline stages. Every node declares the files it reads and
+writes, the code it runs and its parameters; a node depends on the nodes that
+write its inputs. The fingerprint of a node hashes the size and modification
+time of its inputs, the content of its code files and its parameters, and the
+fingerprint of its last successful run is kept in a state file, so a node only
+runs again if one of them changed or an output is missing. Nodes whose
+dependencies are done run concurrently in a process pool.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+import functools
+import hashlib
+import json
+import os
+import time
+
+from helpers.instrumentation import METRICS
+
+
+class Node:
+    """
+    One stage of the pipeline, task(**kwargs) runs it in a worker process.
+    Nodes of the same exclusive group never run at the same time, e.g. crawlers
+    sharing an API rate limit. With resume_kwarg, the task of a node that was
+    interrupted with the same fingerprint gets resume_kwarg=True, so it can
+    continue instead of starting over.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        task,
+        kwargs: dict = None,
+        inputs: list = (),
+        outputs: list = (),
+        code: list = (),
+        params: dict = None,
+        exclusive: str = None,
+        resume_kwarg: str = None,
+    ):
+        self.name = name
+        self.task = task
+        self.kwargs = kwargs or {}
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = list(code)
+        self.params = params or {}
+        self.exclusive = exclusive
+        self.resume_kwarg = resume_kwarg
+
+    def __repr__(self):
+        return f"Node({self.name!r})"
+
+
+def path_fingerprint(path: str):
+    """
+    Size and modification time of a file, or of every file below a directory;
+    None for a missing path
+    """
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+    if not os.path.isdir(path):
+        return None
+
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(names):
+            stat = os.stat(os.path.join(root, file_name))
+            relative_path = os.path.relpath(os.path.join(root, file_name), path)
+            files.append([relative_path, stat.st_size, stat.st_mtime_ns])
+    return files
+
+
+@functools.cache
+def file_digest(path: str) -> str:
+    """
+    Content hash of a code or resource file, once per process
+    """
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def fingerprint(node: Node) -> str:
+    """
+    Hash of everything a node's outputs are derived from
+    """
+    description = {
+        "inputs": {path: path_fingerprint(path) for path in node.inputs},
+        "code": {
+            os.path.basename(path): file_digest(path) if os.path.exists(path) else None
+            for path in node.code
+        },
+        "params": node.params,
+    }
+    text = json.dumps(description, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def load_state(state_path: str) -> dict:
+    """
+    Load the fingerprints of the previous runs
+    """
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, "r") as f:
+        return json.load(f)
+
+
+def save_state(state_path: str, state: dict) -> None:
+    """
+    Atomically save the fingerprints
+    """
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def get_dependencies(nodes: list) -> dict:
+    """
+    Names of the nodes writing each node's inputs
+    """
+    writers = {}
+    for node in nodes:
+        for path in node.outputs:
+            if path in writers:
+                raise ValueError(
+                    f"{path} is written by {writers[path]} and {node.name}"
+                )
+            writers[path] = node.name
+
+    return {
+        node.name: sorted(
+            {writers[path] for path in node.inputs if path in writers} - {node.name}
+        )
+        for node in nodes
+    }
+
+
+def topological_order(nodes: list, dependencies: dict) -> list:
+    """
+    Nodes sorted so that each comes after its dependencies, keeping the given
+    order otherwise
+    """
+    by_name = {node.name: node for node in nodes}
+    order = []
+    visiting = set()
+    done = set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Cycle in the stage graph at {name}")
+        visiting.add(name)
+        for dependency in dependencies[name]:
+            visit(dependency)
+        visiting.discard(name)
+        done.add(name)
+        order.append(by_name[name])
+
+    for node in nodes:
+        visit(node.name)
+    return order
+
+
+def is_stale(node: Node, state: dict, node_fingerprint: str) -> bool:
+    """
+    Whether a node has to run: it never finished with this fingerprint, or one
+    of its outputs is gone
+    """
+    previous = state.get(node.name)
+    if previous is None or not previous["complete"]:
+        return True
+    if previous["fingerprint"] != node_fingerprint:
+        return True
+    return not all(os.path.exists(path) for path in node.outputs)
+
+
+def has_inputs(node: Node) -> bool:
+    """
+    Whether any input of a node exists; a node without declared inputs always can run
+    """
+    return not node.inputs or any(os.path.exists(path) for path in node.inputs)
+
+
+def run_task(task, kwargs: dict) -> tuple:
+    """
+    Run a node's task in a worker, returns its duration and the metrics it
+    recorded, as the worker's METRICS never reach the summary of the run
+    """
+    # a worker process runs one task after another
+    METRICS.reset()
+    start = time.perf_counter()
+    task(**kwargs)
+    return time.perf_counter() - start, METRICS.snapshot()
+
+
+def run_nodes(
+    nodes: list,
+    state_path: str,
+    max_workers: int = None,
+    force: bool = False,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Run the stale nodes, each as soon as its dependencies are done, and return
+    the status of every node: "fresh", "done", "missing" if none of its inputs
+    exist, "failed", "blocked" or, for a dry run, "stale". A node is checked
+    only once its dependencies are done, as their outputs are its inputs. A node
+    that fails blocks the nodes depending on it, the others keep running.
+    """
+    dependencies = get_dependencies(nodes)
+    order = topological_order(nodes, dependencies)
+    state = load_state(state_path)
+    status = {}
+
+    if dry_run:
+        for node in order:
+            upstream_stale = any(
+                status[name] == "stale" for name in dependencies[node.name]
+            )
+            if not upstream_stale and not has_inputs(node):
+                status[node.name] = "missing"
+                continue
+            stale = force or upstream_stale or is_stale(node, state, fingerprint(node))
+            status[node.name] = "stale" if stale else "fresh"
+        return status
+
+    running = {}
+    started = set()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while len(status) < len(order):
+            busy = {node.exclusive for node, _ in running.values() if node.exclusive}
+            for node in order:
+                if node.name in status or node.name in started:
+                    continue
+                upstream = [status.get(name) for name in dependencies[node.name]]
+                if any(value in ("failed", "blocked") for value in upstream):
+                    status[node.name] = "blocked"
+                    print(f"[{node.name}] blocked by a failed dependency")
+                    continue
+                if not all(value in ("fresh", "done", "missing") for value in upstream):
+                    continue
+                if not has_inputs(node):
+                    status[node.name] = "missing"
+                    continue
+
+                node_fingerprint = fingerprint(node)
+                if not force and not is_stale(node, state, node_fingerprint):
+                    status[node.name] = "fresh"
+                    continue
+                if node.exclusive and node.exclusive in busy:
+                    continue
+
+                kwargs = dict(node.kwargs)
+                if node.resume_kwarg is not None:
+                    previous = state.get(node.name, {})
+                    kwargs[node.resume_kwarg] = (
+                        not force
+                        and previous.get("fingerprint") == node_fingerprint
+                        and not previous.get("complete", True)
+                    )
+                state[node.name] = {"fingerprint": node_fingerprint, "complete": False}
+                save_state(state_path, state)
+
+                print(f"[{node.name}] running")
+                future = executor.submit(run_task, node.task, kwargs)
+                running[future] = (node, node_fingerprint)
+                started.add(node.name)
+                if node.exclusive:
+                    busy.add(node.exclusive)
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node, node_fingerprint = running.pop(future)
+                try:
+                    seconds, metrics = future.result()
+                except Exception as e:
+                    status[node.name] = "failed"
+                    print(f"[{node.name}] failed: {e!r}")
+                    continue
+
+                METRICS.merge(metrics)
+                METRICS.record_stage(f"node.{node.name}", seconds)
+                status[node.name] = "done"
+                # the outputs are fingerprinted after the run, as inputs of later nodes
+                state[node.name] = {
+                    "fingerprint": node_fingerprint,
+                    "complete": True,
+                    "finished_at": datetime.now(timezone.utc).isoformat(),
+                    "seconds": round(seconds, 3),
+                }
+                save_state(state_path, state)
+                print(f"[{node.name}] done in {seconds:.1f}s")
+
+    return status
@@ -1,2 +1,145 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "analysis")
+)
+from config import get_celebrities
+
+
+def preprocess(args):
+    """
+    Run the streaming preprocessing pipeline for the selected celebrities and sources
+    """
+    from helpers.instrumentation import write_run_summary
+    from preprocessing_pipeline import preprocess_file
+    from translation_cache import TranslationCache
+
+    cache = TranslationCache()
+    for name in args.celebrity or get_celebrities()["name"]:
+        for source in args.source:
+            preprocess_file(
+                name,
+                source,
+                chunk_size=args.chunk_size,
+                n_process=args.n_process,
+                cache=cache,
+                restart=args.restart,
+                duplicate_threshold=args.duplicate_threshold,
+            )
+    print(cache.stats())
+    write_run_summary("preprocess")
+
+
+def run(args):
+    """
+    Run the stale stages of the selected celebrities, celebrities in parallel
+    """
+    from helpers.instrumentation import write_run_summary
+    from helpers.stage_runner import run_nodes
+    from pipeline_stages import STATE_FILE, build_nodes
+
+    nodes = build_nodes(
+        args.celebrity or get_celebrities()["name"].tolist(),
+        sources=args.source,
+        crawl=args.crawl or args.refresh_crawl,
+        chunk_size=args.chunk_size,
+        n_process=args.n_process,
+        months_before=args.months_before,
+        months_after=args.months_after,
+        refresh_crawl=args.refresh_crawl,
+    )
+    status = run_nodes(
+        nodes,
+        STATE_FILE,
+        max_workers=args.max_workers,
+        force=args.force,
+        dry_run=args.dry_run,
+    )
+    for name, node_status in status.items():
+        print(f"{node_status:>8}  {name}")
+    if not args.dry_run:
+        write_run_summary("run")
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line arguments
+    """
+    parser = argparse.ArgumentParser(description="Cancel culture impact pipeline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    preprocess_parser = subparsers.add_parser(
+        "preprocess", help="emoji -> translate -> stopwords -> lemma in chunks"
+    )
+    preprocess_parser.add_argument(
+        "--celebrity", action="append", help="celebrity name from config.json"
+    )
+    preprocess_parser.add_argument(
+        "--source",
+        action="append",
+        choices=["youtube_comments", "articles"],
+        help="raw source to preprocess (default: all)",
+    )
+    preprocess_parser.add_argument("--chunk-size", type=int, default=5000)
+    preprocess_parser.add_argument("--n-process", type=int, default=1)
+    preprocess_parser.add_argument(
+        "--restart", action="store_true", help="ignore progress of an interrupted run"
+    )
+    preprocess_parser.add_argument(
+        "--duplicate-threshold",
+        type=float,
+        help="similarity above which rows are near-duplicates (default per source)",
+    )
+    preprocess_parser.set_defaults(func=preprocess)
+
+    run_parser = subparsers.add_parser(
+        "run", help="crawl -> preprocess -> score -> event study, only stale stages"
+    )
+    run_parser.add_argument(
+        "--celebrity", action="append", help="celebrity name from config.json"
+    )
+    run_parser.add_argument(
+        "--source",
+        action="append",
+        choices=["youtube_comments", "articles"],
+        help="text source to preprocess and score (default: all)",
+    )
+    run_parser.add_argument(
+        "--crawl",
+        action="store_true",
+        help="also crawl YouTube and GNews, at most once a day",
+    )
+    run_parser.add_argument(
+        "--refresh-crawl",
+        action="store_true",
+        help="crawl again even if the crawlers already ran today",
+    )
+    run_parser.add_argument(
+        "--force", action="store_true", help="run all stages, even up-to-date ones"
+    )
+    run_parser.add_argument(
+        "--dry-run", action="store_true", help="only list the stale stages"
+    )
+    run_parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=os.cpu_count(),
+        help="stages running in parallel",
+    )
+    run_parser.add_argument("--chunk-size", type=int, default=5000)
+    run_parser.add_argument("--n-process", type=int, default=1)
+    run_parser.add_argument("--months-before", type=int, default=6)
+    run_parser.add_argument("--months-after", type=int, default=6)
+    run_parser.set_defaults(func=run)
+
+    args = parser.parse_args(argv)
+    if args.command in ("preprocess", "run") and not args.source:
+        args.source = ["youtube_comments", "articles"]
+    return args
+
+
 if __name__ == "__main__":
-    pass
+    args = parse_args()
+    args.func(args)